@@ -0,0 +1,375 @@
+"""Benchmark and crash-recovery suite for utils/file_priority_queue.py.
+
+Measures push/pop/peek throughput and latency percentiles at several queue depths
+and settings, and the time (and correctness) of reopening a queue whose process was
+killed at each of its write points. Results are written as JSON so runs can be compared.
+
+    python benchmarks/queue_benchmark.py --output queue_benchmark.json
+    python benchmarks/queue_benchmark.py --sizes 1000 10000 --ops 200 --recovery-size 2000
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUEUE_MODULE_PATH = os.path.join(REPO_ROOT, "utils", "file_priority_queue.py")
+
+# Exit code of a child that was killed on purpose at a write point
+KILLED = 137
+
+# Items look like the worker's: an aware end_date and an ObjectId-sized hex id
+BASE_TIME = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def priority(n):
+    return BASE_TIME + timedelta(seconds=n)
+
+
+def item_id(n):
+    return f"{n:024x}"
+
+
+def load_queue_class():
+    """Load the queue module straight from its file.
+
+    Importing it through the utils package would also import the models and
+    connect to MongoDB, which the benchmark does not need.
+    """
+    spec = importlib.util.spec_from_file_location("file_priority_queue", QUEUE_MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+queue_module = load_queue_class()
+FilePriorityQueue = queue_module.FilePriorityQueue
+CODECS = {
+    "pickle": queue_module.PickleCodec,
+    "binary": queue_module.BinaryCodec,
+}
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def summarize(op, samples, elapsed, config):
+    return {
+        **config,
+        "op": op,
+        "ops": len(samples),
+        "ops_per_sec": len(samples) / elapsed if elapsed else None,
+        "p50_ms": percentile(samples, 0.50) * 1000 if samples else None,
+        "p99_ms": percentile(samples, 0.99) * 1000 if samples else None,
+        "max_ms": max(samples) * 1000 if samples else None,
+    }
+
+
+def open_queue(directory, config, **kwargs):
+    return FilePriorityQueue(
+        directory=directory,
+        max_memory_items=config["max_memory_items"],
+        flush_threshold=config["flush_threshold"],
+        storage_mode=config["storage_mode"],
+        keyed=config.get("keyed", False),
+        codec=CODECS[config.get("codec", "pickle")](),
+        **kwargs)
+
+
+def fill(queue, size, batch_size, start=0):
+    """Fill the queue in batches the size of its memory buffer, like a steady producer would."""
+    for batch_start in range(start, start + size, batch_size):
+        batch_end = min(batch_start + batch_size, start + size)
+        # Spread priorities so pops come from both the buffer and the chunks
+        queue.push_many((priority((i * 7919) % (size * 2)), item_id(i))
+                        for i in range(batch_start, batch_end))
+
+
+def directory_size(directory):
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(directory) for filename in filenames)
+
+
+def timed(fn, count):
+    samples = []
+    started = time.perf_counter()
+    for i in range(count):
+        op_started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - op_started)
+    return samples, time.perf_counter() - started
+
+
+def run_throughput(config, size, ops):
+    """Measure single-operation latency against a queue already holding `size` items."""
+    directory = tempfile.mkdtemp(prefix="queue_bench_")
+    results = []
+    try:
+        queue = open_queue(directory, config)
+        fill_started = time.perf_counter()
+        fill(queue, size, config["max_memory_items"])
+        fill_seconds = time.perf_counter() - fill_started
+        base = {**config, "size": size, "fill_seconds": fill_seconds,
+                "disk_bytes": directory_size(directory)}
+
+        samples, elapsed = timed(lambda i: queue.push(priority(i % (size * 2)), item_id(size + i)), ops)
+        results.append(summarize("push", samples, elapsed, base))
+
+        samples, elapsed = timed(lambda i: queue.peek(), ops)
+        results.append(summarize("peek", samples, elapsed, base))
+
+        samples, elapsed = timed(lambda i: queue.pop(), ops)
+        results.append(summarize("pop", samples, elapsed, base))
+
+        del queue
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+# ---------------------------------------------------------------------- crash recovery
+
+def _crash_child(directory, config, operation, kill_point, write_number):
+    """Open the queue, arm a kill at the given write, and run the operation."""
+    queue = open_queue(directory, config)
+    writes = {"count": 0}
+
+    safe_write_bytes = queue._safe_write_bytes
+
+    def crashing_write(payload, filepath, temp_filepath=None):
+        writes["count"] += 1
+        if writes["count"] != write_number:
+            return safe_write_bytes(payload, filepath, temp_filepath)
+        if kill_point == "after_rename":
+            safe_write_bytes(payload, filepath, temp_filepath)
+        else:
+            # Temp file fully written, replace not done yet (what the temp/lock files recover from)
+            temp_path = temp_filepath or f"{filepath}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+        os._exit(KILLED)
+
+    append_wal = getattr(queue, "_append_wal", None)
+
+    def torn_append(record):
+        writes["count"] += 1
+        if writes["count"] != write_number:
+            return append_wal(record)
+        # Half a record reaches the log before the process dies
+        append_wal(record)
+        queue._wal_file.flush()
+        position = queue._wal_file.tell()
+        queue._wal_file.truncate(position - 1)
+        queue._wal_file.flush()
+        os._exit(KILLED)
+
+    if kill_point == "torn_log":
+        queue._append_wal = torn_append
+    else:
+        queue._safe_write_bytes = crashing_write
+
+    OPERATIONS[operation](queue)
+    # The armed write was never reached
+    os._exit(0)
+
+
+def _push_to_consolidate(queue):
+    # Fill the memory buffer so this push also writes a chunk, the buffer and the index
+    missing = queue.max_memory_items - len(queue.buffer)
+    queue.push_many((priority(10 ** 9 + i), item_id(10 ** 9 + i)) for i in range(max(1, missing)))
+
+
+def _pop_from_chunk(queue):
+    # The template is filled in whole buffers, so the buffer is empty and this pop rewrites a chunk
+    queue.pop()
+
+
+OPERATIONS = {
+    "push": _push_to_consolidate,
+    "pop": _pop_from_chunk,
+}
+
+
+def build_queue(config, size):
+    """Create a queue holding `size` items in whole chunks and close it cleanly.
+
+    The index stores absolute chunk paths, so every crash run builds its own queue
+    instead of copying a template directory.
+    """
+    scratch = tempfile.mkdtemp(prefix="queue_bench_crash_")
+    directory = os.path.join(scratch, "queue")
+    queue = open_queue(directory, config)
+    fill(queue, size, config["max_memory_items"])
+    queue.checkpoint()
+    del queue
+    return scratch, directory
+
+
+def count_writes(config, size, operation, kill_point):
+    """Run the operation on a fresh queue and count the write points it goes through."""
+    scratch, directory = build_queue(config, size)
+    try:
+        queue = open_queue(directory, config)
+        counter = {"count": 0}
+        attribute = "_append_wal" if kill_point == "torn_log" else "_safe_write_bytes"
+        original = getattr(queue, attribute)
+
+        def counting(*args, **kwargs):
+            counter["count"] += 1
+            return original(*args, **kwargs)
+
+        setattr(queue, attribute, counting)
+        OPERATIONS[operation](queue)
+        del queue
+        return counter["count"]
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def sample_points(count, limit):
+    """Pick at most `limit` write numbers out of 1..count, always keeping the first and last."""
+    if count <= limit:
+        return list(range(1, count + 1))
+    step = (count - 1) / (limit - 1)
+    return sorted({1 + int(round(i * step)) for i in range(limit)})
+
+
+def run_recovery(config, size, points_per_kind):
+    """Kill a queue process at the write points of a push and a pop and time the reopen."""
+    # Whole buffers only, so every item sits in a chunk and the pop rewrites one
+    size = max(size - size % config["max_memory_items"], config["max_memory_items"])
+
+    kill_points = ["before_rename", "after_rename"]
+    if config["storage_mode"] == "wal":
+        kill_points.append("torn_log")
+
+    results = []
+    for operation in OPERATIONS:
+        for kill_point in kill_points:
+            writes = count_writes(config, size, operation, kill_point)
+            for write_number in sample_points(writes, points_per_kind):
+                results.append(_recover_once(config, size, operation, kill_point, write_number))
+    return results
+
+
+def _recover_once(config, size, operation, kill_point, write_number):
+    scratch, directory = build_queue(config, size)
+    try:
+        child = multiprocessing.get_context("fork").Process(
+            target=_crash_child, args=(directory, config, operation, kill_point, write_number))
+        child.start()
+        child.join()
+
+        started = time.perf_counter()
+        queue = open_queue(directory, config)
+        recovery_seconds = time.perf_counter() - started
+
+        size_after = queue.size()
+        drained = []
+        while True:
+            item = queue.pop()
+            if item is None:
+                break
+            drained.append(item)
+        ordered = all(drained[i][0] <= drained[i + 1][0] for i in range(len(drained) - 1))
+        values = [value for _, value in drained]
+
+        # Nothing may be lost or duplicated. A killed pop may or may not have removed its
+        # item; a killed batch push keeps none, all or (WAL) a prefix of its items.
+        if operation == "push":
+            size_ok = size <= size_after <= size + config["max_memory_items"]
+        else:
+            size_ok = size_after in (size - 1, size)
+        consistent = (size_ok and len(drained) == size_after
+                      and ordered and len(values) == len(set(values)))
+        del queue
+
+        return {
+            **config,
+            "size": size,
+            "operation": operation,
+            "kill_point": kill_point,
+            "write_number": write_number,
+            "killed": child.exitcode == KILLED,
+            "recovery_seconds": recovery_seconds,
+            "size_after_recovery": size_after,
+            "consistent": consistent,
+        }
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 100000, 1000000],
+                        help="queue depths to measure at")
+    parser.add_argument("--ops", type=int, default=1000,
+                        help="operations timed per op type and configuration")
+    parser.add_argument("--max-memory-items", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--flush-threshold", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--storage-modes", nargs="+", default=["snapshot", "wal"])
+    parser.add_argument("--codecs", nargs="+", default=["pickle", "binary"], choices=sorted(CODECS))
+    parser.add_argument("--recovery-size", type=int, default=10000,
+                        help="items in the queue for the crash-recovery runs (0 to skip)")
+    parser.add_argument("--recovery-points", type=int, default=5,
+                        help="write points killed per operation and kill kind")
+    parser.add_argument("--output", default="queue_benchmark.json")
+    args = parser.parse_args(argv)
+
+    configs = [
+        {"storage_mode": mode, "max_memory_items": memory, "flush_threshold": threshold,
+         "codec": codec}
+        for mode in args.storage_modes
+        for codec in args.codecs
+        for memory in args.max_memory_items
+        for threshold in args.flush_threshold
+    ]
+
+    report = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "throughput": [],
+        "recovery": [],
+    }
+
+    for config in configs:
+        for size in args.sizes:
+            print(f"throughput {config} size={size}", flush=True)
+            report["throughput"].extend(run_throughput(config, size, args.ops))
+
+    if args.recovery_size:
+        # flush_threshold does not change what is written, so one value is enough here
+        for config in configs:
+            if config["flush_threshold"] != args.flush_threshold[0]:
+                continue
+            print(f"recovery {config} size={args.recovery_size}", flush=True)
+            report["recovery"].extend(run_recovery(
+                config, args.recovery_size, args.recovery_points))
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    failures = [run for run in report["recovery"] if not run["consistent"]]
+    print(f"Wrote {args.output}: {len(report['throughput'])} throughput rows, "
+          f"{len(report['recovery'])} recovery runs, {len(failures)} inconsistent")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -34,6 +34,15 @@ env_variables = {
         'client_x509_cert_url': os.getenv('FIREBASE_CLIENT_CERT_URL')
     },
     'AUTH_API_KEY': os.getenv('AUTH_API_KEY', "default_AUTH_api_key"),
+    'QUEUE_BACKEND': os.getenv('QUEUE_BACKEND', "file"),
+    'CONNECTION_WORKERS': os.getenv('CONNECTION_WORKERS', "8"),
+    'WORKER_PROCESSES': os.getenv('WORKER_PROCESSES', "1"),
+    # "index/count" of the owner partition a worker process handles; set by the supervisor
+    'WORKER_PARTITION': os.getenv('WORKER_PARTITION', ""),
+    # "threads" (default) or "asyncio" (needs motor, see utils/async_worker.py)
+    'WORKER_MODE': os.getenv('WORKER_MODE', "threads"),
+    # Connections an asyncio worker keeps leased, loading or executing at once
+    'ASYNC_MAX_IN_FLIGHT': os.getenv('ASYNC_MAX_IN_FLIGHT', "512"),
 }
 
 if env_variables['DEV'] == "true":
@@ -1,18 +1,21 @@
 import threading
+import subprocess
+import time
 
 from datetime import datetime
 from fastapi import FastAPI
 from pytz import UTC
-from models import MONGO_HOST
+from models import MONGO_HOST, backfill_owner_buckets
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse
 from routes import subjects, components, auth, dataTransfers, connection, widget, notifications , profile, categories , templets , settings , ai_message , home 
 import os
 import logging
 from mongoengine import connect, disconnect
-from consts import firebase_urls
+from consts import firebase_urls, env_variables
 import sys
-from utils.connections import listen_for_connection_changes, load_pending_connections, execute_due_connections, periodic_sync_connections
+from utils.connections import listen_for_connection_changes, execute_due_connections, periodic_sync_connections, reap_stale_claims, get_connection_queue
+from utils.async_worker import run_async_worker
 
 # Set up logging
 logging.basicConfig(level=logging.INFO,
@@ -40,20 +43,63 @@ def run_worker():
     else:
         connect(db="Cluster0", host=MONGO_HOST, port=27017)
 
-    # Initial load
-    load_pending_connections()
+    if env_variables['WORKER_MODE'] == "asyncio":
+        # Listener, sync, reaper and executor share one event loop and one motor client;
+        # the connection above is what transfers write through
+        run_async_worker()
+        return
+    if env_variables['WORKER_MODE'] != "threads":
+        raise ValueError(f"Unknown WORKER_MODE '{env_variables['WORKER_MODE']}', expected 'threads' or 'asyncio'")
 
-    # Start change stream listener in a thread
+    # Only the worker opens the queue files; open them before any thread uses them
+    get_connection_queue()
+
+    # Start change stream listener in a thread; it loads pending connections itself
+    # once the stream is open, so nothing between the scan and the stream is missed
     listener_thread = threading.Thread(target=listen_for_connection_changes, daemon=True)
     listener_thread.start()
 
     sync_thread = threading.Thread(target=periodic_sync_connections, daemon=True)
     sync_thread.start()
+
+    reaper_thread = threading.Thread(target=reap_stale_claims, daemon=True)
+    reaper_thread.start()
     logger.info("Worker process started, listening for connection changes...")
     # Start execution loop
     execute_due_connections()
 
 
+def run_supervisor(processes):
+    """Run one worker process per owner partition, restarting any that exits."""
+    logger.info(f"Starting Planitly worker supervisor with {processes} partitions")
+    # Partitions select connections by owner_bucket; give older connections one first
+    updated = backfill_owner_buckets()
+    if updated:
+        logger.info(f"Set owner_bucket on {updated} existing connections")
+
+    def spawn(index):
+        env = dict(os.environ, WORKER_PARTITION=f"{index}/{processes}")
+        child = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        child_pids.append(child.pid)
+        logger.info(f"Started worker partition {index}/{processes} (pid {child.pid})")
+        return child
+
+    children = {index: spawn(index) for index in range(processes)}
+    try:
+        while True:
+            time.sleep(5)
+            for index, child in children.items():
+                if child.poll() is not None:
+                    logger.error(f"Worker partition {index} exited with code {child.returncode}, restarting")
+                    child_pids.remove(child.pid)
+                    children[index] = spawn(index)
+    finally:
+        for child in children.values():
+            child.terminate()
+        for child in children.values():
+            child.wait()
+
+
 @app.get("/")
 async def welcome():
     return {"message": "Welcome to the Planitly API!"}
@@ -96,5 +142,7 @@ app.include_router(home.router)
 if __name__ == "__main__":
     if is_uvicorn():
         run_server()
+    elif int(env_variables['WORKER_PROCESSES']) > 1 and not env_variables['WORKER_PARTITION']:
+        run_supervisor(int(env_variables['WORKER_PROCESSES']))
     else:
         run_worker()
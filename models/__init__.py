@@ -2,7 +2,7 @@ from .user import User
 from .dataTransfer import DataTransfer_db, DataTransfer
 from .subject import Subject_db, Subject
 from .component import Component_db, Component
-from .connection import Connection_db, Connection
+from .connection import Connection_db, Connection, ConnectionBatch, DeadLetterConnection_db, backfill_owner_buckets, release_stale_claims, record_connection_failure, retry_dead_letter, FAILURE_RETRY, FAILURE_DEAD_LETTER
 from .widget import Widget, Widget_db
 from .todos import Todo_db, Todo
 from .locks import AccountLock
@@ -2,6 +2,7 @@ import mongoengine as me
 from datetime import datetime
 import json
 from pymongo import UpdateOne
+from bson import ObjectId
 from .user import User
 # Removed the Component import from here to avoid circular import
 from mongoengine import Document, StringField, ReferenceField, DateTimeField, DynamicField, IntField
@@ -589,6 +590,81 @@ class Arrays:
         except Exception as e:
             return {"success": False, "message": f"Error appending to array: {e}"}
 
+    @staticmethod
+    def append_many_to_array(user_id, host_id, values, host_type=None, array_name=None, array_id=None):
+        """Append several values in order with one bulk insert; like append_to_array, all or nothing.
+
+        The elements get their ids up front, so when the insert or the length update fails
+        the elements already inserted are deleted again before failing. If even that
+        fails the result has "partial": True and the array must not be appended to again.
+        """
+        try:
+            # Get user by ID
+            user = User.objects(id=user_id).first()
+            if not user:
+                return {"success": False, "message": "User not found"}
+
+            # Get host object, type, and subject
+            host_object, detected_host_type, subject = Arrays._get_host_object(host_id, host_type)
+            if not host_object:
+                return {"success": False, "message": "Invalid host ID"}
+
+            # Get array metadata by name or ID with subject-aware lookup
+            array_metadata = Arrays._get_array_metadata_by_name_or_id(user, host_id, detected_host_type, array_name, array_id, subject)
+            if not array_metadata:
+                identifier = f"ID '{array_id}'" if array_id else f"name '{array_name}'" if array_name else "default array"
+                scope = "subject" if subject else "user"
+                return {"success": False, "message": f"Array with {identifier} not found for {detected_host_type} '{host_id}' in {scope}"}
+
+            # Check value sizes
+            for value in values:
+                is_valid, error_msg = Arrays._check_value_size(value)
+                if not is_valid:
+                    return {"success": False, "message": error_msg}
+
+            # Check if appending would exceed the maximum array size
+            current_length = array_metadata.length if hasattr(array_metadata, 'length') else ArrayItem_db.objects(
+                user=user, array_metadata=array_metadata).count()
+
+            if current_length + len(values) > Arrays.MAX_ARRAY_SIZE:
+                return {"success": False, "message": f"Cannot append: array size would exceed maximum allowed ({Arrays.MAX_ARRAY_SIZE} elements)"}
+
+            # Get current array length
+            last_element = ArrayItem_db.objects(
+                user=user, array_metadata=array_metadata).order_by('-index').first()
+            first_index = 0 if last_element is None else last_element.index + 1
+
+            # Insert new elements, then update length in array metadata
+            elements = [
+                ArrayItem_db(id=ObjectId(), user=user, array_metadata=array_metadata,
+                             index=first_index + offset, value=value)
+                for offset, value in enumerate(values)
+            ]
+            try:
+                if elements:
+                    ArrayItem_db.objects.insert(elements, load_bulk=False)
+                array_metadata.length = first_index + len(values)
+                array_metadata.save()
+            except Exception as e:
+                # An ordered insert stops at the first error with the ones before it stored
+                try:
+                    ArrayItem_db.objects(id__in=[element.id for element in elements]).delete()
+                except Exception as rollback_error:
+                    return {"success": False, "partial": True,
+                            "message": f"Error appending to array: {e}; rolling back failed: {rollback_error}"}
+                raise
+
+            return {
+                "success": True,
+                "message": f"{len(values)} values appended to array '{array_metadata.name}' for {detected_host_type} '{host_id}'",
+                "host_type": detected_host_type,
+                "subject_id": str(subject.id) if subject else None,
+                "array_name": array_metadata.name,
+                "array_id": str(array_metadata.id)
+            }
+        except Exception as e:
+            return {"success": False, "message": f"Error appending to array: {e}"}
+
     @staticmethod
     def delete_array(user_id, host_id, host_type=None, array_name=None, array_id=None):
         """Delete an entire array with smart host detection and subject-aware lookup."""
@@ -1,10 +1,36 @@
-from .component import Component, PREDEFINED_COMPONENT_TYPES
+from .component import Component, Component_db, PREDEFINED_COMPONENT_TYPES
 from .subject import Subject, Subject_db
-from .dataTransfer import DataTransfer_db, DataTransfer
+from .dataTransfer import DataTransfer_db, DataTransfer, insert_all_or_none
+import time
 import uuid
-from mongoengine import Document, StringField, DictField, ReferenceField, ListField, DateTimeField, NULLIFY, BooleanField
+import zlib
+from mongoengine import Document, StringField, DictField, ReferenceField, ListField, DateTimeField, NULLIFY, BooleanField, IntField
 from mongoengine.errors import DoesNotExist
-from datetime import datetime, timezone
+from mongoengine.context_managers import no_dereference
+from datetime import datetime, timezone, timedelta
+
+
+# Owners are hashed into this many buckets; a sharded worker takes the buckets with
+# owner_bucket % worker_count == worker_index, so every owner belongs to exactly one worker
+OWNER_BUCKETS = 1024
+# A claim held longer than this is treated as abandoned (its worker died) and released
+CLAIM_TIMEOUT = timedelta(minutes=10)
+# A connection that failed this many times is moved to the dead-letter collection
+MAX_ATTEMPTS = 5
+# Delay before retry n is RETRY_BASE_DELAY * 2**(n - 1), capped at RETRY_MAX_DELAY
+RETRY_BASE_DELAY = timedelta(seconds=30)
+RETRY_MAX_DELAY = timedelta(hours=1)
+# claim_token of dead-lettered connections: they stay claimed until retried by hand
+DEAD_LETTER_CLAIM = "dead-letter"
+# Outcomes of record_connection_failure()
+FAILURE_RETRY = "retry"
+FAILURE_DEAD_LETTER = "dead-letter"
+FAILURE_CLAIM_LOST = "claim-lost"
+
+
+def owner_bucket(owner):
+    """Stable bucket of an owner id (the same in every process, unlike hash())."""
+    return zlib.crc32(str(owner).encode()) % OWNER_BUCKETS
 
 
 class Connection_db(Document):
@@ -18,7 +44,137 @@ class Connection_db(Document):
     start_date = DateTimeField(required=True)
     end_date = DateTimeField(required=True)
     done = BooleanField(default=False, required=True)
-    meta = {'collection': 'connections'}
+    owner_bucket = IntField()  # owner_bucket(owner), kept up to date on save
+    # Set while a worker executes the connection; only the holder of the token may finish it
+    claim_token = StringField(null=True)
+    claimed_at = DateTimeField(null=True)
+    # Failed executions so far, the last error and when the next attempt is due
+    attempts = IntField(default=0)
+    last_error = StringField(null=True)
+    retry_at = DateTimeField(null=True)
+    # Last change made by a save or by the worker; the periodic sync rescans recent changes
+    updated_at = DateTimeField()
+    meta = {
+        'collection': 'connections',
+        # Range scans of the worker's sync and startup load
+        'indexes': [
+            {'fields': ['done', 'end_date']},
+            {'fields': ['done', 'retry_at']},
+            {'fields': ['done', 'updated_at']},
+        ]
+    }
+
+    def clean(self):
+        self.owner_bucket = owner_bucket(self.owner)
+        self.updated_at = datetime.now(timezone.utc)
+
+
+def claim_connections(conn_ids, token):
+    """Atomically mark the pending, unclaimed connections among conn_ids as running under token.
+
+    Returns the claimed connections' documents (without dereferencing); connections that
+    are done or claimed by another worker are left out and must not be executed.
+    """
+    conn_ids = list(conn_ids)
+    now = datetime.now(timezone.utc)
+    # update() skips clean(); updated_at is what the periodic sync's change scan reads
+    Connection_db.objects(id__in=conn_ids, done=False, claim_token=None).update(
+        set__claim_token=token, set__claimed_at=now, set__updated_at=now)
+    return Connection_db.objects(id__in=conn_ids, claim_token=token).no_dereference()
+
+
+def release_claim(conn_id, token):
+    """Give up a claim so the connection can be executed again."""
+    return Connection_db.objects(id=conn_id, claim_token=token).update_one(
+        unset__claim_token=True, unset__claimed_at=True,
+        set__updated_at=datetime.now(timezone.utc)) > 0
+
+
+def release_stale_claims(query=None, timeout=CLAIM_TIMEOUT):
+    """Release claims older than timeout and return the released connections' (id, end_date).
+
+    query is an optional Q object narrowing the connections looked at.
+    """
+    cutoff = datetime.now(timezone.utc) - timeout
+    stale = Connection_db.objects(done=False, claimed_at__lt=cutoff)
+    if query is not None:
+        stale = stale.filter(query)
+    stale = stale.only('id', 'end_date', 'claim_token').as_pymongo()
+    released = []
+    for doc in stale:
+        # Conditional on the token, so a claim renewed in between is left alone
+        if release_claim(doc['_id'], doc.get('claim_token')):
+            released.append((doc['_id'], doc['end_date']))
+    return released
+
+
+class DeadLetterConnection_db(Document):
+    """A connection that failed MAX_ATTEMPTS times; it is not executed again until retried."""
+    id = StringField(primary_key=True)  # The connection's id
+    owner = StringField(required=True)
+    attempts = IntField(required=True)
+    last_error = StringField(null=True)
+    end_date = DateTimeField()
+    failed_at = DateTimeField(required=True)
+    meta = {'collection': 'dead_letter_connections'}
+
+
+def retry_delay(attempts):
+    """Backoff before the next attempt of a connection that failed attempts times."""
+    return min(RETRY_BASE_DELAY * (2 ** (attempts - 1)), RETRY_MAX_DELAY)
+
+
+def record_connection_failure(conn_id, token, error):
+    """Count a failed execution of a connection claimed with token and give up the claim.
+
+    Returns (outcome, retry_at): (FAILURE_RETRY, the time to retry at),
+    (FAILURE_DEAD_LETTER, None) if it reached MAX_ATTEMPTS and was moved to the
+    dead-letter collection, or (FAILURE_CLAIM_LOST, None) if token no longer holds the
+    claim and nothing was recorded.
+    """
+    connection_db = Connection_db.objects(id=conn_id, claim_token=token).modify(
+        inc__attempts=1, set__last_error=str(error), new=True)
+    if connection_db is None:
+        return FAILURE_CLAIM_LOST, None
+    now = datetime.now(timezone.utc)
+
+    if connection_db.attempts >= MAX_ATTEMPTS:
+        DeadLetterConnection_db(
+            id=connection_db.id,
+            owner=connection_db.owner,
+            attempts=connection_db.attempts,
+            last_error=connection_db.last_error,
+            end_date=connection_db.end_date,
+            failed_at=now
+        ).save()
+        # Parked under a claim no worker holds, so nothing queues or executes it any more
+        Connection_db.objects(id=conn_id, claim_token=token).update_one(
+            set__claim_token=DEAD_LETTER_CLAIM, unset__claimed_at=True, unset__retry_at=True,
+            set__updated_at=now)
+        return FAILURE_DEAD_LETTER, None
+
+    retry_at = now + retry_delay(connection_db.attempts)
+    Connection_db.objects(id=conn_id, claim_token=token).update_one(
+        set__retry_at=retry_at, unset__claim_token=True, unset__claimed_at=True, set__updated_at=now)
+    return FAILURE_RETRY, retry_at
+
+
+def retry_dead_letter(conn_id):
+    """Put a dead-lettered connection back in play with a fresh attempt budget. Returns False if it is not dead-lettered."""
+    released = Connection_db.objects(id=conn_id, claim_token=DEAD_LETTER_CLAIM).update_one(
+        set__attempts=0, unset__claim_token=True, unset__last_error=True, unset__retry_at=True,
+        set__updated_at=datetime.now(timezone.utc))
+    DeadLetterConnection_db.objects(id=conn_id).delete()
+    return released > 0
+
+
+def backfill_owner_buckets():
+    """Set owner_bucket on connections saved before the field existed. Returns how many were updated."""
+    updated = 0
+    for owner in Connection_db.objects(owner_bucket=None).distinct('owner'):
+        updated += Connection_db.objects(owner=owner, owner_bucket=None).update(
+            set__owner_bucket=owner_bucket(owner))
+    return updated
 
 
 def parse_date(date_val):
@@ -53,12 +209,18 @@ class Connection:
         if self.start_date is None or self.end_date is None:
             raise ValueError("start_date and end_date must be provided as timezone-aware ISO strings.")
         self.done = done or False
+        self.error = None
 
     async def add_data_transfer(self, source_component, target_component, data_value, operation, details=None):
+        data_transfer = self.new_data_transfer(source_component, target_component, data_value, operation, details)
+        data_transfer.save_to_db()
+
+    def new_data_transfer(self, source_component, target_component, data_value, operation, details=None):
+        """Attach a data transfer to the connection without storing it (see save_many)."""
         data_transfer = DataTransfer(source_component=source_component, target_component=target_component,
                                      data_value=data_value, operation=operation, details=details, owner=self.owner, schedule_time=self.end_date)
-        data_transfer.save_to_db()
         self.data_transfers.append(data_transfer.id)
+        return data_transfer
 
     def to_json(self):
         return {
@@ -82,22 +244,47 @@ class Connection:
             connection.data_transfers[transfer_id] = data_transfer
         return connection
 
+    def to_db(self):
+        return Connection_db(id=self.id,
+                             source_subject=self.source_subject,
+                             target_subject=self.target_subject,
+                             con_type=self.con_type,
+                             data_transfers=self.data_transfers,
+                             owner=self.owner,
+                             start_date=self.start_date,
+                             end_date=self.end_date,
+                             done=self.done)
+
     def save_to_db(self):
         try:
-            connection_db = Connection_db(id=self.id,
-                                          source_subject=self.source_subject,
-                                          target_subject=self.target_subject,
-                                          con_type=self.con_type,
-                                          data_transfers=self.data_transfers,
-                                          owner=self.owner,
-                                          start_date=self.start_date,
-                                          end_date=self.end_date,
-                                          done=self.done)
-            connection_db.save()
+            self.to_db().save()
         except Exception as e:
             print(f"Error saving connection with ID {self.id} to the database.")
             raise e
 
+    @staticmethod
+    def save_many(connections, transfers=()):
+        """Store new connections and their data transfers with one insert per collection.
+
+        Everything is validated before the first write. The transfers are inserted first
+        so the worker never loads a connection whose transfers are missing; if inserting
+        the connections fails, those it stored and all the transfers are removed again.
+        """
+        docs = [connection.to_db() for connection in connections]
+        for doc in docs:
+            # insert() skips validation; this also runs clean() (owner_bucket, updated_at)
+            doc.validate()
+        transfers = list(transfers)
+        DataTransfer.save_many(transfers)
+        if not docs:
+            return
+        try:
+            insert_all_or_none(Connection_db, docs)
+        except Exception:
+            if transfers:
+                DataTransfer_db.objects(id__in=[transfer.id for transfer in transfers]).delete()
+            raise
+
     @staticmethod
     def load_from_db(conn_id):
         try:
@@ -143,21 +330,236 @@ class Connection:
             done=connection_db.done
         )
 
-    def execute(self):
+    def execute(self, transfers=None, components=None, claim_token=None, on_transfer=None):
+        """Run the connection's data transfers and mark it done. Returns True on success.
+
+        transfers and components are optional identity maps (see ConnectionBatch); without
+        them every transfer and component is fetched on its own. With claim_token (see
+        claim_connections) the connection is only marked done while that claim is held;
+        on failure the claim is kept and the error is left in self.error for the caller
+        to pass to record_connection_failure(). on_transfer(transfer, seconds, result) is called after
+        each transfer runs, e.g. to record its latency.
+        """
         try:
             if self.done:
                 return
-            for data_transfer in self.data_transfers:
-                print(f"Executing data transfer with ID {data_transfer.id}")
-                transfer = DataTransfer.load_from_db(data_transfer.id)
-                if transfer:
-                    if transfer.execute():
-                        print(f"Data transfer with ID {data_transfer.id} executed successfully from connection.")
-                else:
-                    print(f"Data transfer with ID {data_transfer} not found.")
-                    raise Exception(
-                        f"Data transfer with ID {data_transfer} not found.")
-            self.done = True
-            self.save_to_db()
+            for transfer in self.iter_transfers(transfers):
+                started = time.perf_counter()
+                result = transfer.execute(components=components)
+                if on_transfer is not None:
+                    on_transfer(transfer, time.perf_counter() - started, result)
+                if result:
+                    print(f"Data transfer with ID {transfer.id} executed successfully from connection.")
+            self.finish(claim_token)
+            return True
         except Exception as e:
             print(f"Error executing connection with ID {self.id}: {e}")
+            # Kept for the caller, e.g. to record the failure (see record_connection_failure)
+            self.error = e
+            return False
+
+    def iter_transfers(self, transfers=None):
+        """Yield the connection's DataTransfers in order; raises on the first one that does not exist."""
+        for data_transfer in self.data_transfers:
+            print(f"Executing data transfer with ID {data_transfer.id}")
+            if transfers is not None:
+                transfer = transfers.get(data_transfer.id)
+            else:
+                transfer = DataTransfer.load_from_db(data_transfer.id)
+            if not transfer:
+                print(f"Data transfer with ID {data_transfer} not found.")
+                raise Exception(
+                    f"Data transfer with ID {data_transfer} not found.")
+            yield transfer
+
+    def finish(self, claim_token=None):
+        """Mark the connection done; with claim_token only while that claim is still held."""
+        self.done = True
+        if claim_token is None:
+            self.save_to_db()
+        elif not Connection_db.objects(id=self.id, claim_token=claim_token).update_one(
+                set__done=True, unset__claim_token=True, unset__claimed_at=True,
+                set__updated_at=datetime.now(timezone.utc)):
+            print(f"Claim on connection with ID {self.id} was lost before it finished.")
+
+
+class ConnectionBatch:
+    """Connections loaded together with their data transfers and the components those touch.
+
+    Loading costs three queries (connections, transfers, components, each with $in) however
+    many connections and transfers the batch holds; executing through it reads transfers
+    and components from these identity maps instead of fetching them one at a time.
+    Without conn_ids the batch starts empty and is filled from documents the caller
+    fetched itself, e.g. with an async driver.
+    """
+
+    def __init__(self, conn_ids=None, components=None, claim_token=None):
+        self.connections = {}
+        # Connections whose document could not be turned into a Connection: id -> error
+        self.errors = {}
+        self.transfers = {}
+        # Instances passed in are reused as they are, e.g. ones still held by running connections
+        self.components = dict(components or {})
+        # With a claim token only connections this batch claimed are loaded (and executed)
+        self.claim_token = claim_token
+        if conn_ids is None:
+            # Filled by the caller with add_connections(), add_transfers() and add_components()
+            return
+
+        if claim_token is not None:
+            connection_docs = claim_connections(conn_ids, claim_token)
+        else:
+            connection_docs = Connection_db.objects(id__in=list(conn_ids)).no_dereference()
+        self.add_connections(connection_docs)
+
+        transfer_ids = self.transfer_ids()
+        if transfer_ids:
+            self.add_transfers(DataTransfer.load_many(transfer_ids).values())
+
+        missing = self.missing_component_ids()
+        if missing:
+            self.add_components(Component_db.objects(id__in=list(missing)))
+
+    def add_connections(self, connection_docs):
+        """Add Connection_db documents, e.g. built from raw documents with Connection_db._from_son()."""
+        # References stay ids; transfers and components come from the batch's own maps
+        with no_dereference(Connection_db):
+            for connection_db in connection_docs:
+                try:
+                    connection = Connection.from_db(connection_db)
+                except Exception as e:
+                    self.errors[connection_db.id] = e
+                    continue
+                self.connections[connection.id] = connection
+
+    def add_transfers(self, transfers):
+        for transfer in transfers:
+            self.transfers[transfer.id] = transfer
+
+    def add_components(self, components):
+        for component in components:
+            self.components[component.id] = component
+
+    def transfer_ids(self):
+        """Ids of the transfers of the batch's connections that are not loaded yet."""
+        return {ref.id for connection in self.connections.values()
+                for ref in connection.data_transfers
+                if ref is not None and ref.id not in self.transfers}
+
+    def missing_component_ids(self):
+        """Ids of the components the loaded transfers use that are not loaded yet."""
+        return {component_id for transfer in self.transfers.values()
+                for component_id in (transfer.source_component, transfer.target_component)
+                if component_id and component_id not in self.components}
+
+    def connection(self, conn_id):
+        """The batch's Connection for conn_id, or None if it does not exist (or was not claimed)."""
+        if conn_id in self.errors:
+            raise self.errors[conn_id]
+        return self.connections.get(conn_id)
+
+    def _transfers_of(self, conn_id):
+        connection = self.connections.get(conn_id)
+        if not connection:
+            return []
+        return [self.transfers[ref.id] for ref in connection.data_transfers
+                if ref is not None and ref.id in self.transfers]
+
+    def target_ids(self, conn_id):
+        """Ids of the components the connection's transfers write to."""
+        return {transfer.target_component for transfer in self._transfers_of(conn_id)
+                if transfer.target_component}
+
+    def component_ids(self, conn_id):
+        """Ids of the loaded components the connection's transfers read or write."""
+        return {component_id for transfer in self._transfers_of(conn_id)
+                for component_id in (transfer.source_component, transfer.target_component)
+                if component_id in self.components}
+
+    def groups(self, conn_ids):
+        """Split conn_ids into groups of connections linked by shared target components.
+
+        Each group keeps the order of conn_ids. Different groups write different components,
+        so they can run in parallel; a group runs as one unit with execute_many().
+        """
+        conn_ids = list(conn_ids)
+        parent = list(range(len(conn_ids)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        first_writer = {}
+        for i, conn_id in enumerate(conn_ids):
+            for component_id in self.target_ids(conn_id):
+                if component_id in first_writer:
+                    parent[find(i)] = find(first_writer[component_id])
+                else:
+                    first_writer[component_id] = i
+        groups = {}
+        for i, conn_id in enumerate(conn_ids):
+            groups.setdefault(find(i), []).append(conn_id)
+        return list(groups.values())
+
+    def execute_many(self, conn_ids, on_transfer=None):
+        """Execute connections of the batch in order as one unit, folding their transfers.
+
+        The transfers of all of them go through DataTransfer.execute_many(), so e.g. a burst
+        of adds to one component becomes one write. Returns {conn_id: result} with what
+        execute() would return, except that an exception it would raise is the result.
+        """
+        results = {}
+        planned = {}
+        # transfer id -> connections it belongs to; a connection stops at its first failure
+        owners = {}
+        executed = []
+        for conn_id in conn_ids:
+            try:
+                connection = self.connection(conn_id)
+            except Exception as e:
+                results[conn_id] = e
+                continue
+            if not connection or connection.done:
+                results[conn_id] = None
+                continue
+            transfer_ids = []
+            try:
+                for transfer in connection.iter_transfers(self.transfers):
+                    # A transfer shared by two connections runs once, as the second would skip it
+                    planned.setdefault(transfer.id, transfer)
+                    owners.setdefault(transfer.id, []).append(conn_id)
+                    transfer_ids.append(transfer.id)
+            except Exception as e:
+                # Its transfers before the missing one still run, as in execute()
+                print(f"Error executing connection with ID {connection.id}: {e}")
+                connection.error = e
+                results[conn_id] = False
+            executed.append((connection, transfer_ids))
+
+        transfer_results = DataTransfer.execute_many(planned.values(), self.components, on_transfer, owners)
+
+        for connection, transfer_ids in executed:
+            if connection.id in results:
+                continue
+            errors = [transfer_results[transfer_id] for transfer_id in transfer_ids
+                      if isinstance(transfer_results.get(transfer_id), Exception)]
+            try:
+                if errors:
+                    raise errors[0]
+                connection.finish(self.claim_token)
+                results[connection.id] = True
+            except Exception as e:
+                print(f"Error executing connection with ID {connection.id}: {e}")
+                connection.error = e
+                results[connection.id] = False
+        return results
+
+    def execute(self, conn_id, on_transfer=None):
+        """Execute a connection of the batch; returns whether it succeeded, or None if it is not in the batch."""
+        connection = self.connection(conn_id)
+        if not connection:
+            return None
+        return connection.execute(transfers=self.transfers, components=self.components,
+                                  claim_token=self.claim_token, on_transfer=on_transfer)
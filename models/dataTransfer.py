@@ -1,10 +1,18 @@
 from .component import Component_db
 from .arrayItem import Arrays
 from mongoengine import Document, StringField, DictField, ReferenceField, DateTimeField, NULLIFY
+import copy
+import functools
+import math
+import time
 import uuid
+from collections import namedtuple
+from types import SimpleNamespace
 from pytz import UTC  # type: ignore
 from datetime import datetime
 from dateutil import parser as date_parser
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
 import re
 
 ACCEPTED_OPERATIONS = {
@@ -24,6 +32,35 @@ ACCEPTED_OPERATIONS = {
     "phone": ["replace", "update_country_code", "update_number"],
 }
 
+ARRAY_COMPONENT_TYPES = ("Array_type", "Array_generic", "Array_of_strings",
+                         "Array_of_booleans", "Array_of_dates", "Array_of_objects")
+
+# Template-specific checks as (component types, operations, DataTransfer method); each
+# (comp_type, operation) only runs the ones listed for it, see TRANSFER_DISPATCH
+SPECIAL_VALIDATIONS = (
+    ({"Array_of_pairs"}, {"append", "push_at", "update_pair"}, "_validate_financial_tracker_component"),
+    ({"Array_type"}, {"append", "push_at", "update_at"}, "_validate_habit_tracker_component"),
+)
+
+COUNTRY_CODE_PATTERN = re.compile(r"^\+?[1-9]\d{0,3}$")
+PHONE_NUMBER_PATTERN = re.compile(r"^[0-9]{4,14}$")
+
+
+def insert_all_or_none(document, docs):
+    """Insert docs with one ordered insert_many; on failure delete the ones it stored and re-raise."""
+    try:
+        document.objects.insert(docs, load_bulk=False)
+    except Exception as e:
+        # An ordered insert stops at the first error with the ones before it stored;
+        # mongoengine re-raises BulkWriteError as NotUniqueError, keeping it as the cause
+        bulk_error = e if isinstance(e, BulkWriteError) else e.__cause__
+        inserted = docs
+        if isinstance(bulk_error, BulkWriteError):
+            inserted = docs[:bulk_error.details.get("nInserted", len(docs))]
+        if inserted:
+            document.objects(id__in=[doc.id for doc in inserted]).delete()
+        raise
+
 
 def parse_schedule_time(schedule_time):
     if isinstance(schedule_time, str) and schedule_time:
@@ -42,6 +79,67 @@ def parse_schedule_time(schedule_time):
     return None
 
 
+@functools.lru_cache(maxsize=4096)
+def _is_financial_tracker_value(value):
+    """Whether value is "double;date" (see DataTransfer._validate_financial_tracker_format).
+
+    Cached: the same amount/date strings come back on every run of a recurring connection.
+    """
+    try:
+        if ';' not in value:
+            return False
+
+        parts = value.split(';')
+        if len(parts) != 2:
+            return False
+
+        amount_str, date_str = parts
+        # Strip whitespace from both parts
+        amount_str = amount_str.strip()
+        date_str = date_str.strip()
+
+        # Validate amount (double/float)
+        try:
+            amount = float(amount_str)
+            if amount < 0:  # Optional: reject negative amounts
+                return False
+        except ValueError:
+            return False
+
+        # Validate date format - support both YYYY-MM-DD and ISO format
+        try:
+            if 'T' in date_str:
+                # ISO format like "2025-06-24T00:00:00.000"
+                date_parser.parse(date_str)
+            else:
+                # Simple format like "2024-01-15"
+                datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            return False
+
+        return True
+    except Exception:
+        return False
+
+
+@functools.lru_cache(maxsize=4096)
+def _phone_number_error(country_code, number):
+    """Why a phone number's parts are invalid, or None if they are valid (cached per pair)."""
+    # Validate country code
+    if country_code and not COUNTRY_CODE_PATTERN.match(country_code):
+        return "Invalid country code format. Must be 1-4 digits, optionally starting with +"
+
+    # Validate phone number
+    if number and not PHONE_NUMBER_PATTERN.match(number):
+        return "Invalid phone number format. Must be 4-14 digits"
+
+    # Validate total length
+    full_number = f"{country_code.replace('+', '')}{number}"
+    if full_number and (len(full_number) < 5 or len(full_number) > 15):
+        return "Complete phone number must be between 5-15 digits"
+    return None
+
+
 class DataTransfer_db(Document):
     id = StringField(primary_key=True)
     source_component = ReferenceField(
@@ -69,8 +167,17 @@ class DataTransfer:
         self.details["done"] = False
         self.owner = owner
         self.timestamp = datetime.now(UTC).isoformat()
+        # Set while execute_many() folds this transfer with others; writes are collected there
+        self._fold = None
+        # Set while execute_many() runs this transfer; the batch's SubjectTemplates
+        self._subjects = None
+
+    def execute(self, components=None):
+        """Apply the transfer to its target component.
 
-    def execute(self):
+        components is an optional identity map (component id -> Component_db) loaded
+        up front for a batch of transfers; ids missing from it are treated as not found.
+        """
         # Check if operation was already completed
         if self.details and self.details.get("done"):
             return
@@ -78,25 +185,26 @@ class DataTransfer:
         # Fetch source and target components
         source_component = target_component = None
         if self.source_component:
-            source_component = Component_db.objects(id=self.source_component).first()
+            source_component = self._get_component(self.source_component, components)
             if self.source_component and not source_component:
                 print(f"Source component with ID {self.source_component} not found.")
                 return
                 
         if self.target_component:
-            target_component = Component_db.objects(id=self.target_component).first()
+            target_component = self._get_component(self.target_component, components)
         
         if not target_component:
             print(f"Target component with ID {self.target_component} not found.")
             return
 
         # Validate operation type for target component
-        if self.operation not in ACCEPTED_OPERATIONS.get(target_component.comp_type, []):
+        dispatch = TRANSFER_DISPATCH.get((target_component.comp_type, self.operation))
+        if dispatch is None:
             print(f"Operation '{self.operation}' not supported for component type '{target_component.comp_type}'.")
             return
 
         # Apply special validations based on component type and name
-        if not self._apply_special_validations(target_component):
+        if not self._apply_special_validations(target_component, dispatch.validators):
             return
 
         # Type check data_value if it's being used
@@ -136,27 +244,26 @@ class DataTransfer:
             return
 
         # Handle operations based on target component type
-        if target_component.comp_type == "pair":
-            return self._execute_pair_operation(target_component, source_value)
-        elif target_component.comp_type == "Array_of_pairs":
-            return self._execute_array_of_pairs_operation(target_component, source_value)
-        elif target_component.comp_type in ["Array_type", "Array_generic", "Array_of_strings", 
-                                        "Array_of_booleans", "Array_of_dates", "Array_of_objects"]:
-            return self._execute_array_operation(target_component, source_value)
-        else:
-            return self._execute_scalar_operation(target_component, source_value)
+        return dispatch.handler(self, target_component, source_value)
 
-    def _apply_special_validations(self, target_component):
-        """Apply special validations for specific component types and templates."""
-        # Financial Tracker validation
-        if not self._validate_financial_tracker_component(target_component):
-            return False
-        
-        # Habit Tracker validation
-        if not self._validate_habit_tracker_component(target_component):
-            return False
-        
-        # Add more special validations here as needed
+    @staticmethod
+    def _get_component(component_id, components=None):
+        if components is not None:
+            return components.get(component_id)
+        return Component_db.objects(id=component_id).first()
+
+    def _apply_special_validations(self, target_component, validators=None):
+        """Apply special validations for specific component types and templates.
+
+        validators defaults to the ones TRANSFER_DISPATCH lists for the transfer's
+        (comp_type, operation); add new ones to SPECIAL_VALIDATIONS.
+        """
+        if validators is None:
+            dispatch = TRANSFER_DISPATCH.get((target_component.comp_type, self.operation))
+            validators = dispatch.validators if dispatch else ()
+        for validator in validators:
+            if not validator(self, target_component):
+                return False
         return True
 
     def _validate_financial_tracker_component(self, target_component):
@@ -317,61 +424,16 @@ class DataTransfer:
         - "1000;2024-12-25"
         - "20000.0 ; 2025-06-24T00:00:00.000"
         """
-        try:
-            if not isinstance(value, str) or ';' not in value:
-                return False
-            
-            parts = value.split(';')
-            if len(parts) != 2:
-                return False
-            
-            amount_str, date_str = parts
-            # Strip whitespace from both parts
-            amount_str = amount_str.strip()
-            date_str = date_str.strip()
-            
-            # Validate amount (double/float)
-            try:
-                amount = float(amount_str)
-                if amount < 0:  # Optional: reject negative amounts
-                    return False
-            except ValueError:
-                return False
-            
-            # Validate date format - support both YYYY-MM-DD and ISO format
-            try:
-                if 'T' in date_str:
-                    # ISO format like "2025-06-24T00:00:00.000"
-                    from dateutil import parser as date_parser
-                    date_parser.parse(date_str)
-                else:
-                    # Simple format like "2024-01-15"
-                    from datetime import datetime
-                    datetime.strptime(date_str, "%Y-%m-%d")
-            except ValueError:
-                return False
-            
-            return True
-        except Exception:
-            return False
+        return isinstance(value, str) and _is_financial_tracker_value(value)
 
     def _validate_habit_subject(self, subject_id):
         """
         Validate that the subject exists and has the "habit" template.
         """
         try:
-            from .subject import Subject_db
-            
-            # Check if subject exists
-            subject = Subject_db.objects(id=subject_id).first()
-            if not subject:
-                return False
-            
-            # Check if subject has the "habit" template
-            if subject.template != "habit":
-                return False
-            
-            return True
+            subjects = self._subjects if self._subjects is not None else SubjectTemplates()
+            # None when the subject does not exist
+            return subjects.template(subject_id) == "habit"
         except Exception as e:
             print(f"Error validating habit subject {subject_id}: {e}")
             return False
@@ -390,21 +452,14 @@ class DataTransfer:
         
         country_code = phone_data.get("country_code", "")
         number = phone_data.get("number", "")
-        
-        # Validate country code
-        if country_code and not re.match(r"^\+?[1-9]\d{0,3}$", country_code):
-            print("Invalid country code format. Must be 1-4 digits, optionally starting with +")
-            return False
-        
-        # Validate phone number
-        if number and not re.match(r"^[0-9]{4,14}$", number):
-            print("Invalid phone number format. Must be 4-14 digits")
-            return False
-        
-        # Validate total length
-        full_number = f"{country_code.replace('+', '')}{number}"
-        if full_number and (len(full_number) < 5 or len(full_number) > 15):
-            print("Complete phone number must be between 5-15 digits")
+
+        if isinstance(country_code, str) and isinstance(number, str):
+            error = _phone_number_error(country_code, number)
+        else:
+            # Not cacheable; fails the same way as before caching
+            error = _phone_number_error.__wrapped__(country_code, number)
+        if error:
+            print(error)
             return False
         
         return True
@@ -436,7 +491,7 @@ class DataTransfer:
                 print(f"Type mismatch: Expected string for key, got {type(new_key).__name__}.")
                 return
                 
-            target_component.data["item"]["key"] = new_key
+            update = {"$set": {"data.item.key": new_key}}
             
         elif self.operation == "update_value":
             # Check if data_value has the right structure
@@ -460,13 +515,15 @@ class DataTransfer:
                     print(f"Type mismatch: Expected boolean for value, got {type(new_value).__name__}.")
                     return
                     
-            target_component.data["item"]["value"] = new_value
+            update = {"$set": {"data.item.value": new_value}}
             
         else:
             print(f"Unsupported operation '{self.operation}' for pair.")
             return
 
-        self._mark_as_done(target_component)
+        # Only written while the item is still the pair validated above
+        if not self._mark_as_done(target_component, update, {"data.item": {"$type": "object"}}):
+            return
         return True
 
     def _execute_array_of_pairs_operation(self, target_component, source_value):
@@ -505,12 +562,7 @@ class DataTransfer:
                     print(f"Type mismatch: Expected boolean for value, got {type(source_value['value']).__name__}.")
                     return
 
-            result = Arrays.append_to_array(
-                user_id=target_component.owner,
-                host_id=target_component.id,
-                value=source_value,
-                host_type="component"
-            )
+            result = self._append_value(target_component, source_value)
             
         elif self.operation == "remove_back":
             if not target_component.data["item"]:
@@ -660,7 +712,8 @@ class DataTransfer:
             print(f"Array_of_pairs operation failed: {result.get('message', 'Unknown error')}")
             return
 
-        self._mark_as_done(target_component)
+        if not self._mark_as_done(target_component):
+            return
         return True
 
     def _execute_array_operation(self, target_component, source_value):
@@ -705,12 +758,7 @@ class DataTransfer:
                     print(f"Type mismatch: Expected object (dict), got {type(source_value).__name__}.")
                     return
                     
-            result = Arrays.append_to_array(
-                user_id=target_component.owner,
-                host_id=target_component.id,
-                value=source_value,
-                host_type="component"
-            )
+            result = self._append_value(target_component, source_value)
             
         elif self.operation == "remove_back":
             if not target_component.data["item"]:
@@ -864,7 +912,8 @@ class DataTransfer:
             print(f"Array operation failed: {result.get('message', 'Unknown error')}")
             return
 
-        self._mark_as_done(target_component)
+        if not self._mark_as_done(target_component):
+            return
         return True
 
     def _execute_scalar_operation(self, target_component, source_value):
@@ -874,7 +923,8 @@ class DataTransfer:
             print(f"Unsupported operation '{self.operation}' for {target_component.comp_type}.")
             return
 
-        # Handle operations based on type
+        # Each operation compiles to one update (and the state it requires) applied atomically
+        guard = None
         if self.operation == "replace":
             # Type check the new value based on component type
             if target_component.comp_type == "int" and not isinstance(source_value, int):
@@ -901,7 +951,7 @@ class DataTransfer:
                 if not self._validate_phone_number(source_value):
                     return
                     
-            target_component.data["item"] = source_value
+            update = {"$set": {"data.item": source_value}}
             
         elif self.operation == "update_country_code":
             # Only valid for phone components
@@ -919,17 +969,19 @@ class DataTransfer:
                 print("Country code must be a string.")
                 return
                 
-            if source_value and not re.match(r"^\+?[1-9]\d{0,3}$", source_value):
+            if source_value and not COUNTRY_CODE_PATTERN.match(source_value):
                 print("Invalid country code format. Must be 1-4 digits, optionally starting with +")
                 return
                 
-            # Update country code
-            target_component.data["item"]["country_code"] = source_value
-            
             # Validate the complete phone number after update
-            if not self._validate_phone_number(target_component.data["item"]):
+            current = target_component.data["item"]
+            if not self._validate_phone_number({**current, "country_code": source_value}):
                 print("Updated phone number failed validation.")
                 return
+
+            update = {"$set": {"data.item.country_code": source_value}}
+            # Only written next to the number it was validated with
+            guard = {"data.item.number": current.get("number")}
                 
         elif self.operation == "update_number":
             # Only valid for phone components
@@ -947,17 +999,19 @@ class DataTransfer:
                 print("Phone number must be a string.")
                 return
                 
-            if source_value and not re.match(r"^[0-9]{4,14}$", source_value):
+            if source_value and not PHONE_NUMBER_PATTERN.match(source_value):
                 print("Invalid phone number format. Must be 4-14 digits")
                 return
                 
-            # Update number
-            target_component.data["item"]["number"] = source_value
-            
             # Validate the complete phone number after update
-            if not self._validate_phone_number(target_component.data["item"]):
+            current = target_component.data["item"]
+            if not self._validate_phone_number({**current, "number": source_value}):
                 print("Updated phone number failed validation.")
                 return
+
+            update = {"$set": {"data.item.number": source_value}}
+            # Only written next to the country code it was validated with
+            guard = {"data.item.country_code": current.get("country_code")}
                 
         elif self.operation == "add":
             # Check if operation makes sense for the type 
@@ -969,7 +1023,8 @@ class DataTransfer:
                 print(f"Cannot add non-numeric value: {type(source_value).__name__}.")
                 return
                 
-            target_component.data["item"] += source_value
+            update = {"$inc": {"data.item": source_value}}
+            guard = {"data.item": {"$type": "number"}}
             
         elif self.operation == "multiply":
             # Check if operation makes sense for the type
@@ -981,7 +1036,8 @@ class DataTransfer:
                 print(f"Cannot multiply by non-numeric value: {type(source_value).__name__}.")
                 return
                 
-            target_component.data["item"] *= source_value
+            update = {"$mul": {"data.item": source_value}}
+            guard = {"data.item": {"$type": "number"}}
             
         elif self.operation == "toggle":
             # Check if operation makes sense for the type
@@ -989,21 +1045,60 @@ class DataTransfer:
                 print(f"Cannot perform 'toggle' operation on non-boolean type: {type(target_component.data['item']).__name__}.")
                 return
                 
-            target_component.data["item"] = not target_component.data["item"]
+            # Negated by the server, so two concurrent toggles cancel out instead of colliding
+            update = [{"$set": {"data.item": {"$not": ["$data.item"]}}}]
+            guard = {"data.item": {"$type": "bool"}}
             
         else:
             print(f"Unsupported operation '{self.operation}' for {target_component.comp_type}.")
             return
 
-        self._mark_as_done(target_component)
+        if not self._mark_as_done(target_component, update, guard):
+            return
         return True
 
-    def _mark_as_done(self, target_component):
-        """Mark operation as completed and save changes"""
+    def _apply_update(self, target_component, update, guard=None):
+        """Write update to the target component in one atomic find_one_and_update.
+
+        guard narrows the filter to the state the transfer was validated against; if the
+        component no longer matches it (or was deleted) nothing is written. The updated
+        data is copied into target_component, so later transfers on the same instance
+        (e.g. from a batch's identity map) validate against what is stored.
+        """
+        doc = Component_db._get_collection().find_one_and_update(
+            {"_id": target_component.id, **(guard or {})}, update,
+            projection={"data": True}, return_document=ReturnDocument.AFTER)
+        if doc is None:
+            print(f"Component with ID {target_component.id} was changed or deleted before the transfer applied.")
+            return False
+        target_component.data = doc.get("data")
+        # Already stored; a later save() of the instance must not write it back over newer updates
+        target_component._clear_changed_fields()
+        return True
+
+    def _append_value(self, target_component, value):
+        if self._fold is not None:
+            return self._fold.add_append(value)
+        return Arrays.append_to_array(
+            user_id=target_component.owner,
+            host_id=target_component.id,
+            value=value,
+            host_type="component"
+        )
+
+    def _mark_as_done(self, target_component, update=None, guard=None):
+        """Apply the compiled component update (if any) and mark the operation as completed.
+
+        Array operations pass no update: their elements are written by Arrays.
+        """
+        if self._fold is not None:
+            return self._fold.add(self, update, guard)
+        if update is not None and not self._apply_update(target_component, update, guard):
+            return False
         self.details = {**(self.details or {}), "done": True}
-        target_component.save()
         self.save_to_db()
         print(f"Data transfer executed: {self.operation} on {target_component.id}")
+        return True
 
     def to_json(self):
         return {
@@ -1032,8 +1127,8 @@ class DataTransfer:
             owner=data.get("owner")
         )
 
-    def save_to_db(self):
-        data_transfer_db = DataTransfer_db(
+    def to_db(self):
+        return DataTransfer_db(
             id=self.id,
             source_component=self.source_component,
             target_component=self.target_component,
@@ -1043,7 +1138,23 @@ class DataTransfer:
             details=self.details,
             owner=self.owner
         )
-        data_transfer_db.save()
+
+    def save_to_db(self):
+        self.to_db().save()
+
+    @staticmethod
+    def save_many(transfers):
+        """Store new data transfers with a single insert_many.
+
+        Every transfer is validated before anything is written, so an invalid one
+        raises ValidationError and stores none of them. If the insert fails partway
+        (e.g. an id that already exists), the ones it stored are deleted again.
+        """
+        docs = [transfer.to_db() for transfer in transfers]
+        for doc in docs:
+            doc.validate()
+        if docs:
+            insert_all_or_none(DataTransfer_db, docs)
 
     @staticmethod
     def load_from_db(transfer_id):
@@ -1061,3 +1172,337 @@ class DataTransfer:
                 owner=data_transfer_db.owner
             )
         return None
+
+    @staticmethod
+    def from_doc(doc):
+        """Create a DataTransfer from a raw data_transfers document (e.g. from as_pymongo())."""
+        transfer = DataTransfer(
+            id=doc["_id"],
+            source_component=doc.get("source_component"),
+            target_component=doc.get("target_component"),
+            data_value=doc.get("data_value"),
+            operation=doc.get("operation"),
+            details=doc.get("details"),
+            schedule_time=doc.get("schedule_time"),
+            owner=doc.get("owner")
+        )
+        # The constructor starts every transfer as not done; keep the stored state so a
+        # retried connection does not apply transfers that already succeeded again
+        transfer.details["done"] = bool((doc.get("details") or {}).get("done"))
+        return transfer
+
+    @staticmethod
+    def load_many(transfer_ids):
+        """Load data transfers by id with a single query, without dereferencing components.
+
+        Returns {transfer_id: DataTransfer}; ids that do not exist or cannot be loaded are left out.
+        """
+        transfers = {}
+        for doc in DataTransfer_db.objects(id__in=list(transfer_ids)).as_pymongo():
+            try:
+                transfers[doc["_id"]] = DataTransfer.from_doc(doc)
+            except Exception as e:
+                print(f"Error loading data transfer with ID {doc['_id']}: {e}")
+        return transfers
+
+    @staticmethod
+    def execute_many(transfers, components=None, on_transfer=None, owners=None):
+        """Execute transfers in order, folding runs on one target component into a single write.
+
+        Consecutive add/multiply/replace/toggle (or append) transfers with a data_value on
+        the same target are validated one by one and then applied as one update (or one
+        bulk insert), with the same result as running them in order; every other transfer
+        runs on its own. Returns {transfer id: result}; an exception raised while executing
+        is stored as the result of the transfers it concerned.
+
+        owners optionally maps transfer ids to what they belong to (e.g. connection ids).
+        Like Connection.execute(), an owner stops at its first transfer that raises: later
+        transfers whose owners have all failed are skipped and get no result.
+        """
+        transfers = list(transfers)
+        # Habit subjects the batch validates, resolved together instead of one query each
+        subjects = SubjectTemplates()
+        try:
+            subjects.prefetch(_habit_subject_ids(transfers, components))
+        except Exception as e:
+            # Validation looks up whatever is missing on its own
+            print(f"Error prefetching habit subjects: {e}")
+        results = {}
+        failed = set()
+        for run in _fold_runs(transfers, owners):
+            if failed:
+                run = [transfer for transfer in run
+                       if not owners.get(transfer.id) or not failed.issuperset(owners[transfer.id])]
+                if not run:
+                    continue
+            started = time.perf_counter()
+            for transfer in run:
+                transfer._subjects = subjects
+            try:
+                if len(run) == 1:
+                    run_results = {run[0].id: run[0].execute(components=components)}
+                else:
+                    run_results = _TransferFold.execute(run, components)
+            except Exception as e:
+                run_results = {transfer.id: e for transfer in run}
+            finally:
+                for transfer in run:
+                    transfer._subjects = None
+            # A folded run is one write; its transfers share its time
+            seconds = (time.perf_counter() - started) / len(run)
+            for transfer in run:
+                results[transfer.id] = run_results.get(transfer.id)
+                if isinstance(results[transfer.id], Exception):
+                    if owners:
+                        failed.update(owners.get(transfer.id, ()))
+                elif on_transfer is not None:
+                    on_transfer(transfer, seconds, results[transfer.id])
+        return results
+
+    @staticmethod
+    def _mark_many_done(transfers):
+        """Mark stored transfers as completed with one bulk write."""
+        for transfer in transfers:
+            transfer.details = {**(transfer.details or {}), "done": True}
+        DataTransfer_db._get_collection().bulk_write(
+            [UpdateOne({"_id": transfer.id}, {"$set": {"details": transfer.details}})
+             for transfer in transfers], ordered=False)
+
+
+class SubjectTemplates:
+    """Templates of subjects by id, for validations that only need to know a subject's template.
+
+    Meant to live for one batch of transfers or one request: prefetch() resolves many ids
+    with a single projected $in query and template() fetches only what is still missing.
+    Missing subjects are remembered as None.
+    """
+
+    def __init__(self):
+        self.templates = {}
+
+    def prefetch(self, subject_ids):
+        from .subject import Subject_db
+
+        missing = {subject_id for subject_id in subject_ids if subject_id not in self.templates}
+        if not missing:
+            return
+        for doc in Subject_db.objects(id__in=list(missing)).only("template").as_pymongo():
+            self.templates[doc["_id"]] = doc.get("template")
+        for subject_id in missing:
+            self.templates.setdefault(subject_id, None)
+
+    def template(self, subject_id):
+        if subject_id not in self.templates:
+            self.prefetch([subject_id])
+        return self.templates[subject_id]
+
+
+def _habit_subject_ids(transfers, components=None):
+    """Subject ids the Habit Tracker validation will look up for transfers on loaded targets."""
+    subject_ids = set()
+    if components is None:
+        return subject_ids
+    for transfer in transfers:
+        if transfer.operation not in ("append", "push_at", "update_at") or not isinstance(transfer.data_value, dict):
+            continue
+        target = components.get(transfer.target_component)
+        if target is None or target.comp_type != "Array_type" or getattr(target, "name", None) != "habits":
+            continue
+        subject_id = transfer.data_value.get("item")
+        if isinstance(subject_id, str):
+            subject_ids.add(subject_id)
+    return subject_ids
+
+
+TransferDispatch = namedtuple("TransferDispatch", ["handler", "validators"])
+
+
+def _build_dispatch():
+    """(comp_type, operation) -> TransferDispatch for every pair in ACCEPTED_OPERATIONS."""
+    handlers = {"pair": DataTransfer._execute_pair_operation,
+                "Array_of_pairs": DataTransfer._execute_array_of_pairs_operation}
+    for comp_type in ARRAY_COMPONENT_TYPES:
+        handlers[comp_type] = DataTransfer._execute_array_operation
+    dispatch = {}
+    for comp_type, operations in ACCEPTED_OPERATIONS.items():
+        handler = handlers.get(comp_type, DataTransfer._execute_scalar_operation)
+        for operation in operations:
+            validators = tuple(getattr(DataTransfer, method)
+                               for comp_types, validated_operations, method in SPECIAL_VALIDATIONS
+                               if comp_type in comp_types and operation in validated_operations)
+            dispatch[(comp_type, operation)] = TransferDispatch(handler, validators)
+    return dispatch
+
+
+# Built once; execute() finds the handler and the validators of a transfer with one lookup
+TRANSFER_DISPATCH = _build_dispatch()
+
+
+# Operations execute_many() can fold, by the kind of run they fold into
+FOLDABLE_OPERATIONS = {"add": "scalar", "multiply": "scalar", "replace": "scalar", "toggle": "scalar",
+                       "append": "append"}
+
+
+def _fold_kind(transfer):
+    # A source component's value is only known when the transfer runs
+    if transfer.source_component or (transfer.details or {}).get("done"):
+        return None
+    return FOLDABLE_OPERATIONS.get(transfer.operation)
+
+
+def _fold_runs(transfers, owners=None):
+    """Split transfers into the units execute_many() runs, keeping the order on every component.
+
+    A foldable transfer joins the open run on its target. Any other transfer runs alone
+    and closes the runs on the components it reads or writes, so nothing is moved across
+    a transfer that could observe it. With owners (see execute_many()) a transfer also
+    never joins a run that executes before an earlier transfer of one of its owners.
+    """
+    runs = []
+    # component id -> index in runs of its open run
+    open_runs = {}
+    # owner -> index in runs of the run holding its latest transfer
+    placed = {}
+    for transfer in transfers:
+        keys = owners.get(transfer.id, ()) if owners else ()
+        kind = _fold_kind(transfer)
+        index = open_runs.get(transfer.target_component) if kind is not None else None
+        if index is not None and _fold_kind(runs[index][0]) == kind and all(
+                placed.get(key, -1) <= index for key in keys):
+            runs[index].append(transfer)
+        else:
+            if kind is None:
+                for component_id in (transfer.source_component, transfer.target_component):
+                    open_runs.pop(component_id, None)
+            index = len(runs)
+            runs.append([transfer])
+            if kind is not None:
+                open_runs[transfer.target_component] = index
+        for key in keys:
+            placed[key] = index
+    return runs
+
+
+def _simulate_update(data, update):
+    """Apply a compiled foldable update (see _execute_scalar_operation) to data in memory."""
+    if isinstance(update, list):
+        data["item"] = not data["item"]
+    elif "$inc" in update:
+        data["item"] += update["$inc"]["data.item"]
+    elif "$mul" in update:
+        data["item"] *= update["$mul"]["data.item"]
+    else:
+        for path, value in update["$set"].items():
+            # "data.item" or a field inside it, e.g. "data.item.number"
+            *parents, field = path.split(".")[1:]
+            target = data
+            for parent in parents:
+                target = target[parent]
+            target[field] = copy.deepcopy(value)
+
+
+class _TransferFold:
+    """The writes of a run of transfers on one component, collected and applied as one."""
+
+    def __init__(self, target_component):
+        self.target_component = target_component
+        # What the run's transfers validate against: the target after the writes collected so far
+        self.scratch = SimpleNamespace(
+            id=target_component.id, name=target_component.name, comp_type=target_component.comp_type,
+            owner=target_component.owner, data=copy.deepcopy(target_component.data))
+        self.transfers = []
+        self.updates = []
+        self.appends = []
+
+    def add(self, transfer, update, guard):
+        if update is not None:
+            self.updates.append((update, guard))
+            _simulate_update(self.scratch.data, update)
+        self.transfers.append(transfer)
+        return True
+
+    def add_append(self, value):
+        self.appends.append(value)
+        return {"success": True}
+
+    def compile(self):
+        """One (update, guard) with the effect of the collected updates; update is None for a no-op."""
+        if any(isinstance(update, dict) and "$set" in update for update, _ in self.updates):
+            # What follows the last replace was applied to a known value: store the outcome
+            return {"$set": {"data.item": self.scratch.data["item"]}}, None
+
+        # The first update needs the stored state; the rest were validated against the simulation
+        guard = self.updates[0][1]
+        updates = [update for update, _ in self.updates]
+        if all(isinstance(update, list) for update in updates):
+            # Toggles cancel out in pairs
+            return (updates[0] if len(updates) % 2 else None), guard
+        for operator in ("$inc", "$mul"):
+            values = [update.get(operator, {}).get("data.item") if isinstance(update, dict) else None
+                      for update in updates]
+            # Integers only: regrouping float arithmetic could round differently
+            if type(self.target_component.data.get("item")) is int and all(type(value) is int for value in values):
+                total = sum(values) if operator == "$inc" else math.prod(values)
+                return {operator: {"data.item": total}}, guard
+
+        expression = "$data.item"
+        for update in updates:
+            if isinstance(update, list):
+                expression = {"$not": [expression]}
+            elif "$inc" in update:
+                expression = {"$add": [expression, update["$inc"]["data.item"]]}
+            else:
+                expression = {"$multiply": [expression, update["$mul"]["data.item"]]}
+        return [{"$set": {"data.item": expression}}], guard
+
+    def commit(self):
+        """Write the collected updates or appends and mark the transfers done; False if nothing was written.
+
+        Raises when appends were only partly written and could not be undone, so the run
+        is not applied a second time.
+        """
+        target = self.target_component
+        if self.appends:
+            result = Arrays.append_many_to_array(
+                user_id=target.owner,
+                host_id=target.id,
+                values=self.appends,
+                host_type="component"
+            )
+            if result.get("partial"):
+                # Some values may be stored: running the run again one by one would repeat them
+                raise RuntimeError(f"Array operation partly applied: {result.get('message')}")
+            if not result.get("success", False):
+                print(f"Array operation failed: {result.get('message', 'Unknown error')}")
+                return False
+        elif self.updates:
+            update, guard = self.compile()
+            if update is not None and not self.transfers[0]._apply_update(target, update, guard):
+                return False
+        DataTransfer._mark_many_done(self.transfers)
+        print(f"Data transfers executed: {len(self.transfers)} folded onto {target.id}")
+        return True
+
+    @staticmethod
+    def execute(run, components=None):
+        """Validate a run against a scratch copy of its target, then write it at once."""
+        target = DataTransfer._get_component(run[0].target_component, components)
+        if target is None:
+            return {transfer.id: transfer.execute(components=components) for transfer in run}
+
+        fold = _TransferFold(target)
+        scratch = {target.id: fold.scratch}
+        results = {}
+        for transfer in run:
+            transfer._fold = fold
+            try:
+                results[transfer.id] = transfer.execute(components=scratch)
+            finally:
+                transfer._fold = None
+        if not fold.transfers or fold.commit():
+            return results
+
+        # Nothing was written (e.g. the component changed meanwhile): run them one by one
+        if components is not None:
+            target.reload()
+        return {transfer.id: transfer.execute(components=components) for transfer in run}
@@ -1,13 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from models import User, Component, Component_db,  Subject_db, DataTransfer, DataTransfer_db, Connection_db, Connection
+from models import User, Component, Component_db,  Subject_db, DataTransfer, DataTransfer_db, Connection_db, Connection, DeadLetterConnection_db, retry_dead_letter
 from middleWares import verify_device, admin_required
-from mongoengine.errors import DoesNotExist
+from mongoengine.errors import DoesNotExist, ValidationError
 from dateutil import parser as date_parser
+from utils.connections import queue_root
+from utils.worker_metrics import read_worker_stats
+from routes.dataTransfers import check_bulk_items, load_owned
 import pytz
 
 router = APIRouter(prefix="/connections", tags=["Connections"])
 
 
+def _parse_utc(value):
+    """Parse a date string into UTC; dates without a timezone are taken as UTC."""
+    if not value:
+        return value
+    dt = date_parser.parse(value)
+    if dt.tzinfo is None:
+        return pytz.UTC.localize(dt)
+    return dt.astimezone(pytz.UTC)
+
+
 @router.post("/", dependencies=[Depends(verify_device)], status_code=status.HTTP_201_CREATED)
 async def create_connection(data: dict, user_device: tuple = Depends(verify_device)):
     current_user = user_device[0]
@@ -32,23 +45,9 @@ async def create_connection(data: dict, user_device: tuple = Depends(verify_devi
             status_code=400, detail="Connection type is required")
 
     # Parse and normalize start_date and end_date to UTC
-    start_date = data.get("start_date")
-    end_date = data.get("end_date")
     try:
-        if start_date:
-            dt = date_parser.parse(start_date)
-            if dt.tzinfo is None:
-                dt = pytz.UTC.localize(dt)
-            else:
-                dt = dt.astimezone(pytz.UTC)
-            start_date = dt
-        if end_date:
-            dt = date_parser.parse(end_date)
-            if dt.tzinfo is None:
-                dt = pytz.UTC.localize(dt)
-            else:
-                dt = dt.astimezone(pytz.UTC)
-            end_date = dt
+        start_date = _parse_utc(data.get("start_date"))
+        end_date = _parse_utc(data.get("end_date"))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid date format: {e}")
 
@@ -104,6 +103,110 @@ async def create_connection(data: dict, user_device: tuple = Depends(verify_devi
             status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+@router.post("/bulk", dependencies=[Depends(verify_device)], status_code=status.HTTP_201_CREATED)
+async def bulk_create_connections(data: dict, user_device: tuple = Depends(verify_device)):
+    """Create many connections and their data transfers in one request.
+
+    Body: {"connections": [...]}, each item with the fields of POST /connections/.
+    Subjects and components are checked with one query each and everything is stored
+    with one insert per collection; nothing is created when any item is invalid.
+    """
+    current_user = user_device[0]
+    items = data.get("connections")
+    check_bulk_items(items, "connections")
+    for index, item in enumerate(items):
+        if 'source_subject' not in item or 'target_subject' not in item:
+            raise HTTPException(
+                status_code=400, detail=f"Source and Target subjects are required (connections[{index}])")
+        if 'con_type' not in item:
+            raise HTTPException(
+                status_code=400, detail=f"Connection type is required (connections[{index}])")
+        transfers = item.get("data_transfers", [])
+        if not isinstance(transfers, list) or not all(isinstance(transfer, dict) for transfer in transfers):
+            raise HTTPException(
+                status_code=400, detail=f"Each data_transfer must be a dictionary (connections[{index}])")
+        for transfer in transfers:
+            if not transfer.get("target_component"):
+                raise HTTPException(
+                    status_code=400, detail=f"Target component is required in data_transfer (connections[{index}])")
+            if "data_value" not in transfer or "operation" not in transfer:
+                raise HTTPException(
+                    status_code=400, detail=f"data_value and operation are required in data_transfer (connections[{index}])")
+
+    # Only references are stored, so ids and owners are all that is loaded
+    subjects = load_owned(
+        Subject_db, [subject_id for item in items for subject_id in (item["source_subject"], item["target_subject"])],
+        current_user, "Subject", only=("id", "owner"))
+    components = load_owned(
+        Component_db, [component_id for item in items for transfer in item.get("data_transfers", [])
+                       for component_id in (transfer.get("source_component"), transfer["target_component"])],
+        current_user, "Component", only=("id", "owner"))
+
+    connections, data_transfers = [], []
+    for index, item in enumerate(items):
+        try:
+            connection = Connection(
+                source_subject=subjects[str(item["source_subject"])],
+                target_subject=subjects[str(item["target_subject"])],
+                con_type=item["con_type"],
+                owner=current_user.id,
+                start_date=_parse_utc(item.get("start_date")),
+                end_date=_parse_utc(item.get("end_date"))
+            )
+        except Exception as e:
+            raise HTTPException(
+                status_code=400, detail=f"Error creating connection object (connections[{index}]): {str(e)}")
+        for transfer in item.get("data_transfers", []):
+            source_id = transfer.get("source_component")
+            data_transfers.append(connection.new_data_transfer(
+                components[str(source_id)] if source_id else None, components[str(transfer["target_component"])],
+                transfer["data_value"], transfer["operation"], transfer.get("details")))
+        connections.append(connection)
+
+    try:
+        Connection.save_many(connections, data_transfers)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=400, detail=f"Validation error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+    return {
+        "message": f"Created {len(connections)} connections with {len(data_transfers)} data transfers",
+        "connections": [connection.to_json() for connection in connections]
+    }
+
+
+@router.get("/metrics", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_device), Depends(admin_required)])
+async def get_worker_metrics():
+    """Scheduler worker stats: execution lag, transfer latency, queue depth, sync timings (Admin Only)."""
+    workers = read_worker_stats(queue_root)
+    return {"workers": workers, "running": sum(1 for worker in workers if not worker["stale"])}
+
+
+@router.get("/dead-letters", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_device)])
+async def get_dead_letters(user_device: tuple = Depends(verify_device)):
+    """List connections that kept failing and are no longer executed (all of them for admins)."""
+    current_user = user_device[0]
+    dead_letters = DeadLetterConnection_db.objects() if current_user.admin else DeadLetterConnection_db.objects(owner=str(current_user.id))
+    return [dead_letter.to_mongo() for dead_letter in dead_letters.order_by("-failed_at")]
+
+
+@router.post("/dead-letters/{connection_id}/retry", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_device)])
+async def retry_dead_letter_connection(connection_id: str, user_device: tuple = Depends(verify_device)):
+    """Give a dead-lettered connection a fresh set of attempts; the worker picks it up again."""
+    current_user = user_device[0]
+    dead_letter = DeadLetterConnection_db.objects(id=connection_id).first()
+    if not dead_letter:
+        raise HTTPException(status_code=404, detail="Dead-lettered connection not found")
+    if str(current_user.id) != str(dead_letter.owner) and not current_user.admin:
+        raise HTTPException(status_code=403, detail="Not authorized to retry this connection")
+
+    if not retry_dead_letter(connection_id):
+        # The connection itself was deleted or already retried; the dead letter is gone either way
+        raise HTTPException(status_code=404, detail="Connection not found")
+    return {"message": "Connection queued for retry", "connection_id": connection_id}
+
 
 @router.get("/{connection_id}", status_code=status.HTTP_200_OK, dependencies=[Depends(verify_device)])
 async def get_connection_by_id(connection_id: str):
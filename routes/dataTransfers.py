@@ -10,6 +10,60 @@ import pytz
 
 router = APIRouter(prefix="/datatransfers", tags=["DataTransfer"])
 
+# Most items a single bulk request may create
+MAX_BULK_ITEMS = 1000
+
+
+def check_bulk_items(items, name):
+    """Reject a bulk body whose items are not a non-empty list of dictionaries."""
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail=f"{name} must be a non-empty list")
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BULK_ITEMS} {name} can be created per request")
+    if not all(isinstance(item, dict) for item in items):
+        raise HTTPException(status_code=400, detail=f"Each item of {name} must be a dictionary")
+
+
+def load_owned(document, ids, current_user, label, only=None):
+    """Fetch documents by id with a single $in query and check the user may use them.
+
+    Returns {id: document}. Raises 404 when an id does not exist and 403 when a document
+    belongs to another user (admins may use any). only limits the loaded fields.
+    """
+    ids = {str(doc_id) for doc_id in ids if doc_id}
+    if not ids:
+        return {}
+    query = document.objects(id__in=list(ids))
+    if only:
+        query = query.only(*only)
+    found = {str(doc.id): doc for doc in query}
+    missing = ids - found.keys()
+    if missing:
+        raise HTTPException(
+            status_code=404, detail=f"{label} not found: {', '.join(sorted(missing))}")
+    if not current_user.admin:
+        foreign = sorted(doc_id for doc_id, doc in found.items() if str(doc.owner) != str(current_user.id))
+        if foreign:
+            raise HTTPException(
+                status_code=403, detail=f"Not authorized to use {label.lower()}: {', '.join(foreign)}")
+    return found
+
+
+def parse_schedule_time(value):
+    """Parse a timezone-aware schedule_time into UTC; None when it is not given."""
+    if not value:
+        return None
+    try:
+        dt = date_parser.parse(value)
+    except Exception:
+        raise HTTPException(
+            status_code=400, detail="Invalid date format for 'schedule_time'")
+    if dt.tzinfo is None:
+        raise HTTPException(
+            status_code=400, detail="schedule_time must include timezone information")
+    return dt.astimezone(timezone.utc)
+
 
 @router.post("/", dependencies=[Depends(verify_device)], status_code=status.HTTP_201_CREATED)
 async def create_data_transfer(data: dict, user_device: tuple = Depends(verify_device)):
@@ -87,6 +141,78 @@ async def create_data_transfer(data: dict, user_device: tuple = Depends(verify_d
             status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+@router.post("/bulk", dependencies=[Depends(verify_device)], status_code=status.HTTP_201_CREATED)
+async def bulk_create_data_transfers(data: dict, user_device: tuple = Depends(verify_device)):
+    """Create many data transfers with one ownership query and one insert.
+
+    Body: {"data_transfers": [...]}, each item with the fields of POST /datatransfers/.
+    Nothing is created when any item is invalid. Every transfer is stored; those whose
+    schedule_time is not in the future then run right away, as one batch.
+    """
+    current_user = user_device[0]
+    items = data.get("data_transfers")
+    check_bulk_items(items, "data_transfers")
+    for index, item in enumerate(items):
+        if not item.get("target_component"):
+            raise HTTPException(
+                status_code=400, detail=f"Target component is required (data_transfers[{index}])")
+    schedule_times = [parse_schedule_time(item.get("schedule_time")) for item in items]
+    transfer_ids = [str(item.get('id') or uuid.uuid4()) for item in items]
+    if len(set(transfer_ids)) != len(transfer_ids):
+        raise HTTPException(status_code=400, detail="Data transfer ids must be unique")
+    existing = [str(doc_id) for doc_id in DataTransfer_db.objects(id__in=transfer_ids).scalar('id')]
+    if existing:
+        raise HTTPException(
+            status_code=409, detail=f"Data transfers already exist: {', '.join(sorted(existing))}")
+    # Full documents: the transfers that run now use them as their identity map
+    components = load_owned(
+        Component_db,
+        [component_id for item in items
+         for component_id in (item.get("source_component"), item["target_component"])],
+        current_user, "Component")
+    # As in POST /datatransfers/: admins may write to anyone's component but only read their own
+    foreign_sources = sorted({str(item["source_component"]) for item in items if item.get("source_component")
+                              and str(components[str(item["source_component"])].owner) != str(current_user.id)})
+    if foreign_sources:
+        raise HTTPException(
+            status_code=403, detail=f"Not authorized to use component: {', '.join(foreign_sources)}")
+
+    now = datetime.now(timezone.utc)
+    due, scheduled = [], []
+    for item, schedule_time, transfer_id in zip(items, schedule_times, transfer_ids):
+        data_transfer = DataTransfer(
+            id=transfer_id,
+            source_component=str(item["source_component"]) if item.get("source_component") else None,
+            target_component=str(item["target_component"]),
+            data_value=item.get("data_value"),
+            operation=item.get('operation', 'replace'),
+            schedule_time=schedule_time,
+            details=item.get("details") or {},
+            owner=current_user.id
+        )
+        (scheduled if schedule_time and schedule_time > now else due).append(data_transfer)
+
+    try:
+        # Due transfers are stored too: a folded run only marks existing documents done
+        DataTransfer.save_many(scheduled + due)
+        results = DataTransfer.execute_many(due, components=components) if due else {}
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=400, detail=f"Validation error: {str(e)}")
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"An unexpected error occurred: {str(e)}")
+
+    executed = [transfer.id for transfer in due if results.get(transfer.id) is True]
+    failed = [transfer.id for transfer in due if results.get(transfer.id) is not True]
+    return {
+        "message": f"{len(executed)} data transfers executed, {len(scheduled)} scheduled, {len(failed)} failed",
+        "executed": executed,
+        "scheduled": [transfer.id for transfer in scheduled],
+        "failed": failed
+    }
+
+
 @router.get("/{transfer_id}", dependencies=[Depends(verify_device)], status_code=status.HTTP_200_OK)
 async def get_data_transfer(transfer_id: str, user_device: tuple = Depends(verify_device)):
     """ Retrieve a data transfer by its ID. """
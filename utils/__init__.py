@@ -1,4 +1,7 @@
-from .file_priority_queue import FilePriorityQueue
+from .file_priority_queue import FilePriorityQueue, PickleCodec, BinaryCodec, CodecError
+from .mmap_heap_queue import MmapHeapQueue
+from .timing_wheel import TimingWheel
+from .async_priority_queue import AsyncPriorityQueue
 from .tokens import JWT_SECRET_KEY,REJWT_SECRET_KEY,ACCESS_TOKEN_EXPIRE_DAYS,ACCESS_TOKEN_EXPIRE_DAYS,REFRESH_TOKEN_EXPIRE_DAYS, ALGORITHM , oauth2_scheme , create_access_token , create_refresh_token , verify_refresh_token 
 from .user import logout_user
 from .ip_info import get_ip_info
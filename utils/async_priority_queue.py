@@ -0,0 +1,148 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Callable, Iterable, List, Optional, Tuple, Union
+
+
+class AsyncPriorityQueue:
+    """An asyncio facade over a FilePriorityQueue or MmapHeapQueue of (datetime, id) items.
+
+    Every queue call runs on a worker thread, so disk I/O and fsyncs never block the event
+    loop. Pushes made through the facade wake iter_due() waiters right away; pushes made
+    by other threads of the process should be followed by notify_threadsafe(), and pushes
+    by other processes are picked up within poll_interval.
+    """
+
+    def __init__(self, queue, executor: Optional[ThreadPoolExecutor] = None,
+                 clock: Optional[Callable[[], datetime]] = None):
+        self.queue = queue
+        # One thread is enough: the queue serializes its operations under its own lock anyway
+        self._own_executor = executor is None
+        self.executor = executor or ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="priority-queue")
+        self.clock = clock or (lambda: datetime.now(timezone.utc))
+
+        # Bumped on every change made or announced through the facade
+        self._version = 0
+        self._condition: Optional[asyncio.Condition] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        self._loop = loop
+        return await loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    def _get_condition(self) -> asyncio.Condition:
+        # Created lazily so it belongs to the loop that uses it
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def notify(self) -> None:
+        """Wake every iter_due() waiter so it looks at the queue again."""
+        condition = self._get_condition()
+        async with condition:
+            self._version += 1
+            condition.notify_all()
+
+    def notify_threadsafe(self) -> None:
+        """notify() for code running outside the event loop, e.g. a change-stream thread."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.notify(), loop)
+
+    async def push(self, priority: datetime, value: str) -> None:
+        await self._run(self.queue.push, priority, value)
+        await self.notify()
+
+    async def push_many(self, items: Iterable[Tuple[datetime, str]]) -> int:
+        # Materialize here: the iterable must not be consumed on the worker thread
+        count = await self._run(self.queue.push_many, list(items))
+        await self.notify()
+        return count
+
+    async def pop(self, lease_timeout: Optional[float] = None) -> Optional[Tuple[datetime, str]]:
+        return await self._run(self.queue.pop, lease_timeout=lease_timeout)
+
+    async def pop_due(self, until: Optional[datetime] = None, max_items: Optional[int] = None,
+                      lease_timeout: Optional[float] = None) -> List[Tuple[datetime, str]]:
+        """Pop every item due by until (default: now) without waiting."""
+        return await self._run(self.queue.pop_due, until or self.clock(),
+                               max_items=max_items, lease_timeout=lease_timeout)
+
+    async def claim_many(self, keys: Iterable[str],
+                         lease_timeout: Optional[float] = None) -> List[Tuple[datetime, str]]:
+        return await self._run(self.queue.claim_many, list(keys), lease_timeout=lease_timeout)
+
+    async def ack(self, key: str) -> bool:
+        return await self._run(self.queue.ack, key)
+
+    async def cancel(self, key: str) -> bool:
+        cancelled = await self._run(self.queue.cancel, key)
+        if cancelled:
+            await self.notify()
+        return cancelled
+
+    async def peek(self) -> Optional[Tuple[datetime, str]]:
+        return await self._run(self.queue.peek)
+
+    async def size(self) -> int:
+        return await self._run(self.queue.size)
+
+    async def _wait_for_change(self, version: int, timeout: float) -> None:
+        condition = self._get_condition()
+        async with condition:
+            try:
+                await asyncio.wait_for(
+                    condition.wait_for(lambda: self._version != version), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def iter_due(self, lease_timeout: Optional[float] = None,
+                       max_items: Optional[int] = None,
+                       poll_interval: float = 30.0) -> AsyncIterator[Tuple[datetime, str]]:
+        """Yield items as they become due, sleeping until the next due time or a push.
+
+        poll_interval bounds every sleep, so items queued by other processes (or a clock
+        that jumped) are noticed without a notification.
+        """
+        async for due in self.iter_due_batches(lease_timeout, max_items, poll_interval):
+            for item in due:
+                yield item
+
+    async def iter_due_batches(self, lease_timeout: Optional[float] = None,
+                               max_items: Optional[Union[int, Callable[[], int]]] = None,
+                               poll_interval: float = 30.0) -> AsyncIterator[List[Tuple[datetime, str]]]:
+        """iter_due() yielding each pop_due() result as one list.
+
+        max_items may be a callable, asked before every pop, e.g. for the free capacity of
+        the consumer; while it returns 0 nothing is popped and the wait is poll_interval or
+        a notify().
+        """
+        while True:
+            # Read the version first: a push landing after the peek below still wakes us
+            version = self._version
+            limit = max_items() if callable(max_items) else max_items
+            if limit is None or limit > 0:
+                due = await self.pop_due(self.clock(), max_items=limit,
+                                         lease_timeout=lease_timeout)
+                if due:
+                    yield due
+                    continue
+
+            timeout = poll_interval
+            head = await self.peek() if limit is None or limit > 0 else None
+            if head is not None:
+                until_due = (_aware(head[0]) - self.clock()).total_seconds()
+                timeout = min(max(until_due, 0), poll_interval)
+            if timeout > 0:
+                await self._wait_for_change(version, timeout)
+
+    def close(self) -> None:
+        if self._own_executor:
+            self.executor.shutdown(wait=True)
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
@@ -0,0 +1,359 @@
+"""Connection worker on asyncio and motor (WORKER_MODE=asyncio).
+
+One AsyncIOMotorClient, and so one connection pool, serves the change stream, the
+startup and periodic scans, claims and batch loads; every connection (or group of
+connections sharing a target component) runs as its own task. Transfers still apply
+through the MongoEngine models, on CONNECTION_WORKERS threads. The durable queue,
+resume token, partitioning and metrics are the ones of the thread-based worker in
+utils/connections.py, so both modes can take over each other's queue directory.
+"""
+import asyncio
+import functools
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from pytz import UTC
+
+from consts import env_variables
+from models import (Component_db, Connection_db, ConnectionBatch, DataTransfer, DataTransfer_db,
+                    FAILURE_DEAD_LETTER, FAILURE_RETRY, MONGO_HOST, record_connection_failure,
+                    release_stale_claims)
+from .async_priority_queue import AsyncPriorityQueue
+from .keyed_executor import AsyncKeyedExecutor
+from .connections import (
+    CLAIM_REAP_SECONDS, CONNECTION_LEASE_SECONDS, CONNECTION_WORKERS, LATENESS_REPORT_SECONDS,
+    MAX_IDLE_SECONDS, RESUME_RETRY_SECONDS, RESUME_TOKEN_EXPIRED_CODES, RESUME_TOKEN_SAVE_SECONDS,
+    SCAN_FIELDS, SYNC_WINDOW, WORKER_ID, get_connection_queue, worker_metrics,
+    _classify_connection_change, _drop_resume_token, _due_items, _load_resume_token,
+    _partition_filter, _partition_match, _pending_connections, _pending_query, _record_lateness,
+    _record_transfer, _report_lateness, _save_resume_token, _sync_queries, _to_utc)
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+except ImportError:  # Only needed in asyncio mode
+    AsyncIOMotorClient = None
+
+logger = logging.getLogger(__name__)
+
+# Connections leased, loading or executing at once; waiting ones cost a coroutine, not a thread
+MAX_CONNECTIONS_IN_FLIGHT = int(env_variables['ASYNC_MAX_IN_FLIGHT'])
+# The sync scans read these fields only
+SCAN_PROJECTION = {Connection_db._fields[name].db_field: 1 for name in SCAN_FIELDS}
+
+
+class AsyncConnectionWorker:
+    """Queues, claims and executes this partition's connections on one event loop."""
+
+    def __init__(self, client):
+        db = client["planitly" if MONGO_HOST == "localhost" else "Cluster0"]
+        self.connections = db[Connection_db._get_collection_name()]
+        self.transfers = db[DataTransfer_db._get_collection_name()]
+        self.components = db[Component_db._get_collection_name()]
+        self.queue = AsyncPriorityQueue(get_connection_queue())
+        # Connections sharing a target component run one after another, in due order
+        self.executor = AsyncKeyedExecutor(MAX_CONNECTIONS_IN_FLIGHT)
+        # Applying transfers goes through MongoEngine, which blocks
+        self.transfer_threads = ThreadPoolExecutor(max_workers=CONNECTION_WORKERS,
+                                                   thread_name_prefix="transfer")
+        # Same role as utils.connections._live_components; only touched on the loop
+        self.live_components = {}
+        self.saturated = False
+
+    async def run(self):
+        worker_metrics.start_writer(self._collect_gauges)
+        await asyncio.gather(self.listen_for_changes(), self.periodic_sync(),
+                             self.reap_stale_claims(), self.execute_due())
+
+    def _collect_gauges(self):
+        worker_metrics.set_gauge("queue_depth", get_connection_queue().size())
+        worker_metrics.set_gauge("queue_leased", get_connection_queue().in_flight())
+        worker_metrics.set_gauge("executor_pending", self.executor.pending())
+
+    async def _in_thread(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.transfer_threads, functools.partial(fn, *args, **kwargs))
+
+    # Scheduling
+
+    async def scan_due(self, query, until):
+        """Async utils.connections._scan_due_connections: one projected find on the shared pool."""
+        # The raw filter MongoEngine compiles for the query, so both modes select the same connections
+        cursor = self.connections.find(_pending_connections(query)._query, SCAN_PROJECTION)
+        return _due_items(await cursor.to_list(None), until)
+
+    async def load_pending(self):
+        try:
+            future_time = datetime.now(UTC) + SYNC_WINDOW
+            with worker_metrics.timer("load_pending_seconds"):
+                await self.queue.push_many(await self.scan_due(_pending_query(future_time), future_time))
+        except Exception as e:
+            worker_metrics.inc("load_pending_failures")
+            logger.error(f"Error loading pending connections: {e}")
+
+    async def periodic_sync(self):
+        """periodic_sync_connections() on the event loop."""
+        watermark = last_run = None
+        await asyncio.sleep(5 * 60)
+        while True:
+            try:
+                start_time = datetime.now(UTC)
+                end_time = start_time + SYNC_WINDOW
+                with worker_metrics.timer("sync_seconds"):
+                    scans = await asyncio.gather(*(self.scan_due(query, end_time)
+                                                   for query in _sync_queries(watermark, last_run, end_time)))
+                    synced_count = await self.queue.push_many(item for due in scans for item in due)
+                watermark, last_run = end_time, start_time
+                worker_metrics.set_gauge("sync_last_count", synced_count)
+                logger.info(f"Periodic sync completed: {synced_count} connections processed")
+                elapsed = (datetime.now(UTC) - start_time).total_seconds()
+                await asyncio.sleep(max(0, 5 * 60 - elapsed))
+            except Exception as e:
+                worker_metrics.inc("sync_failures")
+                logger.error(f"Error in periodic sync: {e}")
+                await asyncio.sleep(60)
+
+    async def reap_stale_claims(self):
+        """reap_stale_claims() on the event loop; the rare release itself runs on a thread."""
+        while True:
+            await asyncio.sleep(CLAIM_REAP_SECONDS)
+            try:
+                released = await self._in_thread(release_stale_claims, _partition_filter())
+                if released:
+                    await self.queue.push_many(
+                        (_to_utc(end_date), str(conn_id)) for conn_id, end_date in released)
+                    worker_metrics.inc("claims_reaped", len(released))
+                    logger.warning(f"Released {len(released)} stale connection claims")
+            except Exception as e:
+                logger.error(f"Error reaping stale connection claims: {e}")
+
+    async def handle_change(self, change):
+        action = _classify_connection_change(change)
+        if action is None:
+            return
+        conn_id, due = action
+        if due is None:
+            if await self.queue.cancel(conn_id):
+                logger.info(f"Removed connection {conn_id} from queue")
+        else:
+            await self.queue.push(due, conn_id)
+            logger.info(f"Queued new/updated connection {conn_id} for {due}")
+
+    async def listen_for_changes(self):
+        """listen_for_connection_changes() over an async change stream."""
+        from pymongo.errors import OperationFailure
+
+        loop = asyncio.get_running_loop()
+        scanned = False
+        while True:
+            resume_token = _load_resume_token()
+            try:
+                async with self.connections.watch(
+                        [_partition_match()], full_document='updateLookup',
+                        resume_after=resume_token) as stream:
+                    if resume_token is None:
+                        logger.info("No change stream resume token, scanning pending connections")
+                    else:
+                        logger.info("Resumed connection change stream from saved token")
+                    if resume_token is None or not scanned:
+                        # Connections that came due while the worker was down produce no event
+                        await self.load_pending()
+                        scanned = True
+                    if resume_token is None and stream.resume_token is not None:
+                        _save_resume_token(stream.resume_token)
+                    logger.info("Listening for connection changes...")
+
+                    saved_token = stream.resume_token
+                    last_save = time.monotonic()
+                    while stream.alive:
+                        change = await stream.try_next()
+                        if change is not None:
+                            try:
+                                await self.handle_change(change)
+                            except Exception as e:
+                                logger.error(f"Error processing change stream event: {e}")
+                        token = stream.resume_token
+                        if token != saved_token and time.monotonic() - last_save >= RESUME_TOKEN_SAVE_SECONDS:
+                            # fsyncs; kept off the loop
+                            await loop.run_in_executor(None, _save_resume_token, token)
+                            saved_token = token
+                            last_save = time.monotonic()
+            except OperationFailure as e:
+                if e.code in RESUME_TOKEN_EXPIRED_CODES:
+                    logger.warning(f"Change stream resume token expired ({e.code}), rescanning")
+                    _drop_resume_token()
+                    continue
+                logger.error(f"Change stream listener stopped: {e}")
+            except Exception as e:
+                logger.error(f"Change stream listener stopped: {e}")
+            await asyncio.sleep(RESUME_RETRY_SECONDS)
+
+    # Execution
+
+    async def load_batch(self, conn_ids):
+        """Claim connections and load them, their transfers and components: four round trips.
+
+        Same claim as models.connection.claim_connections(), so connections claimed by a
+        thread-based worker are skipped here and the other way round.
+        """
+        token = f"{WORKER_ID}:{uuid.uuid4().hex}"
+        conn_ids = list(conn_ids)
+        now = datetime.now(UTC)
+        await self.connections.update_many(
+            {"_id": {"$in": conn_ids}, "done": False, "claim_token": None},
+            {"$set": {"claim_token": token, "claimed_at": now, "updated_at": now}})
+        connection_docs = await self.connections.find(
+            {"_id": {"$in": conn_ids}, "claim_token": token}).to_list(None)
+
+        batch = ConnectionBatch(
+            components={component_id: entry[0] for component_id, entry in self.live_components.items()},
+            claim_token=token)
+        batch.add_connections(Connection_db._from_son(doc) for doc in connection_docs)
+
+        transfer_ids = batch.transfer_ids()
+        if transfer_ids:
+            transfers = []
+            async for doc in self.transfers.find({"_id": {"$in": list(transfer_ids)}}):
+                try:
+                    transfers.append(DataTransfer.from_doc(doc))
+                except Exception as e:
+                    print(f"Error loading data transfer with ID {doc['_id']}: {e}")
+            batch.add_transfers(transfers)
+
+        missing = batch.missing_component_ids()
+        if missing:
+            batch.add_components([Component_db._from_son(doc) async for doc in
+                                  self.components.find({"_id": {"$in": list(missing)}})])
+        return batch
+
+    def _hold_components(self, batch, conn_id):
+        for component_id in batch.component_ids(conn_id):
+            entry = self.live_components.setdefault(component_id, [batch.components[component_id], 0])
+            entry[1] += 1
+
+    def _release_components(self, batch, conn_id):
+        for component_id in batch.component_ids(conn_id):
+            entry = self.live_components.get(component_id)
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] <= 0:
+                    del self.live_components[component_id]
+
+    def _room(self):
+        room = MAX_CONNECTIONS_IN_FLIGHT - self.executor.pending()
+        self.saturated = room <= 0
+        return room
+
+    def _on_connection_done(self, _):
+        # Wakes execute_due() only when it is waiting for a free slot
+        if self.saturated:
+            self.saturated = False
+            asyncio.ensure_future(self.queue.notify())
+
+    async def handle_failure(self, conn_id, batch):
+        """utils.connections._handle_connection_failure() on the event loop."""
+        connection = batch.connection(conn_id)
+        outcome, retry_at = await self._in_thread(record_connection_failure, conn_id, batch.claim_token,
+                                                  connection.error)
+        if outcome == FAILURE_RETRY:
+            # Pushed before the ack, so the connection is never out of the queue in between
+            await self.queue.push(retry_at, conn_id)
+            worker_metrics.inc("connections_retried")
+            logger.warning(f"Connection {conn_id} failed ({connection.error}), retrying at {retry_at}")
+        elif outcome == FAILURE_DEAD_LETTER:
+            worker_metrics.inc("connections_dead_lettered")
+            logger.error(f"Connection {conn_id} failed ({connection.error}), moved to dead letters")
+        else:
+            worker_metrics.inc("failure_claims_lost")
+            logger.warning(f"Connection {conn_id} failed ({connection.error}), but its claim was lost")
+        await self.queue.ack(conn_id)
+
+    async def execute_connections(self, items, batch):
+        """utils.connections._execute_connections() with the transfers on a thread."""
+        for end_date, conn_id in items:
+            _record_lateness(conn_id, end_date)
+            logger.info(f"Executing connection: {conn_id}")
+        started = time.perf_counter()
+        try:
+            results = await self._in_thread(batch.execute_many, [conn_id for _, conn_id in items],
+                                             on_transfer=_record_transfer)
+        except Exception as e:
+            results = {conn_id: e for _, conn_id in items}
+        seconds = (time.perf_counter() - started) / len(items)
+
+        try:
+            for _, conn_id in items:
+                worker_metrics.observe("connection_seconds", seconds)
+                result = results.get(conn_id)
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    if result is None:
+                        worker_metrics.inc("connections_skipped")
+                        logger.error(f"Connection {conn_id} not found in database, already done or claimed by another worker")
+                        await self.queue.ack(conn_id)
+                    elif result:
+                        await self.queue.ack(conn_id)
+                        worker_metrics.inc("connections_executed")
+                        logger.info(f"Connection {conn_id} executed successfully")
+                    else:
+                        worker_metrics.inc("connections_failed")
+                        await self.handle_failure(conn_id, batch)
+                except Exception as e:
+                    # Left unacked, so it is retried when the lease expires
+                    worker_metrics.inc("connections_failed")
+                    logger.error(f"Failed to execute connection {conn_id}: {e}")
+        finally:
+            for _, conn_id in items:
+                self._release_components(batch, conn_id)
+
+    async def execute_due(self):
+        """execute_due_connections() as a task per connection instead of a thread per slot."""
+        logger.info("Starting async connection execution service")
+        next_report = time.monotonic() + LATENESS_REPORT_SECONDS
+        while True:
+            try:
+                # Sleeps until the next connection is due, a push of an earlier one, or a free slot
+                async for due in self.queue.iter_due_batches(
+                        lease_timeout=CONNECTION_LEASE_SECONDS, max_items=self._room,
+                        poll_interval=MAX_IDLE_SECONDS):
+                    batch = await self.load_batch([conn_id for _, conn_id in due])
+                    end_dates = {conn_id: end_date for end_date, conn_id in due}
+                    # One task per group of connections sharing a target, so their transfers fold
+                    for group in batch.groups(conn_id for _, conn_id in due):
+                        for conn_id in group:
+                            self._hold_components(batch, conn_id)
+                        keys = set(group).union(*(batch.target_ids(conn_id) for conn_id in group))
+                        task = self.executor.submit(keys, self.execute_connections,
+                                                    [(end_dates[conn_id], conn_id) for conn_id in group], batch)
+                        task.add_done_callback(self._on_connection_done)
+
+                    if time.monotonic() >= next_report:
+                        _report_lateness()
+                        next_report = time.monotonic() + LATENESS_REPORT_SECONDS
+            except Exception as e:
+                # Connections of a batch that failed to load stay leased and come back when it expires
+                logger.error(f"Error in connection execution loop: {e}")
+                await asyncio.sleep(10)
+
+
+async def _run():
+    # Created inside the loop it serves; every coroutine shares its pool
+    if MONGO_HOST == "localhost":
+        client = AsyncIOMotorClient(host="localhost", port=27017)
+    else:
+        client = AsyncIOMotorClient(host=MONGO_HOST, port=27017)
+    try:
+        await AsyncConnectionWorker(client).run()
+    finally:
+        client.close()
+
+
+def run_async_worker():
+    """Run the asyncio worker until the process is stopped."""
+    if AsyncIOMotorClient is None:
+        raise RuntimeError("WORKER_MODE=asyncio needs the motor package (pip install motor)")
+    logger.info("Starting Planitly asyncio worker")
+    asyncio.run(_run())
@@ -1,12 +1,23 @@
 import time
 from datetime import datetime, timedelta
 from pytz import UTC
-from models import Connection_db, Connection, MONGO_HOST
+from models import Connection_db, ConnectionBatch, release_stale_claims, record_connection_failure, FAILURE_RETRY, FAILURE_DEAD_LETTER, MONGO_HOST
+from mongoengine.queryset.visitor import Q
 import os
 import logging
-from .file_priority_queue import FilePriorityQueue
+from .file_priority_queue import FilePriorityQueue, BinaryCodec
+from .mmap_heap_queue import MmapHeapQueue
+from .timing_wheel import TimingWheel
+from .keyed_executor import KeyedExecutor
+from .wakeup import DeadlineWakeup
+from .worker_metrics import WorkerMetrics, STATS_FILENAME
+from consts import env_variables
 import tempfile
 import threading
+import functools
+import socket
+import uuid
+from collections import deque
 from dateutil import parser as date_parser
 import pytz
 
@@ -14,8 +25,303 @@ logging.basicConfig(level=logging.INFO,
                     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-queue_dir = os.path.join(tempfile.gettempdir(), "planitly_queue")
-connection_queue = FilePriorityQueue(directory=queue_dir, max_memory_items=100)
+
+def _parse_partition(value):
+    """(index, count) from a WORKER_PARTITION value "index/count"; (0, 1) when unset."""
+    if not value:
+        return 0, 1
+    index, count = (int(part) for part in value.split("/"))
+    if not 0 <= index < count:
+        raise ValueError(f"Invalid WORKER_PARTITION '{value}', expected 'index/count' with index < count")
+    return index, count
+
+
+# This process handles the owners with owner_bucket % PARTITION_COUNT == PARTITION_INDEX
+PARTITION_INDEX, PARTITION_COUNT = _parse_partition(env_variables['WORKER_PARTITION'])
+
+queue_root = os.path.join(tempfile.gettempdir(), "planitly_queue")
+queue_dir = queue_root
+if PARTITION_COUNT > 1:
+    # Every partition keeps its own queue (and resume token)
+    queue_dir = os.path.join(queue_root, f"partition-{PARTITION_INDEX}-of-{PARTITION_COUNT}")
+
+# A popped connection that is not acked within this many seconds (e.g. the worker
+# process died while executing it) is queued again for any worker
+CONNECTION_LEASE_SECONDS = 300
+# Connections run in parallel on this many threads, except those writing the same component
+CONNECTION_WORKERS = int(env_variables['CONNECTION_WORKERS'])
+# At most this many executor tasks (a connection, or connections sharing a target component)
+# are waiting or running; only that many batches of due connections are leased
+MAX_CONNECTIONS_IN_FLIGHT = CONNECTION_WORKERS * 4
+# The executor re-checks the queue at least this often (leases expiring, other processes' pushes)
+MAX_IDLE_SECONDS = 30
+# Connections starting later than this after their end_date are logged individually
+LATE_WARNING_SECONDS = 5
+LATENESS_REPORT_SECONDS = 60
+# How often claims abandoned by dead workers are looked for
+CLAIM_REAP_SECONDS = 60
+# Prefix of this process's claim tokens, so a stuck claim can be traced to its worker
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _connection_queue_directory(backend):
+    """Directory of the connection queue for a QUEUE_BACKEND setting ("file" or "mmap")."""
+    if backend == "mmap":
+        return os.path.join(queue_dir, "mmap")
+    if backend != "file":
+        raise ValueError(f"Unknown QUEUE_BACKEND '{backend}', expected 'file' or 'mmap'")
+    return queue_dir
+
+
+QUEUE_DIRECTORY = _connection_queue_directory(env_variables['QUEUE_BACKEND'])
+
+
+def _create_connection_queue():
+    """Build the connection queue for the QUEUE_BACKEND setting."""
+    if env_variables['QUEUE_BACKEND'] == "mmap":
+        return MmapHeapQueue(directory=QUEUE_DIRECTORY)
+    # Keyed by connection id: re-queueing a connection moves it instead of adding a duplicate
+    return FilePriorityQueue(
+        directory=QUEUE_DIRECTORY, max_memory_items=100, storage_mode="wal", keyed=True,
+        codec=BinaryCodec())
+
+
+# Opened by the first get_connection_queue() call, i.e. only in the worker process:
+# other processes import this module too (the API) and must not touch the queue files
+_connection_queue = None
+_connection_queue_lock = threading.Lock()
+
+
+def get_connection_queue():
+    """The worker's connection queue, opened on first use."""
+    global _connection_queue
+    if _connection_queue is None:
+        with _connection_queue_lock:
+            if _connection_queue is None:
+                _connection_queue = _create_connection_queue()
+    return _connection_queue
+
+
+# Change-stream resume token, kept next to the queue so the two are lost (or kept) together
+RESUME_TOKEN_PATH = os.path.join(QUEUE_DIRECTORY, "change_stream_token.json")
+# The token is rewritten at most this often; a crash replays at most this much of the stream
+RESUME_TOKEN_SAVE_SECONDS = 5
+# ChangeStreamFatalError and ChangeStreamHistoryLost: the token can no longer be resumed from
+RESUME_TOKEN_EXPIRED_CODES = (280, 286)
+RESUME_RETRY_SECONDS = 10
+# Connections due within this window are queued by the startup load and the periodic sync
+SYNC_WINDOW = timedelta(minutes=5)
+# The sync's scan for recently changed connections starts this long before its previous run,
+# covering clock skew between workers and the database
+SYNC_OVERLAP = timedelta(seconds=30)
+# The only fields a sync scan reads
+SCAN_FIELDS = ('id', 'end_date', 'retry_at')
+
+# In-memory schedule of the near-term connections; the queue above is the durable copy
+connection_wheel = TimingWheel()
+connection_executor = KeyedExecutor(max_workers=CONNECTION_WORKERS, thread_name_prefix="connection")
+# Interrupts the executor's sleep when an earlier connection is queued or the executor frees up
+connection_wakeup = DeadlineWakeup()
+_executor_saturated = threading.Event()
+
+# Written to queue_dir by execute_due_connections and served by GET /connections/metrics
+worker_metrics = WorkerMetrics(os.path.join(queue_dir, STATS_FILENAME), WORKER_ID)
+
+# Seconds between end_date and the start of execution, since the last lateness report
+_lateness = deque(maxlen=10000)
+
+# Components used by queued or running connections: id -> [Component_db, holder count].
+# New batches reuse these instances, so a connection never starts from a copy that is
+# older than what an earlier connection on the same component saved.
+_live_components = {}
+_live_components_lock = threading.Lock()
+
+
+def _due_time(end_date, retry_at=None):
+    """When a connection should run: its end_date, or later while it backs off after a failure."""
+    due = _to_utc(end_date)
+    if retry_at is not None:
+        due = max(due, _to_utc(retry_at))
+    return due
+
+
+def _partition_filter():
+    """Query filter for this process's connections; matches everything when not sharded."""
+    if PARTITION_COUNT == 1:
+        return Q()
+    owned = Q(owner_bucket__mod=(PARTITION_COUNT, PARTITION_INDEX))
+    if PARTITION_INDEX == 0:
+        # Connections saved before owner_bucket existed and not backfilled yet
+        owned |= Q(owner_bucket=None)
+    return owned
+
+
+def _partition_match():
+    """Change-stream $match stage for this process's connections."""
+    operations = {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}
+    if PARTITION_COUNT == 1:
+        return {"$match": operations}
+    # Deletes carry no document to partition by; cancelling an id another partition owns is a no-op
+    owned = [{"operationType": "delete"},
+             {"fullDocument.owner_bucket": {"$mod": [PARTITION_COUNT, PARTITION_INDEX]}}]
+    if PARTITION_INDEX == 0:
+        owned.append({"fullDocument.owner_bucket": {"$exists": False}})
+    return {"$match": {**operations, "$or": owned}}
+
+
+def _to_utc(date_val):
+    """Normalize a datetime to an aware UTC datetime so queue priorities stay comparable."""
+    if date_val.tzinfo is None:
+        return date_val.replace(tzinfo=UTC)
+    return date_val.astimezone(UTC)
+
+
+def _schedule_connections(items):
+    """Queue (end_date, connection id) pairs durably and in the timing wheel."""
+    items = list(items)
+    count = get_connection_queue().push_many(items)
+    for end_date, conn_id in items:
+        # Beyond the wheel's horizon only the durable queue holds it
+        connection_wheel.schedule(conn_id, end_date)
+    if items:
+        connection_wakeup.notify(min(end_date for end_date, _ in items))
+    return count
+
+
+def _unschedule_connection(conn_id):
+    """Drop a connection from the timing wheel and the durable queue."""
+    connection_wheel.cancel(conn_id)
+    return get_connection_queue().cancel(conn_id)
+
+
+def _load_batch(conn_ids):
+    """Claim due connections and load them, their transfers and components in a few queries.
+
+    Only connections this batch claimed are executed, so a connection queued twice or
+    popped by two workers runs once.
+    """
+    with _live_components_lock:
+        live = {component_id: entry[0] for component_id, entry in _live_components.items()}
+    return ConnectionBatch(conn_ids, components=live, claim_token=f"{WORKER_ID}:{uuid.uuid4().hex}")
+
+
+def _hold_components(batch, conn_id):
+    with _live_components_lock:
+        for component_id in batch.component_ids(conn_id):
+            entry = _live_components.setdefault(component_id, [batch.components[component_id], 0])
+            entry[1] += 1
+
+
+def _release_components(batch, conn_ids, _=None):
+    with _live_components_lock:
+        for conn_id in conn_ids:
+            for component_id in batch.component_ids(conn_id):
+                entry = _live_components.get(component_id)
+                if entry is not None:
+                    entry[1] -= 1
+                    if entry[1] <= 0:
+                        del _live_components[component_id]
+
+
+def _record_lateness(conn_id, end_date):
+    lateness = (datetime.now(UTC) - _to_utc(end_date)).total_seconds()
+    _lateness.append(lateness)
+    worker_metrics.observe("lag_seconds", lateness)
+    if lateness > LATE_WARNING_SECONDS:
+        logger.warning(f"Connection {conn_id} started {lateness:.1f}s after its end_date")
+
+
+def _report_lateness():
+    """Log lateness percentiles of the connections started since the last report."""
+    samples = []
+    while _lateness:
+        samples.append(_lateness.popleft())
+    if not samples:
+        return
+    samples.sort()
+    def percentile(p):
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+    logger.info(f"Connection lateness over {len(samples)} executions: "
+                f"p50={percentile(0.5):.2f}s p99={percentile(0.99):.2f}s max={samples[-1]:.2f}s")
+
+
+def _on_connection_done(_):
+    # Wakes the executor loop only when it is waiting for a free slot
+    if _executor_saturated.is_set() and connection_executor.pending() < MAX_CONNECTIONS_IN_FLIGHT:
+        _executor_saturated.clear()
+        connection_wakeup.notify()
+
+
+def _record_transfer(transfer, seconds, result):
+    worker_metrics.observe(f"transfer_seconds.{transfer.operation}", seconds)
+    if not result:
+        worker_metrics.inc(f"transfer_failures.{transfer.operation}")
+
+
+def _collect_gauges():
+    worker_metrics.set_gauge("queue_depth", get_connection_queue().size())
+    worker_metrics.set_gauge("queue_leased", get_connection_queue().in_flight())
+    worker_metrics.set_gauge("executor_pending", connection_executor.pending())
+    worker_metrics.set_gauge("wheel_size", len(connection_wheel))
+
+
+def _handle_connection_failure(conn_id, batch):
+    """Back off a failed connection in the queue, or leave it dead-lettered after MAX_ATTEMPTS."""
+    connection = batch.connection(conn_id)
+    outcome, retry_at = record_connection_failure(conn_id, batch.claim_token, connection.error)
+    if outcome == FAILURE_RETRY:
+        # Pushed before the ack, so the connection is never out of the queue in between
+        _schedule_connections([(retry_at, conn_id)])
+        worker_metrics.inc("connections_retried")
+        logger.warning(f"Connection {conn_id} failed ({connection.error}), retrying at {retry_at}")
+    elif outcome == FAILURE_DEAD_LETTER:
+        worker_metrics.inc("connections_dead_lettered")
+        logger.error(f"Connection {conn_id} failed ({connection.error}), moved to dead letters")
+    else:
+        # Released as stale and claimed elsewhere meanwhile; its holder records its own outcome
+        worker_metrics.inc("failure_claims_lost")
+        logger.warning(f"Connection {conn_id} failed ({connection.error}), but its claim was lost")
+    get_connection_queue().ack(conn_id)
+
+
+def _execute_connections(items, batch):
+    """Run leased (end_date, connection id) items as one unit and ack them; runs on the connection executor.
+
+    The items share target components (see ConnectionBatch.groups), so their transfers
+    can be folded into one write per component.
+    """
+    for end_date, conn_id in items:
+        _record_lateness(conn_id, end_date)
+        logger.info(f"Executing connection: {conn_id}")
+    started = time.perf_counter()
+    try:
+        results = batch.execute_many([conn_id for _, conn_id in items], on_transfer=_record_transfer)
+    except Exception as e:
+        results = {conn_id: e for _, conn_id in items}
+    seconds = (time.perf_counter() - started) / len(items)
+
+    for _, conn_id in items:
+        worker_metrics.observe("connection_seconds", seconds)
+        result = results.get(conn_id)
+        try:
+            if isinstance(result, Exception):
+                raise result
+            if result is None:
+                worker_metrics.inc("connections_skipped")
+                logger.error(f"Connection {conn_id} not found in database, already done or claimed by another worker")
+                get_connection_queue().ack(conn_id)
+                continue
+            if result:
+                get_connection_queue().ack(conn_id)
+                worker_metrics.inc("connections_executed")
+                logger.info(f"Connection {conn_id} executed successfully")
+            else:
+                worker_metrics.inc("connections_failed")
+                _handle_connection_failure(conn_id, batch)
+        except Exception as e:
+            # Left unacked, so it is retried when the lease expires
+            worker_metrics.inc("connections_failed")
+            logger.error(f"Failed to execute connection {conn_id}: {e}")
 
 
 def execute_due_connections():
@@ -23,54 +329,169 @@ def execute_due_connections():
     logger.info("Starting connection execution service")
 
     try:
-        # Initial load of all pending connections (including far future ones)
-        load_pending_connections()
-        
+        # Pending connections are loaded by the change-stream listener, and only when it
+        # cannot resume from its saved token
+        worker_metrics.start_writer(_collect_gauges)
+        next_report = time.monotonic() + LATENESS_REPORT_SECONDS
+        queue = get_connection_queue()
+
         while True:
             try:
-                item = connection_queue.peek()
                 current_time = datetime.now(UTC)
-                # Pop and process all due connections
-                while item:
-                    next_end_date, conn_id = item
-                    if next_end_date.tzinfo is None:
-                        next_end_date = next_end_date.replace(tzinfo=UTC)
-                    if next_end_date <= current_time:
-                        _, conn_id = connection_queue.pop()
-                        logger.info(f"Executing connection: {conn_id}")
-                        try:
-                            connection = Connection_db.objects(id=conn_id).first()
-                            connection_to_exec = Connection.from_db(connection)
-                            if not connection_to_exec:
-                                logger.error(f"Connection {conn_id} not found in database")
-                                item = connection_queue.peek()
-                                continue
-                            connection_to_exec.execute()
-                            logger.info(f"Connection {conn_id} executed successfully")
-                        except Exception as e:
-                            logger.error(f"Failed to execute connection {conn_id}: {e}")
-                        item = connection_queue.peek()
-                        current_time = datetime.now(UTC)
-                    else:
-                        break
-                # If no due connections, sleep until the next one or a short interval
-                if item:
-                    next_end_date, _ = item
-                    sleep_seconds = min((next_end_date - current_time).total_seconds(), 30)
-                    time.sleep(max(1, sleep_seconds))
-                else:
-                    logger.info("Connection queue empty, waiting for new connections")
-                    time.sleep(10)
+                # Only lease what the executor can start soon, so leases don't expire in its backlog
+                room = MAX_CONNECTIONS_IN_FLIGHT - connection_executor.pending()
+                due = []
+                if room > 0:
+                    # The wheel says which connections are due; they are leased from the durable
+                    # queue by id in one batch. pop_due then picks up what only the durable queue
+                    # holds (expired leases, connections queued by other worker processes).
+                    # Other workers sharing the queue skip leased connections until they are acked.
+                    expired = connection_wheel.advance(current_time)
+                    for conn_id in expired[room:]:
+                        # Over capacity: back in the wheel for the next round
+                        connection_wheel.schedule(conn_id, current_time)
+                    due = queue.claim_many(
+                        expired[:room], lease_timeout=CONNECTION_LEASE_SECONDS)
+                    if len(due) < room:
+                        due += queue.pop_due(
+                            current_time, max_items=room - len(due),
+                            lease_timeout=CONNECTION_LEASE_SECONDS)
+
+                if due:
+                    batch = _load_batch([conn_id for _, conn_id in due])
+                    end_dates = {conn_id: end_date for end_date, conn_id in due}
+                    # Connections of this batch sharing a target component run as one task, so
+                    # their transfers are folded; across batches they run one after another
+                    for group in batch.groups(conn_id for _, conn_id in due):
+                        for conn_id in group:
+                            connection_wheel.cancel(conn_id)
+                            _hold_components(batch, conn_id)
+                        keys = set(group).union(*(batch.target_ids(conn_id) for conn_id in group))
+                        future = connection_executor.submit(
+                            keys, _execute_connections,
+                            [(end_dates[conn_id], conn_id) for conn_id in group], batch)
+                        future.add_done_callback(functools.partial(_release_components, batch, group))
+                        future.add_done_callback(_on_connection_done)
+
+                if time.monotonic() >= next_report:
+                    _report_lateness()
+                    next_report = time.monotonic() + LATENESS_REPORT_SECONDS
+
+                # Sleep until the next connection is due, a push of an earlier one, or a free slot
+                if connection_executor.pending() >= MAX_CONNECTIONS_IN_FLIGHT:
+                    _executor_saturated.set()
+                    # Re-check after setting the flag: a task may have finished in between
+                    if connection_executor.pending() < MAX_CONNECTIONS_IN_FLIGHT:
+                        continue
+                    connection_wakeup.wait(max_wait=MAX_IDLE_SECONDS)
+                    continue
+                item = queue.peek()
+                next_due = _to_utc(item[0]) if item else None
+                connection_wakeup.wait(next_due, max_wait=MAX_IDLE_SECONDS)
             except Exception as e:
                 logger.error(f"Error in connection execution loop: {e}")
                 time.sleep(10)
     except Exception as e:
         logger.error(f"Fatal error in execute_due_connections: {e}")
 
+def _load_resume_token():
+    """Return the saved change-stream resume token, or None if there is none or it is unreadable."""
+    from bson import json_util
+    try:
+        with open(RESUME_TOKEN_PATH, "r") as f:
+            return json_util.loads(f.read())
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.error(f"Ignoring unreadable resume token {RESUME_TOKEN_PATH}: {e}")
+        return None
+
+
+def _save_resume_token(token):
+    """Atomically replace the saved resume token (write a temp file, fsync, rename)."""
+    from bson import json_util
+    temp_path = RESUME_TOKEN_PATH + ".tmp"
+    with open(temp_path, "w") as f:
+        f.write(json_util.dumps(token))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, RESUME_TOKEN_PATH)
+
+
+def _drop_resume_token():
+    try:
+        os.remove(RESUME_TOKEN_PATH)
+    except FileNotFoundError:
+        pass
+
+
+def _classify_connection_change(change):
+    """(connection id, due time) for a change-stream event, or None if it changes nothing.
+
+    The due time is None when the connection has to leave the queue (deleted, done or
+    rescheduled beyond SYNC_WINDOW).
+    """
+    import bson
+
+    doc = change.get("fullDocument")
+    if doc and doc.get("claim_token"):
+        # A worker claimed it and is executing it (or it failed and waits for the reaper)
+        return None
+    if change.get("operationType") == "delete" or (doc and doc.get("done", False)):
+        # Deleted or already executed, nothing left to run
+        doc_id = change.get("documentKey", {}).get("_id")
+        return (str(doc_id), None) if doc_id is not None else None
+    if not doc:
+        return None
+    print (f"Change detected: {doc}")
+    end_date = doc.get("end_date")
+    # Always parse and convert to UTC
+    if isinstance(end_date, str):
+        dt = date_parser.parse(end_date)
+        if dt.tzinfo is None:
+            end_date = pytz.UTC.localize(dt)
+        else:
+            end_date = dt.astimezone(pytz.UTC)
+    elif isinstance(end_date, bson.datetime.datetime):
+        if end_date.tzinfo is None:
+            end_date = end_date.replace(tzinfo=UTC)
+        else:
+            end_date = end_date.astimezone(UTC)
+    # Backing off after a failed attempt
+    end_date = _due_time(end_date, doc.get("retry_at"))
+    doc_id = str(doc.get("id", doc.get("_id")))
+    if end_date <= datetime.now(UTC) + SYNC_WINDOW:
+        return doc_id, end_date
+    # Rescheduled out of the window; the periodic sync queues it again later
+    logger.info(f"Ignored connection with end_date {end_date} (more than 5 minutes in the future)")
+    return doc_id, None
+
+
+def _handle_connection_change(change):
+    """Queue, move or drop the connection a change-stream event is about."""
+    action = _classify_connection_change(change)
+    if action is None:
+        return
+    conn_id, due = action
+    if due is None:
+        if _unschedule_connection(conn_id):
+            logger.info(f"Removed connection {conn_id} from queue")
+    else:
+        _schedule_connections([(due, conn_id)])
+        logger.info(f"Queued new/updated connection {conn_id} for {due}")
+
+
 def listen_for_connection_changes():
-    """Listen for new/updated connections and add them to the queue."""
+    """Listen for new/updated connections and add them to the queue.
+
+    The stream resumes after the last event saved in RESUME_TOKEN_PATH, so writes made
+    while the worker is down are replayed on start. A stream only replays writes, not
+    connections that came due meanwhile, so load_pending_connections() runs on the first
+    open and whenever there is no usable token; the stream is opened first so nothing
+    between the scan and the stream is missed.
+    """
     from pymongo import MongoClient
-    import bson
+    from pymongo.errors import OperationFailure
 
     # Use pymongo for change streams
     if MONGO_HOST == "localhost":
@@ -82,96 +503,161 @@ def listen_for_connection_changes():
 
     collection = db["connections"]
 
-    logger.info("Listening for connection changes...")
-    try:
-        with collection.watch(
-            [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}],
-            full_document='updateLookup'
-        ) as stream:
-            for change in stream:
-                try:
-                    doc = change.get("fullDocument")
-                    if doc and not doc.get("done", False):
-                        print (f"Change detected: {doc}")
-                        end_date = doc.get("end_date")
-                        # Always parse and convert to UTC
-                        if isinstance(end_date, str):
-                            dt = date_parser.parse(end_date)
-                            if dt.tzinfo is None:
-                                end_date = pytz.UTC.localize(dt)
-                            else:
-                                end_date = dt.astimezone(pytz.UTC)
-                        elif isinstance(end_date, bson.datetime.datetime):
-                            if end_date.tzinfo is None:
-                                end_date = end_date.replace(tzinfo=UTC)
-                            else:
-                                end_date = end_date.astimezone(UTC)
-                        now = datetime.now(UTC)
-                        five_minutes_later = now + timedelta(minutes=5)
-                        if end_date <= five_minutes_later:
-                            doc_id = doc.get("id", doc.get("_id"))
-                            connection_queue.push(end_date, str(doc_id))
-                            logger.info(f"Queued new/updated connection {doc_id} for {end_date}")
-                        else:
-                            logger.info(f"Ignored connection with end_date {end_date} (more than 5 minutes in the future)")
-                except Exception as e:
-                    logger.error(f"Error processing change stream event: {e}")
-    except Exception as e:
-        logger.error(f"Change stream listener stopped: {e}")
+    scanned = False
+    while True:
+        resume_token = _load_resume_token()
+        try:
+            with collection.watch(
+                [_partition_match()],
+                full_document='updateLookup',
+                resume_after=resume_token
+            ) as stream:
+                if resume_token is None:
+                    logger.info("No change stream resume token, scanning pending connections")
+                else:
+                    logger.info("Resumed connection change stream from saved token")
+                if resume_token is None or not scanned:
+                    # Connections that came due while the worker was down produce no event
+                    load_pending_connections()
+                    scanned = True
+                if resume_token is None and stream.resume_token is not None:
+                    _save_resume_token(stream.resume_token)
+                logger.info("Listening for connection changes...")
+
+                saved_token = stream.resume_token
+                last_save = time.monotonic()
+                while stream.alive:
+                    # Returns None after an idle getMore; the token still advances past
+                    # unrelated oplog entries, so idle streams keep a fresh token too
+                    change = stream.try_next()
+                    if change is not None:
+                        try:
+                            _handle_connection_change(change)
+                        except Exception as e:
+                            logger.error(f"Error processing change stream event: {e}")
+                    # Saved only after the event is queued: a crash replays it rather than losing it
+                    token = stream.resume_token
+                    if token != saved_token and time.monotonic() - last_save >= RESUME_TOKEN_SAVE_SECONDS:
+                        _save_resume_token(token)
+                        saved_token = token
+                        last_save = time.monotonic()
+        except OperationFailure as e:
+            if e.code in RESUME_TOKEN_EXPIRED_CODES:
+                # The oplog no longer holds the token's position: fall back to a full scan
+                logger.warning(f"Change stream resume token expired ({e.code}), rescanning")
+                _drop_resume_token()
+                continue
+            logger.error(f"Change stream listener stopped: {e}")
+        except Exception as e:
+            logger.error(f"Change stream listener stopped: {e}")
+        time.sleep(RESUME_RETRY_SECONDS)
+
+
+def reap_stale_claims():
+    """Periodically release claims abandoned by dead workers and queue those connections again."""
+    while True:
+        time.sleep(CLAIM_REAP_SECONDS)
+        try:
+            released = release_stale_claims(_partition_filter())
+            if released:
+                _schedule_connections([(_to_utc(end_date), str(conn_id)) for conn_id, end_date in released])
+                worker_metrics.inc("claims_reaped", len(released))
+                logger.warning(f"Released {len(released)} stale connection claims")
+        except Exception as e:
+            logger.error(f"Error reaping stale connection claims: {e}")
+
+
+def _pending_connections(query):
+    """Queryset of this partition's pending, unclaimed connections matching query."""
+    # Claimed ones are running; the reaper queues them again if their worker died
+    return Connection_db.objects(_partition_filter() & query, done=False, claim_token=None)
+
+
+def _due_items(docs, until):
+    """(due time, id) of the raw connection documents that are due by until."""
+    due = []
+    for doc in docs:
+        due_time = _due_time(doc['end_date'], doc.get('retry_at'))
+        if due_time <= until:
+            due.append((due_time, str(doc['_id'])))
+    return due
+
+
+def _scan_due_connections(query, until):
+    """(due time, id) of this partition's pending connections matching query and due by until.
+
+    Reads only _id, end_date and retry_at through a projection; nothing is hydrated.
+    """
+    return _due_items(
+        _pending_connections(query).only(*SCAN_FIELDS).as_pymongo(), until)
+
+
+def _pending_query(until):
+    """Connections overdue or coming due by until, as read on startup (no resume token)."""
+    return Q(end_date__lte=until) | Q(retry_at__lte=until)
+
+
+def _sync_queries(watermark, last_run, until):
+    """The range scans of a periodic sync run (see periodic_sync_connections).
+
+    Without a watermark (the process's first run) it is the full pending scan, overdue
+    connections included.
+    """
+    if watermark is None:
+        return (_pending_query(until),)
+    entered = (Q(end_date__gt=watermark, end_date__lte=until)
+               | Q(retry_at__gt=watermark, retry_at__lte=until))
+    changed = Q(updated_at__gte=last_run - SYNC_OVERLAP) & _pending_query(until)
+    return entered, changed
 
 
 def load_pending_connections():
     """Load pending connections from database into the file-based queue."""
     try:
         current_time = datetime.now(UTC)
-        pending_connections = Connection_db.objects(
-            done=False,
-            end_date__lte=current_time
-        )
-        for conn in pending_connections:
-            connection_queue.push(conn.end_date, str(conn.id))
-        # Also add near-future connections
-        future_time = current_time + timedelta(minutes=5)
-        future_connections = Connection_db.objects(
-            done=False,
-            end_date__gt=current_time,
-            end_date__lte=future_time
-        )
-        for conn in future_connections:
-            connection_queue.push(conn.end_date, str(conn.id))
+        # Overdue connections plus near-future ones, queued as a single batch
+        future_time = current_time + SYNC_WINDOW
+        with worker_metrics.timer("load_pending_seconds"):
+            # Materialize first so the queue lock is not held while the cursor fetches
+            _schedule_connections(_scan_due_connections(_pending_query(future_time), future_time))
     except Exception as e:
+        worker_metrics.inc("load_pending_failures")
         logger.error(f"Error loading pending connections: {e}")
 
 
 def add_to_queue(connection):
-    """Add a connection to the queue if it's not already there."""
+    """Add a connection to the queue, or move it if it is already queued."""
     conn_id = str(connection.id)
-    connection_queue.push(
-        (connection.end_date, 0, conn_id))
+    _schedule_connections([(_to_utc(connection.end_date), conn_id)])
     logger.info(f"Added connection {conn_id} to queue, scheduled for {connection.end_date}")
 
 def periodic_sync_connections():
-    """Periodically sync all connections with end_date in the next 5 minutes."""
+    """Periodically queue the connections that come due in the next SYNC_WINDOW.
+
+    Each run is two indexed range scans: connections whose end_date (or retry_at) entered
+    the window since the previous run's watermark, and connections changed since the
+    previous run (a safety net for change-stream events the listener missed). The first
+    run of a process has no watermark and scans everything pending up to its window, so
+    connections that came due while no worker ran are queued even if the startup load failed.
+    """
+    watermark = last_run = None
     time.sleep(5 * 60)  # Initial delay
     while True:
         try:
             logger.info("Running periodic connection sync...")
             start_time = datetime.now(UTC)
-            end_time = start_time + timedelta(minutes=5)
-            # Fetch connections with end_date in the next 5 minutes and not done
-            upcoming_connections = Connection_db.objects(
-                done=False,
-                end_date__gt=start_time,
-                end_date__lte=end_time
-            )
-            synced_count = 0
-            for conn in upcoming_connections:
-                connection_queue.push(conn.end_date, str(conn.id))
-                synced_count += 1
+            end_time = start_time + SYNC_WINDOW
+            with worker_metrics.timer("sync_seconds"):
+                synced_count = _schedule_connections(
+                    [item for query in _sync_queries(watermark, last_run, end_time)
+                     for item in _scan_due_connections(query, end_time)])
+            watermark, last_run = end_time, start_time
+            worker_metrics.set_gauge("sync_last_count", synced_count)
             logger.info(f"Periodic sync completed: {synced_count} connections processed")
             elapsed = (datetime.now(UTC) - start_time).total_seconds()
             sleep_time = max(0, 5 * 60 - elapsed)
             time.sleep(sleep_time)
         except Exception as e:
+            worker_metrics.inc("sync_failures")
             logger.error(f"Error in periodic sync: {e}")
             time.sleep(60)  # Wait 1 minute on error
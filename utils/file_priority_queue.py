@@ -7,20 +7,363 @@ import time
 import uuid
 import shutil
 import heapq
-from typing import Any, TypeVar, Generic, List, Tuple, Optional, Dict
+import struct
+import zlib
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from itertools import accumulate, repeat
+from typing import Any, TypeVar, Generic, Iterable, List, Tuple, Optional, Dict
 
 T = TypeVar('T')  # Type for the priority key
 V = TypeVar('V')  # Type for the value
 
+# Write-ahead log record header: payload length and CRC32 of the payload
+WAL_HEADER = struct.Struct(">II")
+STORAGE_MODES = ("snapshot", "wal")
+# Bumped in the process lock file by every process that changes the queue on disk
+GENERATION = struct.Struct(">Q")
+
+
+class CodecError(ValueError):
+    """Raised when data cannot be encoded, or a payload fails its checksum or does not decode."""
+
+
+class PickleCodec:
+    """Serializes queue files with pickle. Handles any picklable priority and value."""
+
+    name = "pickle"
+
+    def encode(self, obj) -> bytes:
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, payload: bytes):
+        if payload[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+            # Written by BinaryCodec, e.g. before switching codecs back
+            return BinaryCodec().decode(payload)
+        try:
+            return pickle.loads(payload)
+        except Exception as e:
+            # Garbage can fail to unpickle in many ways
+            raise CodecError(f"Corrupted pickle payload: {e}") from e
+
+    def encode_entries(self, entries: list) -> bytes:
+        return self.encode(entries)
+
+    def decode_entries(self, payload: bytes) -> list:
+        return self.decode(payload)
+
+
+BINARY_MAGIC = b"FPQB"
+# Magic, payload kind, CRC32 of the body
+BINARY_HEADER = struct.Struct("<4scI")
+U32 = struct.Struct("<I")
+INT64 = struct.Struct("<q")
+FLOAT64 = struct.Struct("<d")
+COLUMN_HEADER = struct.Struct("<cI")
+# Datetimes are stored as the 10-byte field encoding datetime itself uses for pickling;
+# datetime(fields, tzinfo) rebuilds them in C, far faster than epoch arithmetic
+DATETIME_SIZE = 10
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+
+def _datetime_fields(value: datetime) -> bytes:
+    """Return the 10-byte field encoding of a datetime; aware ones are normalized to UTC first."""
+    if value.tzinfo is not None and value.utcoffset():
+        value = value.astimezone(timezone.utc)
+    return value.__reduce__()[1][0]
+
+
+class BinaryCodec:
+    """Compact, pickle-free codec with a CRC32 over every payload.
+
+    Lists of heap entries (chunks, the buffer) are stored column-wise: priorities,
+    counters and values each become one packed array when they share a type
+    (int, float, datetime or str), and length-prefixed tagged records otherwise.
+    Everything else (index, log records) uses the same tagged encoding, which covers
+    None, bool, int, float, str, bytes, datetime, list, tuple and dict.
+
+    Files written by pickle are still read when read_pickle is True (the default),
+    so existing queues can switch codecs.
+    """
+
+    name = "binary"
+
+    def __init__(self, read_pickle: bool = True):
+        self.read_pickle = read_pickle
+
+    # -------------------------------------------------------------- framing
+
+    def encode(self, obj) -> bytes:
+        body = bytearray()
+        self._encode_value(obj, body)
+        return self._frame(b"V", body)
+
+    def encode_entries(self, entries: list) -> bytes:
+        body = bytearray(U32.pack(len(entries)))
+        if entries:
+            priorities, counters, values = zip(*entries)
+            self._encode_column(priorities, body)
+            self._encode_column(counters, body)
+            self._encode_column(values, body)
+        return self._frame(b"E", body)
+
+    def decode(self, payload: bytes):
+        kind, body = self._unframe(payload)
+        if kind is None:
+            return self._decode_pickle(payload)
+        try:
+            if kind == b"E":
+                return self._decode_entries_body(body)
+            value, _ = self._decode_value(body, 0)
+            return value
+        except (struct.error, UnicodeDecodeError, IndexError, OverflowError, ValueError, TypeError) as e:
+            raise CodecError(f"Malformed binary payload: {e}") from e
+
+    def decode_entries(self, payload: bytes) -> list:
+        return self.decode(payload)
+
+    def _frame(self, kind: bytes, body: bytearray) -> bytes:
+        return BINARY_HEADER.pack(BINARY_MAGIC, kind, zlib.crc32(body)) + bytes(body)
+
+    def _unframe(self, payload: bytes):
+        if payload[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+            return None, None
+        if len(payload) < BINARY_HEADER.size:
+            raise CodecError("Truncated binary payload")
+        _, kind, crc = BINARY_HEADER.unpack_from(payload, 0)
+        body = memoryview(payload)[BINARY_HEADER.size:]
+        if zlib.crc32(body) != crc:
+            raise CodecError("Checksum mismatch")
+        return kind, body
+
+    def _decode_pickle(self, payload: bytes):
+        if not self.read_pickle:
+            raise CodecError("Not a binary payload and reading pickle is disabled")
+        try:
+            return pickle.loads(payload)
+        except Exception as e:
+            # Garbage can fail to unpickle in many ways
+            raise CodecError(f"Corrupted pickle payload: {e}") from e
+
+    # -------------------------------------------------------------- columns
+
+    def _encode_column(self, column: tuple, out: bytearray) -> None:
+        first = type(column[0])
+        same_type = all(type(item) is first for item in column)
+        n = len(column)
+
+        if same_type and first is int and INT64_MIN <= min(column) and max(column) <= INT64_MAX:
+            tag, data = b"q", struct.pack(f"<{n}q", *column)
+        elif same_type and first is float:
+            tag, data = b"f", struct.pack(f"<{n}d", *column)
+        elif same_type and first is str and self._is_hex_column(column):
+            # Ids such as ObjectId strings: store the raw bytes, half the size
+            width = len(column[0]) // 2
+            tag, data = b"x", U32.pack(width) + bytes.fromhex("".join(column))
+        elif same_type and first is str:
+            raw = [item.encode("utf-8") for item in column]
+            tag, data = b"s", struct.pack(f"<{n}I", *map(len, raw)) + b"".join(raw)
+        elif all(isinstance(item, datetime) for item in column) and \
+                len({item.tzinfo is None for item in column}) == 1:
+            tag = b"n" if column[0].tzinfo is None else b"D"
+            data = b"".join(_datetime_fields(item) for item in column)
+        else:
+            # Mixed types: one length-prefixed tagged record per item
+            tag, records = b"v", bytearray()
+            for item in column:
+                record = bytearray()
+                self._encode_value(item, record)
+                records += U32.pack(len(record)) + record
+            data = bytes(records)
+
+        out += COLUMN_HEADER.pack(tag, len(data)) + data
+
+    @staticmethod
+    def _is_hex_column(column: tuple) -> bool:
+        width = len(column[0])
+        if not width or width % 2 or any(len(item) != width for item in column):
+            return False
+        joined = "".join(column)
+        try:
+            # Only lowercase hex survives the round trip unchanged
+            return bytes.fromhex(joined).hex() == joined
+        except ValueError:
+            return False
+
+    def _decode_column(self, body, pos: int, n: int):
+        tag, length = COLUMN_HEADER.unpack_from(body, pos)
+        pos += COLUMN_HEADER.size
+        end = pos + length
+        if end > len(body):
+            raise CodecError("Truncated column")
+
+        if tag == b"q":
+            column = struct.unpack_from(f"<{n}q", body, pos)
+        elif tag == b"f":
+            column = struct.unpack_from(f"<{n}d", body, pos)
+        # The per-item work below runs through struct and map, so it stays in C
+        elif tag == b"x":
+            (width,) = U32.unpack_from(body, pos)
+            column = list(map(bytes.hex, struct.unpack_from(f"{width}s" * n, body, pos + U32.size)))
+        elif tag == b"s":
+            lengths = struct.unpack_from(f"<{n}I", body, pos)
+            start = pos + 4 * n
+            if min(lengths) == max(lengths):
+                raw = struct.unpack_from(f"{lengths[0]}s" * n, body, start)
+                column = list(map(bytes.decode, raw))
+            else:
+                blob = bytes(body[start:end])
+                offsets = [0, *accumulate(lengths)]
+                column = [blob[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])]
+        elif tag in (b"D", b"n"):
+            fields = struct.unpack_from(f"{DATETIME_SIZE}s" * n, body, pos)
+            if tag == b"D":
+                column = list(map(datetime, fields, repeat(timezone.utc)))
+            else:
+                column = list(map(datetime, fields))
+        elif tag == b"v":
+            column, offset = [], pos
+            for _ in range(n):
+                (size,) = U32.unpack_from(body, offset)
+                offset += U32.size
+                value, _ = self._decode_value(body[offset:offset + size], 0)
+                column.append(value)
+                offset += size
+        else:
+            raise CodecError(f"Unknown column type {tag!r}")
+        return column, end
+
+    def _decode_entries_body(self, body) -> list:
+        (count,) = U32.unpack_from(body, 0)
+        if not count:
+            return []
+        pos = U32.size
+        priorities, pos = self._decode_column(body, pos, count)
+        counters, pos = self._decode_column(body, pos, count)
+        values, pos = self._decode_column(body, pos, count)
+        return list(zip(priorities, counters, values))
+
+    # -------------------------------------------------------------- tagged values
+
+    def _encode_value(self, value, out: bytearray) -> None:
+        if value is None:
+            out += b"N"
+        elif value is True:
+            out += b"T"
+        elif value is False:
+            out += b"F"
+        elif isinstance(value, int):
+            if INT64_MIN <= value <= INT64_MAX:
+                out += b"i" + INT64.pack(value)
+            else:
+                raw = str(value).encode("ascii")
+                out += b"I" + U32.pack(len(raw)) + raw
+        elif isinstance(value, float):
+            out += b"f" + FLOAT64.pack(value)
+        elif isinstance(value, str):
+            raw = value.encode("utf-8")
+            out += b"s" + U32.pack(len(raw)) + raw
+        elif isinstance(value, bytes):
+            out += b"b" + U32.pack(len(value)) + value
+        elif isinstance(value, datetime):
+            out += (b"n" if value.tzinfo is None else b"D") + _datetime_fields(value)
+        elif isinstance(value, (list, tuple)):
+            out += (b"l" if isinstance(value, list) else b"t") + U32.pack(len(value))
+            for item in value:
+                self._encode_value(item, out)
+        elif isinstance(value, dict):
+            out += b"m" + U32.pack(len(value))
+            for key, item in value.items():
+                self._encode_value(key, out)
+                self._encode_value(item, out)
+        else:
+            raise CodecError(f"BinaryCodec cannot encode {type(value).__name__}")
+
+    def _decode_value(self, data, pos: int):
+        tag = bytes(data[pos:pos + 1])
+        pos += 1
+        if tag == b"N":
+            return None, pos
+        if tag == b"T":
+            return True, pos
+        if tag == b"F":
+            return False, pos
+        if tag == b"i":
+            return INT64.unpack_from(data, pos)[0], pos + INT64.size
+        if tag == b"f":
+            return FLOAT64.unpack_from(data, pos)[0], pos + FLOAT64.size
+        if tag in (b"D", b"n"):
+            fields = bytes(data[pos:pos + DATETIME_SIZE])
+            if len(fields) != DATETIME_SIZE:
+                raise CodecError("Truncated datetime")
+            if tag == b"D":
+                return datetime(fields, timezone.utc), pos + DATETIME_SIZE
+            return datetime(fields), pos + DATETIME_SIZE
+        if tag in (b"s", b"b", b"I"):
+            (size,) = U32.unpack_from(data, pos)
+            pos += U32.size
+            raw = bytes(data[pos:pos + size])
+            if len(raw) != size:
+                raise CodecError("Truncated value")
+            if tag == b"s":
+                return raw.decode("utf-8"), pos + size
+            if tag == b"I":
+                return int(raw.decode("ascii")), pos + size
+            return raw, pos + size
+        if tag in (b"l", b"t"):
+            (count,) = U32.unpack_from(data, pos)
+            pos += U32.size
+            items = []
+            for _ in range(count):
+                item, pos = self._decode_value(data, pos)
+                items.append(item)
+            return (items if tag == b"l" else tuple(items)), pos
+        if tag == b"m":
+            (count,) = U32.unpack_from(data, pos)
+            pos += U32.size
+            mapping = {}
+            for _ in range(count):
+                key, pos = self._decode_value(data, pos)
+                mapping[key], pos = self._decode_value(data, pos)
+            return mapping, pos
+        raise CodecError(f"Unknown value type {tag!r}")
+
 
 class FilePriorityQueue(Generic[T, V]):
-    """A fully crash-safe file-based priority queue implementation with thread safety and heap optimization."""
+    """A fully crash-safe file-based priority queue implementation with thread safety and heap optimization.
+
+    Two storage modes are supported:
+    - "snapshot" (default): every push/pop rewrites the buffer (or the touched chunk) on disk.
+    - "wal": every push/pop appends a small record to a segment log; the buffer, index and
+      chunks popped from are only rewritten at checkpoints, and the log tail is replayed on start.
+
+    With keyed=True each value identifies its entry: pushing a value that is already queued
+    moves it to the new priority instead of adding a duplicate, and cancel(value) removes it.
+    Keyed queues also support leased pops: pop(lease_timeout=...) keeps the item in flight
+    until ack(value), and puts it back if the lease expires first.
+
+    Several processes can share one directory. Every operation holds an flock on queue.lock,
+    and a process reloads its in-memory state when another process changed the queue since.
+
+    Files are serialized by the codec (PickleCodec by default; BinaryCodec is smaller, faster
+    for datetime/str items and never unpickles what it reads when read_pickle=False).
+    """
 
     def __init__(self, directory: str = None, max_memory_items: int = 100,
-                 flush_threshold: int = 10, recovery_check: bool = True):
+                 flush_threshold: int = 10, recovery_check: bool = True,
+                 storage_mode: str = "snapshot", checkpoint_interval: int = 1000,
+                 keyed: bool = False, codec=None):
+        if storage_mode not in STORAGE_MODES:
+            raise ValueError(
+                f"Unknown storage mode '{storage_mode}'. Expected one of {STORAGE_MODES}.")
+
         self.directory = directory or tempfile.mkdtemp()
         self.max_memory_items = max_memory_items
         self.flush_threshold = flush_threshold
+        self.storage_mode = storage_mode
+        self.checkpoint_interval = checkpoint_interval
+        self.keyed = keyed
+        self.codec = codec or PickleCodec()
         self.lock = threading.RLock()
 
         # Ensure directory exists
@@ -34,11 +377,14 @@ class FilePriorityQueue(Generic[T, V]):
         self.data_dir = os.path.join(self.directory, "data")
         self.temp_dir = os.path.join(self.directory, "temp")
         self.lock_dir = os.path.join(self.directory, "locks")
+        self.wal_dir = os.path.join(self.directory, "wal")
 
         # Create necessary directories
         os.makedirs(self.data_dir, exist_ok=True)
         os.makedirs(self.temp_dir, exist_ok=True)
         os.makedirs(self.lock_dir, exist_ok=True)
+        if self.storage_mode == "wal":
+            os.makedirs(self.wal_dir, exist_ok=True)
 
         # Counter for tie-breaking equal priorities
         self.counter = 0
@@ -48,12 +394,111 @@ class FilePriorityQueue(Generic[T, V]):
 
         # Count of items added to buffer since last persistence
         self.buffer_count = 0
+        # Buffer entries with a lower counter were already consolidated into a chunk
+        self.buffer_floor = 0
+        self._buffer_dirty = False
+
+        # Per-chunk summary kept in the index: item count, head entry and checksum
+        self.chunk_meta: Dict[str, Dict[str, Any]] = {}
+
+        # Keyed mode: value -> (chunk path or None for the buffer, counter, priority)
+        self.key_index: Dict[V, Tuple[Optional[str], int, T]] = {}
+        self._counter_keys: Dict[int, V] = {}
+        self._key_index_missing = False
+
+        # Decoded chunks that were popped from since the last checkpoint (WAL mode only)
+        self._chunk_cache: Dict[str, list] = {}
+        self._dirty_chunks = set()
+        self._obsolete_chunks: List[str] = []
+
+        # Write-ahead log state: first segment not covered by the checkpoint
+        self.wal_segment = 0
+        self._wal_file = None
+        self._wal_records = 0
+
+        # Leased (popped but not yet acked) items: value -> (priority, deadline as unix time)
+        self.leases: Dict[V, Tuple[T, float]] = {}
+        self._leases_dirty = False
+
+        # Cross-process lock; its first bytes hold the generation of the state on disk
+        self.process_lock_path = os.path.join(self.directory, "queue.lock")
+        self._lock_fd = os.open(self.process_lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._lock_depth = 0
+        self._generation = None
+        self._modified = False
 
         # Initialize or load existing data
-        if recovery_check:
-            self._perform_recovery()
+        with self._process_lock(sync=False):
+            if recovery_check:
+                self._perform_recovery()
+            self._load_state()
+            self._generation = self._read_generation()
+
+    def _load_state(self, checkpoint_replay: bool = True) -> None:
         self._initialize_index()
         self._load_buffer()
+        if self.keyed:
+            self._load_key_index()
+        if self.storage_mode == "wal":
+            self._replay_wal(checkpoint_replay)
+
+    @contextmanager
+    def _process_lock(self, sync: bool = True):
+        """Hold the thread lock and the cross-process lock, reloading state another process changed."""
+        with self.lock:
+            if self._lock_depth:
+                # Re-entered from another operation of this queue
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX)
+            self._lock_depth = 1
+            try:
+                if sync and self._read_generation() != self._generation:
+                    self._reload()
+                yield
+            finally:
+                self._lock_depth = 0
+                self._modified = False
+                fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _read_generation(self) -> int:
+        data = os.pread(self._lock_fd, GENERATION.size, 0)
+        return GENERATION.unpack(data)[0] if len(data) == GENERATION.size else 0
+
+    def _mark_modified(self) -> None:
+        """Bump the on-disk generation before the first write of an operation.
+
+        Done before writing rather than after, so a process that dies mid-operation
+        still makes the others reload whatever it managed to write.
+        """
+        if self._lock_depth and not self._modified:
+            self._generation = self._read_generation() + 1
+            os.pwrite(self._lock_fd, GENERATION.pack(self._generation), 0)
+            self._modified = True
+
+    def _reload(self) -> None:
+        """Drop the in-memory state and load the queue another process left on disk."""
+        if self._wal_file is not None:
+            self._wal_file.close()
+            self._wal_file = None
+        self.buffer = []
+        self._buffer_dirty = False
+        self.key_index = {}
+        self._counter_keys = {}
+        self._chunk_cache = {}
+        self._dirty_chunks = set()
+        self._obsolete_chunks = []
+        self.leases = {}
+        self._leases_dirty = False
+        self._wal_records = 0
+        # The other process checkpoints on its own schedule; just replay its log tail
+        self._load_state(checkpoint_replay=False)
+        self._generation = self._read_generation()
 
     def _get_lock_file(self, operation: str, chunk_id: Optional[str] = None) -> str:
         """Get a lock file path for a specific operation and chunk."""
@@ -137,8 +582,8 @@ class FilePriorityQueue(Generic[T, V]):
                 if os.path.isfile(temp_file):
                     os.remove(temp_file)
 
-    def _safe_read_pickle(self, filepath: str, default=None):
-        """Safely read a pickle file with error handling."""
+    def _safe_read(self, filepath: str, default=None, entries: bool = False):
+        """Read and decode a file, returning default when it is missing or fails verification."""
         if not os.path.exists(filepath):
             return default
 
@@ -146,14 +591,26 @@ class FilePriorityQueue(Generic[T, V]):
             with open(filepath, 'rb') as f:
                 fcntl.flock(f, fcntl.LOCK_EX)
                 try:
-                    return pickle.load(f)
+                    payload = f.read()
                 finally:
                     fcntl.flock(f, fcntl.LOCK_UN)
-        except (pickle.PickleError, EOFError, AttributeError):
-            # File might be corrupted
+        except OSError:
             return default
 
-    def _safe_write_pickle(self, data, filepath: str, temp_filepath: str = None) -> bool:
+        try:
+            if entries:
+                return self.codec.decode_entries(payload)
+            return self.codec.decode(payload)
+        except CodecError:
+            # Checksum mismatch or truncated file
+            return default
+
+    def _safe_write(self, data, filepath: str, temp_filepath: str = None, entries: bool = False) -> bool:
+        payload = self.codec.encode_entries(data) if entries else self.codec.encode(data)
+        return self._safe_write_bytes(payload, filepath, temp_filepath)
+
+    def _safe_write_bytes(self, payload: bytes, filepath: str, temp_filepath: str = None) -> bool:
+        self._mark_modified()
         use_temp = temp_filepath is not None
         temp_path = temp_filepath if use_temp else f"{filepath}.tmp"
 
@@ -162,7 +619,7 @@ class FilePriorityQueue(Generic[T, V]):
             with open(temp_path, 'wb') as f:
                 fcntl.flock(f, fcntl.LOCK_EX)
                 try:
-                    pickle.dump(data, f)
+                    f.write(payload)
                     f.flush()
                     os.fsync(f.fileno())  # Ensure data is written to disk
                 finally:
@@ -175,7 +632,7 @@ class FilePriorityQueue(Generic[T, V]):
                 shutil.move(temp_path, filepath)
 
             return True
-        except Exception as e:
+        except Exception:
             # If an error occurs, remove the temp file if it exists
             if os.path.exists(temp_path) and not use_temp:
                 try:
@@ -184,10 +641,58 @@ class FilePriorityQueue(Generic[T, V]):
                     pass
             return False
 
+    def _write_chunk_file(self, chunk_data: list, filepath: str, temp_filepath: str) -> Optional[int]:
+        """Write a heap-ordered chunk and return the checksum of its contents, or None on failure."""
+        payload = self.codec.encode_entries(chunk_data)
+        if not self._safe_write_bytes(payload, filepath, temp_filepath):
+            return None
+        return zlib.crc32(payload)
+
+    def _load_chunk(self, chunk_path: str) -> list:
+        """Decode a chunk file, rejecting it when it no longer matches the recorded checksum."""
+        if not os.path.exists(chunk_path):
+            return []
+        try:
+            with open(chunk_path, 'rb') as f:
+                payload = f.read()
+        except OSError:
+            return []
+
+        expected = self.chunk_meta.get(chunk_path, {}).get('checksum')
+        if expected is not None and zlib.crc32(payload) != expected:
+            return []
+        try:
+            return self.codec.decode_entries(payload)
+        except CodecError:
+            return []
+
+    def _file_checksum(self, filepath: str) -> Optional[int]:
+        try:
+            with open(filepath, 'rb') as f:
+                return zlib.crc32(f.read())
+        except OSError:
+            return None
+
+    def _update_chunk_meta(self, chunk_path: str, chunk_data: list, checksum: Optional[int] = None) -> None:
+        """Record the count and head entry (and checksum, when rewritten) of a heap-ordered chunk."""
+        meta = self.chunk_meta.setdefault(chunk_path, {})
+        meta['count'] = len(chunk_data)
+        meta['head'] = chunk_data[0] if chunk_data else None
+        if checksum is not None:
+            meta['checksum'] = checksum
+        if chunk_path in self.chunk_files:
+            chunk_idx = self.chunk_files.index(chunk_path)
+            self.min_priorities[chunk_idx] = chunk_data[0][0] if chunk_data else None
+
+    def _drop_chunk_meta(self, chunk_idx: int) -> None:
+        chunk_path = self.chunk_files.pop(chunk_idx)
+        self.min_priorities.pop(chunk_idx)
+        self.chunk_meta.pop(chunk_path, None)
+
     def _initialize_index(self):
         """Initialize or load the index file that tracks chunk information."""
         with self.lock:
-            index_data = self._safe_read_pickle(self.index_path, default={
+            index_data = self._safe_read(self.index_path, default={
                 'chunk_files': [],
                 'counter': 0,
                 'min_priorities': []
@@ -196,56 +701,169 @@ class FilePriorityQueue(Generic[T, V]):
             self.chunk_files = index_data.get('chunk_files', [])
             self.counter = index_data.get('counter', 0)
             self.min_priorities = index_data.get('min_priorities', [])
+            self.chunk_meta = index_data.get('chunk_meta', {})
+            self.buffer_floor = index_data.get('buffer_floor', 0)
+            # Only rewrite the index when it has to be corrected, so a reload by
+            # another process does not count as a change
+            corrected = not os.path.exists(self.index_path)
+
+            if self.storage_mode == "wal":
+                self.wal_segment = index_data.get('wal_segment', 0)
+                # The checkpoint carries the buffer; queues created in snapshot
+                # mode still have it in buffer.pkl
+                buffer_data = index_data.get('buffer')
+                if buffer_data is None:
+                    buffer_data = self._safe_read(self.buffer_path, default=[], entries=True)
+                    corrected = True
+                self.buffer = buffer_data
 
             # Validate that all chunk files in the index actually exist
             valid_chunks = []
             valid_priorities = []
+            valid_meta = {}
 
             for i, chunk_path in enumerate(self.chunk_files):
                 if os.path.exists(chunk_path):
-                    # Verify chunk file is readable
-                    chunk_data = self._safe_read_pickle(chunk_path)
+                    meta = self.chunk_meta.get(chunk_path, {})
+                    checksum = self._file_checksum(chunk_path)
+                    if checksum is not None and checksum == meta.get('checksum') and meta.get('count'):
+                        # Unchanged since the index was written, no need to decode it
+                        valid_chunks.append(chunk_path)
+                        valid_priorities.append(meta['head'][0])
+                        valid_meta[chunk_path] = meta
+                        continue
+
+                    # Older index, or the chunk was rewritten after the index: decode and re-summarize
+                    corrected = True
+                    chunk_data = self._safe_read(chunk_path, entries=True)
                     if chunk_data:
+                        heapq.heapify(chunk_data)
                         valid_chunks.append(chunk_path)
                         # Update min priority based on actual data
-                        valid_priorities.append(
-                            chunk_data[0][0] if chunk_data else None)
+                        valid_priorities.append(chunk_data[0][0])
+                        valid_meta[chunk_path] = {
+                            'count': len(chunk_data),
+                            'head': chunk_data[0],
+                            'checksum': checksum
+                        }
                     else:
                         try:
                             os.remove(chunk_path)
                         except Exception:
                             pass
+                else:
+                    corrected = True
 
             # Update with only valid chunks
             self.chunk_files = valid_chunks
             self.min_priorities = valid_priorities
+            self.chunk_meta = valid_meta
+
+            if self.keyed:
+                # Buffer entries may have changed after the index was written, so only
+                # chunk locations are taken from it; _load_key_index adds the buffer
+                stored_key_index = index_data.get('key_index')
+                self._key_index_missing = stored_key_index is None
+                self.key_index = {
+                    key: location for key, location in (stored_key_index or {}).items()
+                    if location[0] is not None and location[0] in valid_meta
+                }
+                self.leases = index_data.get('leases', {})
+
+            if self.storage_mode == "wal":
+                # Chunks written by an interrupted checkpoint are not referenced by any index
+                self._remove_unreferenced_chunks()
+
+            # Save corrected index (without starting a checkpoint, the log is replayed afterwards)
+            if corrected:
+                self._write_index()
+
+    def _remove_unreferenced_chunks(self) -> int:
+        """Delete chunk files in the data directory that the index does not know about."""
+        known_chunks = set(self.chunk_files)
+        removed = 0
+        for filename in os.listdir(self.data_dir):
+            chunk_path = os.path.join(self.data_dir, filename)
+            if filename.startswith("chunk_") and chunk_path not in known_chunks:
+                try:
+                    os.remove(chunk_path)
+                    removed += 1
+                except Exception:
+                    pass
+        return removed
 
-            # Save corrected index
-            self._save_index()
+    def _load_key_index(self):
+        """Complete the key index loaded from the index file with the buffer entries."""
+        with self.lock:
+            if self._key_index_missing:
+                # Index written before the queue was keyed
+                self._rebuild_key_index()
+                self._key_index_missing = False
+                return
+
+            for priority, counter, value in self.buffer:
+                self.key_index[value] = (None, counter, priority)
+            self._counter_keys = {
+                location[1]: key for key, location in self.key_index.items()}
+
+    def _rebuild_key_index(self) -> None:
+        """Rebuild the key index by scanning the buffer and every chunk."""
+        self.key_index = {}
+        for chunk_path in self.chunk_files:
+            for priority, counter, value in self._read_chunk(chunk_path):
+                self.key_index[value] = (chunk_path, counter, priority)
+        for priority, counter, value in self.buffer:
+            self.key_index[value] = (None, counter, priority)
+        self._counter_keys = {
+            location[1]: key for key, location in self.key_index.items()}
+
+    def _track_key(self, entry: Tuple[T, int, V], chunk_path: Optional[str]) -> None:
+        if self.keyed:
+            priority, counter, value = entry
+            self.key_index[value] = (chunk_path, counter, priority)
+            self._counter_keys[counter] = value
+
+    def _forget_key(self, counter: int) -> None:
+        if self.keyed:
+            key = self._counter_keys.pop(counter, None)
+            if key is not None and self.key_index.get(key, (None, None))[1] == counter:
+                del self.key_index[key]
 
     def _load_buffer(self):
         """Load the persisted buffer from disk and heapify it."""
         with self.lock:
-            if os.path.exists(self.buffer_path):
-                buffer_data = self._safe_read_pickle(
-                    self.buffer_path, default=[])
-                self.buffer = buffer_data
+            if self.storage_mode == "wal":
+                # Already loaded from the checkpoint by _initialize_index
+                heapq.heapify(self.buffer)
+            elif os.path.exists(self.buffer_path):
+                buffer_data = self._safe_read(
+                    self.buffer_path, default=[], entries=True)
+                # Drop what a consolidation interrupted before rewriting the buffer already chunked
+                self.buffer = [entry for entry in buffer_data if entry[1] >= self.buffer_floor]
                 # Heapify the loaded buffer
                 heapq.heapify(self.buffer)
             else:
                 self.buffer = []
 
+            # The index is not rewritten on every push, so its counter can lag the buffer
+            if self.buffer:
+                self.counter = max(self.counter, max(entry[1] for entry in self.buffer) + 1)
+
             self.buffer_count = 0
 
     def _save_buffer(self):
         """Save the buffer to disk with crash safety."""
+        if self.storage_mode == "wal":
+            # The log already holds every buffer change; checkpoints persist the buffer itself
+            return True
+
         with self.lock:
             # Create operation lock
             self._create_operation_lock("save_buffer")
 
             # Write buffer to temp file then move
-            success = self._safe_write_pickle(
-                self.buffer, self.buffer_path, self.temp_buffer_path)
+            success = self._safe_write(
+                self.buffer, self.buffer_path, self.temp_buffer_path, entries=True)
 
             # Reset buffer count after successful save
             if success:
@@ -256,18 +874,34 @@ class FilePriorityQueue(Generic[T, V]):
 
     def _save_index(self):
         """Save the index file with updated information using atomic operations."""
+        if self.storage_mode == "wal":
+            # In WAL mode the index is only replaced as part of a checkpoint
+            return self._checkpoint_wal()
+        return self._write_index()
+
+    def _write_index(self):
+        """Atomically write the index file (and the buffer, in WAL mode)."""
         with self.lock:
             index_data = {
                 'chunk_files': self.chunk_files,
                 'counter': self.counter,
-                'min_priorities': self.min_priorities
+                'min_priorities': self.min_priorities,
+                'chunk_meta': self.chunk_meta,
+                'buffer_floor': self.buffer_floor
             }
+            if self.keyed and not self._key_index_missing:
+                index_data['key_index'] = self.key_index
+            if self.keyed:
+                index_data['leases'] = self.leases
+            if self.storage_mode == "wal":
+                index_data['buffer'] = self.buffer
+                index_data['wal_segment'] = self.wal_segment
 
             # Create operation lock
             self._create_operation_lock("save_index")
 
             # Write to temp file then move
-            success = self._safe_write_pickle(
+            success = self._safe_write(
                 index_data, self.index_path, self.temp_index_path)
 
             self._remove_operation_lock("save_index")
@@ -275,24 +909,113 @@ class FilePriorityQueue(Generic[T, V]):
 
     def push(self, priority: T, value: V) -> None:
         """Add an item to the priority queue with the given priority."""
-        with self.lock:
+        with self._process_lock():
             # Create operation lock
             self._create_operation_lock("push")
 
-            # Add to buffer as a heap entry
-            entry = (priority, self.counter, value)
-            self.counter += 1
-            heapq.heappush(self.buffer, entry)
-            self.buffer_count += 1
+            self._add_entry(priority, value)
 
-            # Immediately persist the buffer
-            self._save_buffer()
+            # Immediately persist the buffer change
+            self._commit()
+
+            self._remove_operation_lock("push")
+
+    def push_many(self, items: Iterable[Tuple[T, V]]) -> int:
+        """Add several (priority, value) items with one lock acquisition and one durable commit."""
+        with self._process_lock():
+            self._create_operation_lock("push")
 
-            # If buffer exceeds threshold, consolidate into chunks
-            if len(self.buffer) >= self.max_memory_items:
-                self._consolidate_buffer()
+            count = 0
+            for priority, value in items:
+                self._add_entry(priority, value)
+                count += 1
+
+            if count:
+                self._commit()
 
             self._remove_operation_lock("push")
+            return count
+
+    def _add_entry(self, priority: T, value: V) -> Optional[Tuple[T, int, V]]:
+        """Add an entry to the in-memory buffer and log it; it becomes durable at the next commit."""
+        if self.keyed and value in self.key_index:
+            chunk_path, counter, queued_priority = self.key_index[value]
+            if queued_priority == priority:
+                # Already queued with this priority
+                return None
+            # Upsert: drop the queued entry and re-add it with the new priority
+            self._discard_entry(counter, chunk_path)
+
+        # Add to buffer as a heap entry
+        entry = (priority, self.counter, value)
+        self.counter += 1
+        heapq.heappush(self.buffer, entry)
+        self.buffer_count += 1
+        self._buffer_dirty = True
+        self._track_key(entry, None)
+
+        if self.storage_mode == "wal":
+            self._append_wal(("push", priority, entry[1], value))
+        return entry
+
+    def _commit(self) -> None:
+        """Make every mutation since the previous commit durable with a single flush per file."""
+        if self.storage_mode == "wal":
+            self._sync_wal()
+            self._buffer_dirty = False
+        else:
+            self._commit_snapshot()
+        self._leases_dirty = False
+
+        # If buffer exceeds threshold, consolidate into chunks
+        if len(self.buffer) >= self.max_memory_items:
+            self._consolidate_buffer()
+        else:
+            self._maybe_checkpoint()
+
+    def _commit_snapshot(self) -> None:
+        """Rewrite the chunks popped from in place, then the buffer and the index."""
+        removed_chunks = []
+        chunks_changed = bool(self._dirty_chunks)
+        # Leases live in the index, so a lease change also rewrites it
+        index_changed = chunks_changed or self._leases_dirty
+
+        for chunk_path in list(self._dirty_chunks):
+            chunk_data = self._chunk_cache.pop(chunk_path, [])
+            self._dirty_chunks.discard(chunk_path)
+            if chunk_path not in self.chunk_files:
+                continue
+
+            if not chunk_data:
+                self._drop_chunk_meta(self.chunk_files.index(chunk_path))
+                removed_chunks.append(chunk_path)
+                continue
+
+            chunk_id = os.path.basename(chunk_path).replace(
+                "chunk_", "").replace(".pkl", "")
+            self._create_operation_lock("pop_chunk", chunk_id)
+            temp_chunk_path = os.path.join(
+                self.temp_dir, f"chunk_{chunk_id}_updated.pkl")
+            checksum = self._write_chunk_file(
+                chunk_data, chunk_path, temp_chunk_path)
+            if checksum is not None:
+                # Update the summary (min priority, count, checksum) for this chunk
+                self._update_chunk_meta(chunk_path, chunk_data, checksum)
+            self._remove_operation_lock("pop_chunk", chunk_id)
+
+        if self._buffer_dirty:
+            self._save_buffer()
+            self._buffer_dirty = False
+
+        if index_changed:
+            self._save_index()
+
+        for chunk_path in removed_chunks:
+            if os.path.exists(chunk_path):
+                try:
+                    os.remove(chunk_path)
+                except Exception:
+                    pass
 
     def _get_new_chunk_id(self) -> str:
         """Generate a unique chunk ID based on timestamp and UUID."""
@@ -318,18 +1041,26 @@ class FilePriorityQueue(Generic[T, V]):
             self._create_operation_lock("flush", chunk_id)
 
             # Write buffer to temp file
-            success = self._safe_write_pickle(
+            checksum = self._write_chunk_file(
                 buffer_copy, final_chunk_path, temp_chunk_path)
 
-            if success:
+            if checksum is not None:
                 # Update index information
                 self.chunk_files.append(final_chunk_path)
                 # The buffer is a heap, so the min is always at index 0
                 self.min_priorities.append(
                     buffer_copy[0][0] if buffer_copy else None)
+                self.chunk_meta[final_chunk_path] = {
+                    'count': len(buffer_copy),
+                    'head': buffer_copy[0],
+                    'checksum': checksum
+                }
+                for entry in buffer_copy:
+                    self._track_key(entry, final_chunk_path)
 
                 # Clear buffer only if successfully written
                 self.buffer = []
+                self.buffer_floor = self.counter
 
                 # Save updated index and empty buffer
                 self._save_index()
@@ -337,77 +1068,427 @@ class FilePriorityQueue(Generic[T, V]):
 
             self._remove_operation_lock("flush", chunk_id)
 
-    def pop(self) -> Optional[Tuple[T, V]]:
-        """Remove and return the highest priority item (lowest numeric value)."""
-        with self.lock:
+    def pop(self, lease_timeout: Optional[float] = None) -> Optional[Tuple[T, V]]:
+        """Remove and return the highest priority item (lowest numeric value).
+
+        With lease_timeout (seconds, keyed queues only) the item stays in flight until
+        ack(value) and is queued again if that does not happen in time.
+        """
+        self._check_lease_timeout(lease_timeout)
+        with self._process_lock():
             # Create operation lock
             self._create_operation_lock("pop")
 
-            # Find the overall highest priority item (either in buffer or chunks)
-            best_in_buffer = self.buffer[0] if self.buffer else None
+            requeued = self._requeue_expired_leases()
+            entry = self._take_next()
+            if entry is not None and lease_timeout is not None:
+                self._lease_entry(entry, lease_timeout)
+            if entry is not None or requeued:
+                self._commit()
 
-            # Find best chunk
-            best_chunk_idx = self._find_best_chunk()
-            best_in_chunk = None
+            self._remove_operation_lock("pop")
+            if entry is None:
+                # Queue is empty
+                return None
+            priority, _, value = entry
+            return (priority, value)
 
-            if best_chunk_idx is not None:
-                chunk_path = self.chunk_files[best_chunk_idx]
-                chunk_data = self._safe_read_pickle(chunk_path, default=[])
-                if chunk_data:
-                    # Heapify chunk data before popping
-                    heapq.heapify(chunk_data)
-                    best_in_chunk = chunk_data[0]
+    def pop_due(self, until: T, max_items: Optional[int] = None,
+                lease_timeout: Optional[float] = None) -> List[Tuple[T, V]]:
+        """Remove and return every item with priority <= until (at most max_items) in one commit.
 
-            # Compare best from buffer and chunks
-            if best_in_buffer is not None and (best_in_chunk is None or best_in_buffer[0] <= best_in_chunk[0]):
-                # Best item is in buffer
-                priority, _, value = heapq.heappop(self.buffer)
-                self._save_buffer()  # Persist buffer change
-                self._remove_operation_lock("pop")
-                return (priority, value)
-            elif best_in_chunk is not None:
-                # Best item is in chunk
-                chunk_path = self.chunk_files[best_chunk_idx]
-                chunk_id = os.path.basename(chunk_path).replace(
-                    "chunk_", "").replace(".pkl", "")
+        lease_timeout works as in pop(): every returned item must be acked.
+        """
+        self._check_lease_timeout(lease_timeout)
+        with self._process_lock():
+            self._create_operation_lock("pop")
 
-                # Create chunk-specific lock
-                self._create_operation_lock("pop_chunk", chunk_id)
+            requeued = self._requeue_expired_leases()
+            due = []
+            while max_items is None or len(due) < max_items:
+                entry = self._take_next(until)
+                if entry is None:
+                    break
+                if lease_timeout is not None:
+                    self._lease_entry(entry, lease_timeout)
+                priority, _, value = entry
+                due.append((priority, value))
+
+            if due or requeued:
+                self._commit()
+
+            self._remove_operation_lock("pop")
+            return due
+
+    def _take_next(self, until: Optional[T] = None) -> Optional[Tuple[T, int, V]]:
+        """Remove the best entry from memory (optionally only if its priority <= until) and log it."""
+        # Find the overall highest priority item (either in buffer or chunks)
+        best_in_buffer = self.buffer[0] if self.buffer else None
+
+        # Find best chunk from the index summary, without decoding any chunk
+        best_chunk_idx = self._find_best_chunk()
+        best_in_chunk = self._chunk_head(best_chunk_idx)
+
+        # Compare best from buffer and chunks
+        if best_in_buffer is not None and (best_in_chunk is None or best_in_buffer[0] <= best_in_chunk[0]):
+            if until is not None and best_in_buffer[0] > until:
+                return None
+            # Best item is in buffer
+            entry = heapq.heappop(self.buffer)
+            self._buffer_dirty = True
+            location = None
+        elif best_in_chunk is not None:
+            if until is not None and best_in_chunk[0] > until:
+                return None
+            # Best item is in chunk; only the winning chunk is decoded
+            chunk_path = self.chunk_files[best_chunk_idx]
+            chunk_data = self._cached_chunk(chunk_path)
+            if not chunk_data:
+                # The chunk vanished or is corrupted, forget it and try again
+                self._chunk_cache.pop(chunk_path, None)
+                self._remove_chunk(best_chunk_idx)
+                return self._take_next(until)
+
+            entry = heapq.heappop(chunk_data)
+            self._dirty_chunks.add(chunk_path)
+            self._update_chunk_meta(chunk_path, chunk_data)
+            location = chunk_path
+        else:
+            return None
 
-                # Read the chunk again (might have changed)
-                chunk_data = self._safe_read_pickle(chunk_path, default=[])
-                if not chunk_data:
-                    self._remove_chunk(best_chunk_idx)
-                    self._remove_operation_lock("pop_chunk", chunk_id)
-                    self._remove_operation_lock("pop")
-                    return self.pop()  # Try again
-
-                # Heapify before popping
-                heapq.heapify(chunk_data)
-                # Get highest priority item
-                priority, _, value = heapq.heappop(chunk_data)
-
-                # Update the file
-                if chunk_data:
-                    temp_chunk_path = os.path.join(
-                        self.temp_dir, f"chunk_{chunk_id}_updated.pkl")
-                    success = self._safe_write_pickle(
-                        chunk_data, chunk_path, temp_chunk_path)
-
-                    if success:
-                        # Update min priority for this chunk
-                        self.min_priorities[best_chunk_idx] = chunk_data[0][0]
-                        self._save_index()
+        self._forget_key(entry[1])
+        if self.storage_mode == "wal":
+            self._append_wal(("remove", entry[1], location))
+        return entry
+
+    def cancel(self, key: V) -> bool:
+        """Remove the entry queued for key (keyed queues only). Returns False if it was not queued."""
+        if not self.keyed:
+            raise ValueError("cancel() requires a queue created with keyed=True")
+
+        with self._process_lock():
+            location = self.key_index.get(key)
+            leased = key in self.leases
+            if location is None and not leased:
+                return False
+
+            self._create_operation_lock("cancel")
+            if leased:
+                # A cancelled item must not come back when its lease expires
+                self._release_lease(key)
+            removed = location is not None and self._discard_entry(location[1], location[0]) is not None
+            if removed or leased:
+                self._commit()
+            else:
+                # Stale index entry, the item is already gone
+                self.key_index.pop(key, None)
+            self._remove_operation_lock("cancel")
+            return removed or leased
+
+    def claim(self, key: V, lease_timeout: Optional[float] = None) -> Optional[Tuple[T, V]]:
+        """Remove the entry queued for key and return it, leased when lease_timeout is given."""
+        claimed = self.claim_many([key], lease_timeout)
+        return claimed[0] if claimed else None
+
+    def claim_many(self, keys: Iterable[V], lease_timeout: Optional[float] = None) -> List[Tuple[T, V]]:
+        """Remove the entries queued for keys in one commit, leasing them when lease_timeout is given.
+
+        Unlike pop_due this goes by key, for callers that already know which items are due.
+        Keys that are not queued are skipped.
+        """
+        if not self.keyed:
+            raise ValueError("claim_many() requires a queue created with keyed=True")
+
+        with self._process_lock():
+            self._create_operation_lock("pop")
+
+            claimed = []
+            for key in keys:
+                location = self.key_index.get(key)
+                if location is None:
+                    continue
+                entry = self._discard_entry(location[1], location[0])
+                if entry is None:
+                    # Stale index entry, the item is already gone
+                    self.key_index.pop(key, None)
+                    continue
+                if lease_timeout is not None:
+                    self._lease_entry(entry, lease_timeout)
+                claimed.append((entry[0], entry[2]))
+
+            if claimed:
+                self._commit()
+
+            self._remove_operation_lock("pop")
+            return claimed
+
+    def ack(self, key: V) -> bool:
+        """Finish a leased item so it is not queued again. Returns False if key holds no lease."""
+        if not self.keyed:
+            raise ValueError("ack() requires a queue created with keyed=True")
+
+        with self._process_lock():
+            if key not in self.leases:
+                # Never leased, already acked, or the lease expired and the item was re-queued
+                return False
+            self._create_operation_lock("ack")
+            self._release_lease(key)
+            self._commit()
+            self._remove_operation_lock("ack")
+            return True
+
+    def in_flight(self) -> int:
+        """Number of leased items that were neither acked nor re-queued yet."""
+        with self._process_lock():
+            return len(self.leases)
+
+    def _check_lease_timeout(self, lease_timeout: Optional[float]) -> None:
+        if lease_timeout is not None and not self.keyed:
+            raise ValueError("Leased pops require a queue created with keyed=True")
+
+    def _lease_entry(self, entry: Tuple[T, int, V], lease_timeout: float) -> None:
+        """Keep a popped entry in flight until it is acked or the lease expires."""
+        priority, _, value = entry
+        deadline = time.time() + lease_timeout
+        self.leases[value] = (priority, deadline)
+        self._leases_dirty = True
+        if self.storage_mode == "wal":
+            self._append_wal(("lease", value, priority, deadline))
+
+    def _release_lease(self, key: V) -> Optional[Tuple[T, float]]:
+        lease = self.leases.pop(key, None)
+        if lease is not None:
+            self._leases_dirty = True
+            if self.storage_mode == "wal":
+                self._append_wal(("ack", key))
+        return lease
+
+    def _requeue_expired_leases(self) -> int:
+        """Make items whose lease ran out visible again; they become durable at the next commit."""
+        if not self.leases:
+            return 0
+        now = time.time()
+        expired = [key for key, (_, deadline) in self.leases.items() if deadline <= now]
+        for key in expired:
+            priority, _ = self._release_lease(key)
+            if key not in self.key_index:
+                # Not pushed again while it was in flight
+                self._add_entry(priority, key)
+        return len(expired)
+
+    def priority_of(self, key: V) -> Optional[T]:
+        """Return the priority key is queued with, or None (keyed queues only)."""
+        with self._process_lock():
+            location = self.key_index.get(key)
+            return location[2] if location is not None else None
+
+    def _discard_entry(self, counter: int, chunk_path: Optional[str]) -> Optional[Tuple[T, int, V]]:
+        """Remove a specific entry and log the removal; it becomes durable at the next commit."""
+        entry = self._remove_entry(counter, chunk_path)
+        if entry is not None and self.storage_mode == "wal":
+            self._append_wal(("remove", counter, chunk_path))
+        return entry
+
+    def _chunk_head(self, chunk_idx: Optional[int]) -> Optional[Tuple[T, int, V]]:
+        """Return the smallest entry of a chunk from the index summary."""
+        if chunk_idx is None:
+            return None
+        return self.chunk_meta.get(self.chunk_files[chunk_idx], {}).get('head')
+
+    def _read_chunk(self, chunk_path: str) -> list:
+        """Read a chunk, preferring the in-memory copy of chunks popped from since the last checkpoint."""
+        if chunk_path in self._chunk_cache:
+            return list(self._chunk_cache[chunk_path])
+        return self._load_chunk(chunk_path)
+
+    def _cached_chunk(self, chunk_path: str) -> list:
+        """Return the in-memory heap of a chunk, decoding it from disk on first use."""
+        chunk_data = self._chunk_cache.get(chunk_path)
+        if chunk_data is None:
+            chunk_data = self._load_chunk(chunk_path)
+            heapq.heapify(chunk_data)
+            self._chunk_cache[chunk_path] = chunk_data
+        return chunk_data
+
+    def _wal_segment_path(self, segment: int) -> str:
+        return os.path.join(self.wal_dir, f"segment_{segment:08d}.log")
+
+    def _list_wal_segments(self) -> List[int]:
+        segments = []
+        for filename in os.listdir(self.wal_dir):
+            if filename.startswith("segment_") and filename.endswith(".log"):
+                try:
+                    segments.append(int(filename[len("segment_"):-len(".log")]))
+                except ValueError:
+                    continue
+        return sorted(segments)
+
+    def _append_wal(self, record: tuple) -> None:
+        """Append one mutation record to the current log segment (flushed by the next commit)."""
+        self._mark_modified()
+        payload = self.codec.encode(record)
+        self._wal_file.write(WAL_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+        self._wal_records += 1
+
+    def _sync_wal(self) -> None:
+        self._wal_file.flush()
+        os.fsync(self._wal_file.fileno())
+
+    def _read_wal_segment(self, segment_path: str) -> List[tuple]:
+        """Read the intact records of a segment and cut off a torn tail left by a crash."""
+        with open(segment_path, 'rb') as f:
+            data = f.read()
+
+        records = []
+        offset = 0
+        while offset + WAL_HEADER.size <= len(data):
+            length, crc = WAL_HEADER.unpack_from(data, offset)
+            start = offset + WAL_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            try:
+                records.append(self.codec.decode(payload))
+            except CodecError:
+                break
+            offset = start + length
+
+        if offset < len(data):
+            with open(segment_path, 'r+b') as f:
+                f.truncate(offset)
+                f.flush()
+                os.fsync(f.fileno())
+        return records
+
+    def _apply_wal_record(self, record: tuple) -> None:
+        """Re-apply a logged mutation to the in-memory state."""
+        operation = record[0]
+        if operation == "push":
+            _, priority, counter, value = record
+            entry = (priority, counter, value)
+            heapq.heappush(self.buffer, entry)
+            self._track_key(entry, None)
+            self.counter = max(self.counter, counter + 1)
+        elif operation == "remove":
+            _, counter, chunk_path = record
+            self._remove_entry(counter, chunk_path)
+        elif operation == "lease":
+            _, value, priority, deadline = record
+            self.leases[value] = (priority, deadline)
+        elif operation == "ack":
+            self.leases.pop(record[1], None)
+
+    def _remove_entry(self, counter: int, chunk_path: Optional[str]) -> Optional[Tuple[T, int, V]]:
+        """Remove the entry with the given counter from the buffer or from a cached chunk."""
+        if chunk_path is None:
+            entries = self.buffer
+        elif chunk_path in self.chunk_files:
+            entries = self._cached_chunk(chunk_path)
+        else:
+            return None
+
+        for i, entry in enumerate(entries):
+            if entry[1] == counter:
+                entries[i] = entries[-1]
+                entries.pop()
+                heapq.heapify(entries)
+                if chunk_path is not None:
+                    self._dirty_chunks.add(chunk_path)
+                    self._update_chunk_meta(chunk_path, entries)
                 else:
-                    self._remove_chunk(best_chunk_idx)
+                    self._buffer_dirty = True
+                self._forget_key(counter)
+                return entry
+        return None
 
-                self._remove_operation_lock("pop_chunk", chunk_id)
-                self._remove_operation_lock("pop")
-                return (priority, value)
+    def _replay_wal(self, checkpoint: bool = True) -> None:
+        """Bring the state loaded from the checkpoint up to date by replaying the log tail."""
+        with self.lock:
+            replayed = 0
+            for segment in self._list_wal_segments():
+                segment_path = self._wal_segment_path(segment)
+                if segment < self.wal_segment:
+                    # Already folded into the checkpoint
+                    os.remove(segment_path)
+                    continue
+                for record in self._read_wal_segment(segment_path):
+                    self._apply_wal_record(record)
+                    replayed += 1
+
+            if replayed and checkpoint:
+                self._checkpoint_wal()
             else:
-                # Queue is empty
-                self._remove_operation_lock("pop")
-                return None
+                self._wal_file = open(self._wal_segment_path(self.wal_segment), 'ab')
+                self._wal_records = replayed
+
+    def _maybe_checkpoint(self) -> None:
+        if self.storage_mode == "wal" and self._wal_records >= self.checkpoint_interval:
+            self._checkpoint_wal()
+
+    def _checkpoint_wal(self) -> bool:
+        """Fold the log into a new checkpoint and continue in a fresh segment."""
+        with self.lock:
+            # Chunks popped from are written under new names, so the previous
+            # checkpoint stays intact until the new index replaces it
+            for chunk_path in list(self._dirty_chunks):
+                chunk_data = self._chunk_cache.pop(chunk_path, [])
+                self._dirty_chunks.discard(chunk_path)
+                self._obsolete_chunks.append(chunk_path)
+                if chunk_path not in self.chunk_files:
+                    continue
+
+                chunk_idx = self.chunk_files.index(chunk_path)
+                if not chunk_data:
+                    self._drop_chunk_meta(chunk_idx)
+                    continue
+
+                chunk_id = self._get_new_chunk_id()
+                temp_chunk_path = os.path.join(
+                    self.temp_dir, f"chunk_{chunk_id}.pkl")
+                new_chunk_path = os.path.join(
+                    self.data_dir, f"chunk_{chunk_id}.pkl")
+                checksum = self._write_chunk_file(chunk_data, new_chunk_path, temp_chunk_path)
+                if checksum is None:
+                    # Keep serving the old chunk from memory and retry at the next checkpoint
+                    self._obsolete_chunks.pop()
+                    self._chunk_cache[chunk_path] = chunk_data
+                    self._dirty_chunks.add(chunk_path)
+                    return False
+                self.chunk_files[chunk_idx] = new_chunk_path
+                self.chunk_meta.pop(chunk_path, None)
+                self._update_chunk_meta(new_chunk_path, chunk_data, checksum)
+                for entry in chunk_data:
+                    self._track_key(entry, new_chunk_path)
+
+            # Everything written is on disk now; only chunks popped from after this
+            # checkpoint are kept decoded, so memory stays bounded by what changed
+            self._chunk_cache = {chunk_path: chunk_data for chunk_path, chunk_data in self._chunk_cache.items()
+                                 if chunk_path in self._dirty_chunks}
+
+            # Records appended from now on belong to the next checkpoint
+            if self._wal_file is not None:
+                self._wal_file.close()
+            self.wal_segment += 1
+            self._wal_file = open(self._wal_segment_path(self.wal_segment), 'ab')
+            self._wal_records = 0
+
+            if not self._write_index():
+                # The previous index still replays every segment from its own start
+                return False
+
+            for chunk_path in self._obsolete_chunks:
+                if os.path.exists(chunk_path):
+                    try:
+                        os.remove(chunk_path)
+                    except Exception:
+                        pass
+            self._obsolete_chunks = []
+
+            for segment in self._list_wal_segments():
+                if segment < self.wal_segment:
+                    os.remove(self._wal_segment_path(segment))
+
+            return True
 
     def _find_best_chunk(self) -> Optional[int]:
         """Find the index of the chunk with the highest priority item."""
@@ -444,28 +1525,20 @@ class FilePriorityQueue(Generic[T, V]):
                     pass
 
             # Update index
-            self.chunk_files.pop(chunk_idx)
-            self.min_priorities.pop(chunk_idx)
+            self._drop_chunk_meta(chunk_idx)
             self._save_index()
 
             self._remove_operation_lock("remove", chunk_id)
 
     def peek(self) -> Optional[Tuple[T, V]]:
         """Look at the highest priority item without removing it."""
-        with self.lock:
+        with self._process_lock():
             # Find the overall highest priority item (either in buffer or chunks)
             best_in_buffer = self.buffer[0] if self.buffer else None
 
-            # Find best chunk
+            # The head entry of every chunk is kept in the index, so nothing is decoded here
             best_chunk_idx = self._find_best_chunk()
-            best_in_chunk = None
-
-            if best_chunk_idx is not None:
-                chunk_path = self.chunk_files[best_chunk_idx]
-                chunk_data = self._safe_read_pickle(chunk_path, default=[])
-                if chunk_data:
-                    heapq.heapify(chunk_data)
-                    best_in_chunk = chunk_data[0]
+            best_in_chunk = self._chunk_head(best_chunk_idx)
 
             # Compare best from buffer and chunks
             if best_in_buffer is not None and (best_in_chunk is None or best_in_buffer[0] <= best_in_chunk[0]):
@@ -481,73 +1554,65 @@ class FilePriorityQueue(Generic[T, V]):
 
     def is_empty(self) -> bool:
         """Check if the queue is empty."""
-        with self.lock:
+        with self._process_lock():
             if self.buffer:
                 return False
 
-            for chunk_path in self.chunk_files:
-                if os.path.exists(chunk_path):
-                    chunk_data = self._safe_read_pickle(chunk_path, default=[])
-                    if chunk_data:
-                        return False
-
-            return True
+            return not any(
+                self.chunk_meta.get(chunk_path, {}).get('count')
+                for chunk_path in self.chunk_files)
 
     def size(self) -> int:
         """Get the total number of items in the queue."""
-        with self.lock:
-            size = len(self.buffer)
-            valid_chunks = []
-            valid_priorities = []
-
-            for i, chunk_path in enumerate(self.chunk_files):
-                if os.path.exists(chunk_path):
-                    chunk_data = self._safe_read_pickle(chunk_path, default=[])
-                    size += len(chunk_data)
-                    if chunk_data:
-                        valid_chunks.append(chunk_path)
-                        valid_priorities.append(chunk_data[0][0])
-
-            # If we found inconsistencies, update the index
-            if len(valid_chunks) != len(self.chunk_files):
-                self.chunk_files = valid_chunks
-                self.min_priorities = valid_priorities
-                self._save_index()
-
-            return size
+        with self._process_lock():
+            # Chunk counts come from the index summary; repair() reconciles it with the files
+            return len(self.buffer) + sum(
+                self.chunk_meta.get(chunk_path, {}).get('count', 0)
+                for chunk_path in self.chunk_files)
 
     def clear(self) -> None:
         """Remove all items from the queue."""
-        with self.lock:
+        with self._process_lock():
             # Create operation lock for clear operation
             self._create_operation_lock("clear")
 
             self.buffer = []
             self._save_buffer()
 
-            for chunk_path in self.chunk_files:
+            # Reset index before deleting the chunks it references
+            old_chunk_files = self.chunk_files
+            self.chunk_files = []
+            self.min_priorities = []
+            self.chunk_meta = {}
+            self.key_index = {}
+            self._counter_keys = {}
+            self._chunk_cache = {}
+            self._dirty_chunks = set()
+            self.leases = {}
+            self._save_index()
+
+            for chunk_path in old_chunk_files:
                 if os.path.exists(chunk_path):
                     try:
                         os.remove(chunk_path)
                     except Exception:
                         pass
 
-            # Reset index
-            self.chunk_files = []
-            self.min_priorities = []
-            self._save_index()
-
             self._remove_operation_lock("clear")
 
     def checkpoint(self) -> None:
         """Save current state to disk."""
-        with self.lock:
+        with self._process_lock():
+            if self.storage_mode == "wal":
+                if self._wal_file is not None:
+                    self._checkpoint_wal()
+                return
             self._save_buffer()
             self._save_index()
 
     def optimize(self) -> Dict[str, int]:
         """Optimize the storage by consolidating chunks."""
-        with self.lock:
+        with self._process_lock():
             stats = {
                 "chunks_before": len(self.chunk_files),
                 "items_processed": 0,
@@ -558,28 +1623,34 @@ class FilePriorityQueue(Generic[T, V]):
             all_items = list(self.buffer)  # Start with buffer items
 
             # Add items from all chunks
-            for chunk_path in self.chunk_files:
+            old_chunk_files = self.chunk_files
+            for chunk_path in old_chunk_files:
                 if os.path.exists(chunk_path):
-                    chunk_data = self._safe_read_pickle(chunk_path, default=[])
+                    chunk_data = self._read_chunk(chunk_path)
                     all_items.extend(chunk_data)
                     stats["items_processed"] += len(chunk_data)
-                    try:
-                        os.remove(chunk_path)
-                    except Exception:
-                        pass
 
             # Clear current data structures
             self.buffer = []
             self.chunk_files = []
             self.min_priorities = []
+            self.chunk_meta = {}
+            self._chunk_cache = {}
+            self._dirty_chunks = set()
 
             # Sort all items in one go
             all_items.sort()
 
-            # Split into optimal sized chunks
+            # Keep a small tail in the memory buffer instead of writing it as a chunk
             chunk_size = self.max_memory_items * 2  # Use larger chunks for efficiency
-            for i in range(0, len(all_items), chunk_size):
-                chunk_items = all_items[i:i+chunk_size]
+            remaining = len(all_items) % chunk_size
+            if remaining == 0 or remaining > self.max_memory_items:
+                remaining = 0
+            chunked_items = all_items[:len(all_items) - remaining]
+
+            # Split into optimal sized chunks
+            for i in range(0, len(chunked_items), chunk_size):
+                chunk_items = chunked_items[i:i+chunk_size]
                 if chunk_items:
                     # Create a new chunk
                     chunk_id = self._get_new_chunk_id()
@@ -588,32 +1659,51 @@ class FilePriorityQueue(Generic[T, V]):
                     final_chunk_path = os.path.join(
                         self.data_dir, f"chunk_{chunk_id}.pkl")
 
-                    success = self._safe_write_pickle(
+                    checksum = self._write_chunk_file(
                         chunk_items, final_chunk_path, temp_chunk_path)
 
-                    if success:
+                    if checksum is not None:
                         self.chunk_files.append(final_chunk_path)
                         self.min_priorities.append(
                             chunk_items[0][0] if chunk_items else None)
+                        self.chunk_meta[final_chunk_path] = {
+                            'count': len(chunk_items),
+                            'head': chunk_items[0],
+                            'checksum': checksum
+                        }
                         stats["chunks_after"] += 1
 
-            # Keep some items in memory buffer if there are any left
-            if all_items and chunk_size > self.max_memory_items:
-                remaining = len(all_items) % chunk_size
-                if remaining > 0 and remaining <= self.max_memory_items:
-                    self.buffer = all_items[-remaining:]
-                    # Heapify the buffer
-                    heapq.heapify(self.buffer)
+            # The old buffer file is rewritten last, so everything in it is below the floor
+            self.buffer_floor = self.counter
+            if remaining:
+                # Renumbered above the floor; the items are the largest ones, so order is unchanged
+                self.buffer = []
+                for priority, _, value in all_items[-remaining:]:
+                    self.buffer.append((priority, self.counter, value))
+                    self.counter += 1
+                # Heapify the buffer
+                heapq.heapify(self.buffer)
+
+            if self.keyed:
+                self._rebuild_key_index()
 
             # Save the updated index and buffer
             self._save_index()
             self._save_buffer()
 
+            # The old chunks are only dropped once nothing references them
+            for chunk_path in old_chunk_files:
+                if os.path.exists(chunk_path):
+                    try:
+                        os.remove(chunk_path)
+                    except Exception:
+                        pass
+
             return stats
 
     def repair(self) -> Dict[str, int]:
         """Repair the queue by fixing inconsistencies."""
-        with self.lock:
+        with self._process_lock():
             stats = {
                 "corrupted_files_removed": 0,
                 "orphaned_files_recovered": 0,
@@ -636,36 +1726,52 @@ class FilePriorityQueue(Generic[T, V]):
                     os.remove(temp_file)
                     stats["temp_files_cleaned"] += 1
 
-            # Check for orphaned chunk files
+            # Check for orphaned chunk files. In WAL mode a chunk missing from the
+            # index was written by an interrupted checkpoint and must not be adopted.
+            if self.storage_mode == "wal":
+                stats["corrupted_files_removed"] += self._remove_unreferenced_chunks()
             known_chunks = set(self.chunk_files)
             for filename in os.listdir(self.data_dir):
                 if filename.startswith("chunk_") and filename.endswith(".pkl"):
                     chunk_path = os.path.join(self.data_dir, filename)
                     if chunk_path not in known_chunks:
                         # Check if the file is valid
-                        chunk_data = self._safe_read_pickle(
-                            chunk_path, default=None)
+                        chunk_data = self._safe_read(
+                            chunk_path, default=None, entries=True)
                         if chunk_data:
                             self.chunk_files.append(chunk_path)
                             self.min_priorities.append(
                                 chunk_data[0][0] if chunk_data else None)
                             stats["orphaned_files_recovered"] += 1
+                            # Force the summary below to be rebuilt from the data
+                            self.chunk_meta.pop(chunk_path, None)
                         else:
                             os.remove(chunk_path)
                             stats["corrupted_files_removed"] += 1
 
-            # Verify all chunks in the index
+            # Verify all chunks in the index and rebuild their summaries
             valid_chunks = []
             valid_priorities = []
+            valid_meta = {}
 
             for chunk_path in self.chunk_files:
                 if os.path.exists(chunk_path):
-                    chunk_data = self._safe_read_pickle(
-                        chunk_path, default=None)
+                    if chunk_path in self._chunk_cache:
+                        chunk_data = self._chunk_cache[chunk_path]
+                    else:
+                        chunk_data = self._safe_read(
+                            chunk_path, default=None, entries=True)
+                        if chunk_data:
+                            heapq.heapify(chunk_data)
                     if chunk_data:
                         valid_chunks.append(chunk_path)
                         valid_priorities.append(
                             chunk_data[0][0] if chunk_data else None)
+                        valid_meta[chunk_path] = {
+                            'count': len(chunk_data),
+                            'head': chunk_data[0],
+                            'checksum': self._file_checksum(chunk_path)
+                        }
                     else:
                         os.remove(chunk_path)
                         stats["corrupted_files_removed"] += 1
@@ -673,17 +1779,21 @@ class FilePriorityQueue(Generic[T, V]):
             # Update the index with valid chunks
             self.chunk_files = valid_chunks
             self.min_priorities = valid_priorities
+            self.chunk_meta = valid_meta
 
-            # Check buffer file
-            if os.path.exists(self.buffer_path):
-                buffer_data = self._safe_read_pickle(
-                    self.buffer_path, default=None)
+            # Check buffer file (WAL mode keeps the buffer in the checkpoint instead)
+            if self.storage_mode != "wal" and os.path.exists(self.buffer_path):
+                buffer_data = self._safe_read(
+                    self.buffer_path, default=None, entries=True)
                 if buffer_data:
-                    self.buffer = buffer_data
+                    self.buffer = [entry for entry in buffer_data if entry[1] >= self.buffer_floor]
                     # Ensure buffer is a valid heap
                     heapq.heapify(self.buffer)
                     stats["buffer_items_recovered"] = len(buffer_data)
 
+            if self.keyed:
+                self._rebuild_key_index()
+
             self._save_index()
             self._save_buffer()
 
@@ -694,3 +1804,7 @@ class FilePriorityQueue(Generic[T, V]):
             self.checkpoint()
         except Exception:
             pass
+        try:
+            os.close(self._lock_fd)
+        except Exception:
+            pass
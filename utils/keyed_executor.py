@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+
+class KeyedExecutor:
+    """A thread pool that runs tasks in parallel unless they share a key.
+
+    Each task is submitted with a set of keys (e.g. the component ids it writes to). A task
+    starts only after every earlier task sharing one of its keys has finished, so tasks
+    on the same key run one at a time in submission order while unrelated tasks run
+    concurrently. Tasks waiting for a key do not occupy a pool thread.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None, thread_name_prefix: str = ""):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers,
+                                       thread_name_prefix=thread_name_prefix)
+        self.lock = threading.Lock()
+        # key -> future of the last task submitted with that key
+        self.tails: Dict[Hashable, Future] = {}
+        self._pending = 0
+
+    def submit(self, keys: Iterable[Hashable], fn: Callable, *args, **kwargs) -> Future:
+        future = Future()
+        keys = set(keys)
+        with self.lock:
+            waiting_on = {self.tails[key] for key in keys if key in self.tails}
+            for key in keys:
+                self.tails[key] = future
+            self._pending += 1
+            remaining = [len(waiting_on)]
+
+        def dependency_done(_):
+            with self.lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                self._start(future, fn, args, kwargs)
+
+        future.add_done_callback(lambda _: self._finished(future, keys))
+        if not waiting_on:
+            self._start(future, fn, args, kwargs)
+        for dependency in waiting_on:
+            dependency.add_done_callback(dependency_done)
+        return future
+
+    def _start(self, future: Future, fn: Callable, args: tuple, kwargs: dict) -> None:
+        # False if the caller cancelled it while it was waiting; dependents are released anyway
+        if future.set_running_or_notify_cancel():
+            self.pool.submit(self._run, future, fn, args, kwargs)
+
+    @staticmethod
+    def _run(future: Future, fn: Callable, args: tuple, kwargs: dict) -> None:
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+
+    def _finished(self, future: Future, keys: set) -> None:
+        with self.lock:
+            self._pending -= 1
+            for key in keys:
+                if self.tails.get(key) is future:
+                    del self.tails[key]
+
+    def pending(self) -> int:
+        """Tasks submitted and not finished yet, running or waiting."""
+        with self.lock:
+            return self._pending
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.pool.shutdown(wait=wait)
+
+
+class AsyncKeyedExecutor:
+    """KeyedExecutor for coroutines: tasks sharing a key run one at a time in submission order.
+
+    At most max_concurrency tasks run at once; tasks waiting for a key or a slot are
+    suspended coroutines, not threads.
+    """
+
+    def __init__(self, max_concurrency: int):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        # key -> task of the last coroutine submitted with that key
+        self.tails: Dict[Hashable, asyncio.Task] = {}
+        self._pending = 0
+
+    def submit(self, keys: Iterable[Hashable], fn: Callable[..., Awaitable], *args) -> asyncio.Task:
+        """Schedule fn(*args) on the running loop; must be called from that loop."""
+        keys = set(keys)
+        waiting_on = {self.tails[key] for key in keys if key in self.tails}
+        task = asyncio.ensure_future(self._run(waiting_on, fn, args))
+        for key in keys:
+            self.tails[key] = task
+        self._pending += 1
+        task.add_done_callback(lambda _: self._finished(task, keys))
+        return task
+
+    async def _run(self, waiting_on: set, fn: Callable[..., Awaitable], args: tuple):
+        if waiting_on:
+            # Only ordering matters here; the earlier tasks' results and errors are their own
+            await asyncio.wait(waiting_on)
+        async with self.semaphore:
+            return await fn(*args)
+
+    def _finished(self, task: asyncio.Task, keys: set) -> None:
+        self._pending -= 1
+        for key in keys:
+            if self.tails.get(key) is task:
+                del self.tails[key]
+
+    def pending(self) -> int:
+        """Tasks submitted and not finished yet, running or waiting."""
+        return self._pending
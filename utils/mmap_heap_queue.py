@@ -0,0 +1,420 @@
+import os
+import mmap
+import struct
+import tempfile
+import threading
+try:
+    import fcntl
+except ImportError:  # Windows: the single-process rule is not enforced there
+    fcntl = None
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# File header: magic, record size, id size, item count, next sequence number, clean-shutdown flag
+HEADER = struct.Struct("<8sIIQQB")
+HEADER_SIZE = 64
+MAGIC = b"PLQHEAP1"
+
+
+class MmapHeapQueue:
+    """A keyed priority queue of (datetime, str id) items stored as an on-disk binary heap.
+
+    Every item is a fixed-width record (epoch microseconds, sequence number, id) in a
+    memory-mapped file, so push/pop/cancel only touch the O(log n) records along one
+    sift path and nothing is pickled. Ids are keys: pushing a queued id moves it.
+
+    A crash in the middle of a sift can duplicate records but never loses a queued one:
+    records are counted in the header before a sift can copy them, and a moved id is
+    appended before its old slot is removed. The header's clean flag is cleared while the
+    file is open, and an unclean file is de-duplicated and re-heapified on the next open.
+    Only a push that had not returned yet can be lost.
+
+    Leased pops keep the record in the heap with the lease deadline as its priority,
+    so an item that is never acked (even across a crash) is delivered again. Unlike
+    FilePriorityQueue, the file must only be used by one process at a time; opening it
+    while another MmapHeapQueue holds it raises RuntimeError.
+    """
+
+    def __init__(self, directory: str = None, id_size: int = 48,
+                 initial_capacity: int = 1024, sync: bool = True):
+        self.directory = directory or tempfile.mkdtemp()
+        self.id_size = id_size
+        self.sync = sync
+        self.lock = threading.RLock()
+        self.record = struct.Struct(f"<qQ{id_size}s")
+
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, "heap.bin")
+
+        # id -> slot in the heap, rebuilt on open
+        self.positions: Dict[str, int] = {}
+        # id -> lease deadline (epoch microseconds) of items popped with a lease
+        self.leases: Dict[str, int] = {}
+
+        self._open(initial_capacity)
+
+    # ------------------------------------------------------------------ storage
+
+    def _open(self, initial_capacity: int) -> None:
+        exists = os.path.exists(self.path) and os.path.getsize(self.path) >= HEADER_SIZE
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        if fcntl is not None:
+            # Recovery and the clean flag assume a single user; refuse to share the file
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(self._fd)
+                raise RuntimeError(f"{self.path} is already open in another process")
+        if not exists:
+            os.ftruncate(self._fd, HEADER_SIZE + initial_capacity * self.record.size)
+        self._map()
+
+        if exists:
+            magic, record_size, id_size, count, seq, clean = HEADER.unpack_from(self._mm, 0)
+            if magic != MAGIC or record_size != self.record.size or id_size != self.id_size:
+                raise ValueError(
+                    f"{self.path} is not a heap file with {self.id_size}-byte ids")
+            self.count = count
+            self.seq = seq
+            if not clean:
+                self._recover()
+        else:
+            self.count = 0
+            self.seq = 0
+
+        self.positions = {self._read(i)[2]: i for i in range(self.count)}
+        # Cleared until the next checkpoint/close, so a crash triggers recovery
+        self._write_header(clean=False)
+        self._flush()
+
+    def _map(self) -> None:
+        size = os.fstat(self._fd).st_size
+        self._mm = mmap.mmap(self._fd, size)
+        self.capacity = (size - HEADER_SIZE) // self.record.size
+
+    def _grow(self) -> None:
+        """Double the file and remap it."""
+        new_capacity = max(1, self.capacity) * 2
+        self._mm.flush()
+        self._mm.close()
+        os.ftruncate(self._fd, HEADER_SIZE + new_capacity * self.record.size)
+        self._map()
+
+    def _write_header(self, clean: bool) -> None:
+        HEADER.pack_into(self._mm, 0, MAGIC, self.record.size, self.id_size,
+                         self.count, self.seq, 1 if clean else 0)
+
+    def _flush(self) -> None:
+        if self.sync:
+            self._mm.flush()
+
+    def _recover(self) -> None:
+        """Drop records duplicated by an interrupted sift and restore the heap property."""
+        seen = set()
+        records = []
+        for i in range(self.count):
+            micros, seq, key = self._read(i)
+            if seq in seen:
+                continue
+            seen.add(seq)
+            records.append((micros, seq, key))
+            self.seq = max(self.seq, seq + 1)
+
+        # Keep the latest push (highest seq) if an id ended up queued twice: an interrupted
+        # upsert leaves the old record next to the one with the new priority
+        by_key = {}
+        for record in records:
+            if record[2] not in by_key or record[1] > by_key[record[2]][1]:
+                by_key[record[2]] = record
+        records = sorted(by_key.values())
+
+        # A sorted array is a valid heap
+        for i, (micros, seq, key) in enumerate(records):
+            self._write(i, micros, seq, key)
+        self.count = len(records)
+
+    def _offset(self, slot: int) -> int:
+        return HEADER_SIZE + slot * self.record.size
+
+    def _read(self, slot: int) -> Tuple[int, int, str]:
+        micros, seq, raw_id = self.record.unpack_from(self._mm, self._offset(slot))
+        return micros, seq, raw_id.rstrip(b"\x00").decode("utf-8")
+
+    def _write(self, slot: int, micros: int, seq: int, key: str) -> None:
+        self.record.pack_into(self._mm, self._offset(slot), micros, seq, key.encode("utf-8"))
+
+    def _move(self, slot: int, record: Tuple[int, int, str]) -> None:
+        self._write(slot, *record)
+        self.positions[record[2]] = slot
+
+    # ------------------------------------------------------------------ heap
+
+    def _sift_up(self, slot: int, record: Tuple[int, int, str]) -> None:
+        """Place record at or above slot, moving larger parents down (hole technique)."""
+        order = record[:2]
+        while slot > 0:
+            parent = (slot - 1) // 2
+            parent_record = self._read(parent)
+            if parent_record[:2] <= order:
+                break
+            self._move(slot, parent_record)
+            slot = parent
+        self._move(slot, record)
+
+    def _sift_down(self, slot: int, record: Tuple[int, int, str]) -> None:
+        """Place record at or below slot, moving smaller children up (hole technique)."""
+        order = record[:2]
+        while True:
+            child = 2 * slot + 1
+            if child >= self.count:
+                break
+            child_record = self._read(child)
+            right = child + 1
+            if right < self.count:
+                right_record = self._read(right)
+                if right_record[:2] < child_record[:2]:
+                    child, child_record = right, right_record
+            if order <= child_record[:2]:
+                break
+            self._move(slot, child_record)
+            slot = child
+        self._move(slot, record)
+
+    def _append(self, record: Tuple[int, int, str]) -> None:
+        """Write record to the slot after the last one and count it in the header.
+
+        Counting it on disk first keeps every slot a following sift copies records into
+        within the range recovery reads.
+        """
+        if self.count >= self.capacity:
+            self._grow()
+        self._write(self.count, *record)
+        self.count += 1
+        self._write_header(clean=False)
+
+    def _remove_slot(self, slot: int) -> Tuple[int, int, str]:
+        """Remove the record at slot and return it."""
+        removed = self._read(slot)
+        del self.positions[removed[2]]
+        self.count -= 1
+        if slot != self.count:
+            last = self._read(self.count)
+            if last[:2] < removed[:2]:
+                self._sift_up(slot, last)
+            else:
+                self._sift_down(slot, last)
+        return removed
+
+    # ------------------------------------------------------------------ conversions
+
+    @staticmethod
+    def _to_micros(priority: datetime) -> int:
+        if priority.tzinfo is None:
+            priority = priority.replace(tzinfo=timezone.utc)
+        delta = priority - EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+    @staticmethod
+    def _to_datetime(micros: int) -> datetime:
+        return EPOCH + timedelta(microseconds=micros)
+
+    def _add(self, priority: datetime, value: str) -> None:
+        if len(value.encode("utf-8")) > self.id_size:
+            raise ValueError(f"Id '{value}' is longer than {self.id_size} bytes")
+
+        micros = self._to_micros(priority)
+        slot = self.positions.get(value)
+        if slot is not None:
+            # Upsert: move the queued record to its new priority. Sifting it in place
+            # would overwrite its only copy first; appending the new record and then
+            # removing the old slot keeps the id on disk throughout (recovery keeps the
+            # newer record if both survive)
+            if self._read(slot)[0] == micros:
+                return
+            self._append((micros, self.seq, value))
+            self.seq += 1
+            self._remove_slot(slot)
+            return
+
+        record = (micros, self.seq, value)
+        self.seq += 1
+        self._append(record)
+        self._sift_up(self.count - 1, record)
+
+    def _commit(self) -> None:
+        self._write_header(clean=False)
+        self._flush()
+
+    # ------------------------------------------------------------------ public API
+
+    def push(self, priority: datetime, value: str) -> None:
+        """Add an id with the given priority, or move it if it is already queued."""
+        with self.lock:
+            self._add(priority, value)
+            self._commit()
+
+    def push_many(self, items: Iterable[Tuple[datetime, str]]) -> int:
+        """Add several (priority, id) items with a single flush."""
+        with self.lock:
+            count = 0
+            for priority, value in items:
+                self._add(priority, value)
+                count += 1
+            if count:
+                self._commit()
+            return count
+
+    def _take_slot(self, slot: int, lease_timeout: Optional[float]) -> Tuple[int, int, str]:
+        """Remove the record at slot, or move it to its lease deadline when leasing."""
+        if lease_timeout is None:
+            record = self._remove_slot(slot)
+            self.leases.pop(record[2], None)
+            return record
+        record = self._read(slot)
+        deadline = self._to_micros(datetime.now(timezone.utc) + timedelta(seconds=lease_timeout))
+        self._add(self._to_datetime(deadline), record[2])
+        self.leases[record[2]] = deadline
+        return record
+
+    def pop(self, lease_timeout: Optional[float] = None) -> Optional[Tuple[datetime, str]]:
+        """Remove and return the earliest item. With lease_timeout it comes back unless acked in time."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            micros, _, value = self._take_slot(0, lease_timeout)
+            self._commit()
+            return (self._to_datetime(micros), value)
+
+    def pop_due(self, until: datetime, max_items: Optional[int] = None,
+                lease_timeout: Optional[float] = None) -> List[Tuple[datetime, str]]:
+        """Remove and return every item with priority <= until (at most max_items) with a single flush."""
+        with self.lock:
+            limit = self._to_micros(until)
+            due = []
+            taken = set()
+            while self.count and (max_items is None or len(due) < max_items):
+                micros, _, value = self._read(0)
+                # A leased item stays in the heap, so stop once it comes round again
+                if micros > limit or value in taken:
+                    break
+                micros, _, value = self._take_slot(0, lease_timeout)
+                taken.add(value)
+                due.append((self._to_datetime(micros), value))
+            if due:
+                self._commit()
+            return due
+
+    def claim(self, key: str, lease_timeout: Optional[float] = None) -> Optional[Tuple[datetime, str]]:
+        """Remove the queued id and return it, leased when lease_timeout is given."""
+        claimed = self.claim_many([key], lease_timeout)
+        return claimed[0] if claimed else None
+
+    def claim_many(self, keys: Iterable[str], lease_timeout: Optional[float] = None) -> List[Tuple[datetime, str]]:
+        """Remove the queued ids with a single flush, leasing them when lease_timeout is given."""
+        with self.lock:
+            claimed = []
+            for key in keys:
+                slot = self.positions.get(key)
+                if slot is None:
+                    continue
+                micros, _, value = self._take_slot(slot, lease_timeout)
+                claimed.append((self._to_datetime(micros), value))
+            if claimed:
+                self._commit()
+            return claimed
+
+    def ack(self, key: str) -> bool:
+        """Finish a leased item. Returns False if key holds no lease."""
+        with self.lock:
+            deadline = self.leases.pop(key, None)
+            if deadline is None:
+                return False
+            slot = self.positions.get(key)
+            # Leave it queued if it was pushed again while in flight
+            if slot is not None and self._read(slot)[0] == deadline:
+                self._remove_slot(slot)
+                self._commit()
+            return True
+
+    def in_flight(self) -> int:
+        with self.lock:
+            return len(self.leases)
+
+    def peek(self) -> Optional[Tuple[datetime, str]]:
+        """Look at the earliest item without removing it."""
+        with self.lock:
+            if self.count == 0:
+                return None
+            micros, _, value = self._read(0)
+            return (self._to_datetime(micros), value)
+
+    def cancel(self, key: str) -> bool:
+        """Remove the queued id. Returns False if it was not queued."""
+        with self.lock:
+            self.leases.pop(key, None)
+            slot = self.positions.get(key)
+            if slot is None:
+                return False
+            self._remove_slot(slot)
+            self._commit()
+            return True
+
+    def priority_of(self, key: str) -> Optional[datetime]:
+        """Return the priority the id is queued with, or None."""
+        with self.lock:
+            slot = self.positions.get(key)
+            if slot is None:
+                return None
+            return self._to_datetime(self._read(slot)[0])
+
+    def _leased_count(self) -> int:
+        """Records in the heap only because of a lease (not pushed again while in flight)."""
+        leased = 0
+        for key, deadline in self.leases.items():
+            slot = self.positions.get(key)
+            if slot is not None and self._read(slot)[0] == deadline:
+                leased += 1
+        return leased
+
+    def is_empty(self) -> bool:
+        """Whether nothing is queued; leased items do not count, as in FilePriorityQueue."""
+        with self.lock:
+            return self.count == self._leased_count()
+
+    def size(self) -> int:
+        """Number of queued items; leased items do not count, as in FilePriorityQueue."""
+        with self.lock:
+            return self.count - self._leased_count()
+
+    def clear(self) -> None:
+        """Remove all items from the queue."""
+        with self.lock:
+            self.count = 0
+            self.positions = {}
+            self.leases = {}
+            self._commit()
+
+    def checkpoint(self) -> None:
+        """Flush the file and mark it cleanly written."""
+        with self.lock:
+            self._write_header(clean=True)
+            self._mm.flush()
+            # Mutations after this point make the file dirty again
+            self._write_header(clean=False)
+
+    def close(self) -> None:
+        with self.lock:
+            if self._mm.closed:
+                return
+            self._write_header(clean=True)
+            self._mm.flush()
+            self._mm.close()
+            os.close(self._fd)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
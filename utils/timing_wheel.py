@@ -0,0 +1,126 @@
+import math
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Generic, Hashable, List, Optional, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+
+
+class TimingWheel(Generic[K]):
+    """A keyed two-level timing wheel (seconds and minutes) for items due within a short horizon.
+
+    schedule, cancel and the expiry of each item are O(1): an item sits in the bucket of
+    its due second, or of its due minute until that minute starts and it cascades down
+    into the seconds wheel. Items are never returned before their due time. Items due
+    beyond the horizon are rejected, so callers keep those in a durable queue only.
+    """
+
+    def __init__(self, now: Optional[datetime] = None, minutes: int = 60):
+        self.minutes_count = minutes
+        self.lock = threading.Lock()
+
+        # Current tick in whole seconds since the epoch; everything up to it has expired
+        self.current = self._to_tick(now or datetime.now(timezone.utc), ceil=False)
+
+        self.seconds: List[Dict[K, datetime]] = [{} for _ in range(60)]
+        self.minutes: List[Dict[K, datetime]] = [{} for _ in range(minutes)]
+        # Scheduled when already due; returned by the next advance()
+        self.ready: Dict[K, datetime] = {}
+        # key -> the bucket holding it
+        self.locations: Dict[K, Dict[K, datetime]] = {}
+
+    @property
+    def horizon(self) -> timedelta:
+        return timedelta(minutes=self.minutes_count)
+
+    @staticmethod
+    def _to_tick(moment: datetime, ceil: bool = True) -> int:
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        timestamp = moment.timestamp()
+        # Due times round up so nothing fires early
+        return math.ceil(timestamp) if ceil else math.floor(timestamp)
+
+    def _bucket_for(self, tick: int) -> Optional[Dict[K, datetime]]:
+        delta = tick - self.current
+        if delta <= 0:
+            return self.ready
+        if delta < 60:
+            return self.seconds[tick % 60]
+        if delta < self.minutes_count * 60:
+            return self.minutes[(tick // 60) % self.minutes_count]
+        return None
+
+    def _unlink(self, key: K) -> Optional[datetime]:
+        bucket = self.locations.pop(key, None)
+        if bucket is None:
+            return None
+        return bucket.pop(key, None)
+
+    def schedule(self, key: K, due: datetime) -> bool:
+        """Schedule key, moving it if it is already scheduled. Returns False if due is beyond the horizon."""
+        with self.lock:
+            self._unlink(key)
+            bucket = self._bucket_for(self._to_tick(due))
+            if bucket is None:
+                return False
+            bucket[key] = due
+            self.locations[key] = bucket
+            return True
+
+    def cancel(self, key: K) -> bool:
+        with self.lock:
+            return self._unlink(key) is not None
+
+    def due_of(self, key: K) -> Optional[datetime]:
+        with self.lock:
+            bucket = self.locations.get(key)
+            return bucket.get(key) if bucket is not None else None
+
+    def _drain(self, bucket: Dict[K, datetime], expired: List[K]) -> None:
+        for key in bucket:
+            del self.locations[key]
+            expired.append(key)
+        bucket.clear()
+
+    def advance(self, now: Optional[datetime] = None) -> List[K]:
+        """Move the wheel to now and return the keys that expired, in due-second order."""
+        with self.lock:
+            target = self._to_tick(now or datetime.now(timezone.utc), ceil=False)
+            expired: List[K] = []
+            self._drain(self.ready, expired)
+
+            if target - self.current >= self.minutes_count * 60:
+                # Slept past the whole horizon: everything is due
+                remaining = [(due, key) for bucket in self.minutes + self.seconds
+                             for key, due in bucket.items()]
+                for bucket in self.minutes + self.seconds:
+                    bucket.clear()
+                self.locations.clear()
+                expired.extend(key for _, key in sorted(remaining, key=lambda item: item[0]))
+                self.current = target
+                return expired
+
+            while self.current < target:
+                self.current += 1
+                if self.current % 60 == 0:
+                    # A new minute starts: cascade its bucket into the seconds wheel
+                    minute = self.minutes[(self.current // 60) % self.minutes_count]
+                    for key, due in minute.items():
+                        bucket = self._bucket_for(self._to_tick(due))
+                        bucket[key] = due
+                        self.locations[key] = bucket
+                    minute.clear()
+                    self._drain(self.ready, expired)
+
+                self._drain(self.seconds[self.current % 60], expired)
+
+            return expired
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.locations)
+
+    def __contains__(self, key: K) -> bool:
+        with self.lock:
+            return key in self.locations
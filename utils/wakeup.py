@@ -0,0 +1,53 @@
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+
+class DeadlineWakeup:
+    """A sleep that producers can cut short by announcing an earlier deadline.
+
+    The consumer sleeps towards its next known deadline with wait(); producers call
+    notify(due) after queueing something. The consumer wakes at once when due is earlier
+    than the deadline it sleeps towards. A notification sent while the consumer is not
+    sleeping makes its next wait() return immediately, so none is lost between the
+    consumer computing its deadline and going to sleep.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Deadline of the wait in progress; None while not waiting or waiting without one
+        self.deadline: Optional[datetime] = None
+        self.waiting = False
+        self.notified = False
+
+    def notify(self, due: Optional[datetime] = None) -> None:
+        """Wake the consumer if due (None means "now / unknown") is before its deadline."""
+        with self.condition:
+            if not self.waiting or due is None or self.deadline is None or due < self.deadline:
+                self.notified = True
+                self.condition.notify_all()
+
+    def wait(self, deadline: Optional[datetime] = None, max_wait: Optional[float] = None) -> bool:
+        """Sleep until deadline, max_wait seconds or a notification. Returns True if notified."""
+        with self.condition:
+            if not self.notified:
+                self.waiting = True
+                self.deadline = deadline
+                give_up = time.monotonic() + max_wait if max_wait is not None else None
+                try:
+                    while not self.notified:
+                        timeout = None
+                        if deadline is not None:
+                            timeout = (deadline - datetime.now(timezone.utc)).total_seconds()
+                        if give_up is not None:
+                            left = give_up - time.monotonic()
+                            timeout = left if timeout is None else min(timeout, left)
+                        if timeout is not None and timeout <= 0:
+                            return False
+                        self.condition.wait(timeout)
+                finally:
+                    self.waiting = False
+                    self.deadline = None
+            self.notified = False
+            return True
@@ -0,0 +1,158 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets; the last one catches everything
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, math.inf)
+STATS_FILENAME = "worker_stats.json"
+
+
+class Histogram:
+    """Fixed-bucket histogram; percentiles are reported as the upper bound of their bucket."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = None
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+        self.max = value if self.max is None else max(self.max, value)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = p * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                # The overflow bucket has no finite bound; the largest value seen is one
+                return bound if bound != math.inf else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {("+Inf" if bound == math.inf else str(bound)): count
+                        for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class WorkerMetrics:
+    """Counters, gauges and latency histograms of one worker process, written to a JSON file.
+
+    start_writer() replaces the file atomically every write_interval seconds, so another
+    process (e.g. the API) can read it at any time with read_worker_stats().
+    """
+
+    def __init__(self, path: str, worker_id: str, write_interval: float = 10.0):
+        self.path = path
+        self.worker_id = worker_id
+        self.write_interval = write_interval
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+
+    def inc(self, name: str, amount: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Observe the duration of the with block under name, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "worker": self.worker_id,
+                "pid": os.getpid(),
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+                "uptime_seconds": time.time() - self.started,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "histograms": {name: histogram.snapshot()
+                               for name, histogram in self.histograms.items()},
+            }
+
+    def write(self) -> None:
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temp_path, self.path)
+
+    def start_writer(self, collect: Optional[Callable[[], None]] = None) -> threading.Thread:
+        """Write the stats file every write_interval seconds on a daemon thread.
+
+        collect(), if given, runs before each write to refresh gauges such as queue depth.
+        """
+        def run():
+            while True:
+                try:
+                    if collect is not None:
+                        collect()
+                    self.write()
+                except Exception:
+                    # Metrics must never take the worker down; the next round tries again
+                    pass
+                time.sleep(self.write_interval)
+
+        thread = threading.Thread(target=run, name="worker-metrics", daemon=True)
+        thread.start()
+        return thread
+
+
+def read_worker_stats(directory: str, stale_after: float = 60.0) -> List[dict]:
+    """Read every worker's stats file under directory (partition workers use subdirectories).
+
+    Each entry gets "stale": True when its file was not rewritten in stale_after seconds,
+    which usually means the worker is not running any more.
+    """
+    stats = []
+    for root, _, filenames in os.walk(directory):
+        if STATS_FILENAME not in filenames:
+            continue
+        path = os.path.join(root, STATS_FILENAME)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+            entry["stale"] = time.time() - os.path.getmtime(path) > stale_after
+        except (OSError, ValueError):
+            continue
+        stats.append(entry)
+    return stats